@@ -111,6 +111,8 @@ class ConfigurationWizard:
 
     # how long to wait for a reply before asking user to press button again in seconds
     _timeout = 40
+    # how old in seconds a reply the Message Bridge has cached may be to answer a query
+    _cacheAge = 300
     _devIDInputs = []
     _encryptionKeyInput = 0
     _lastDCR = []
@@ -293,6 +295,7 @@ class ConfigurationWizard:
 
         UDPSendSocket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
         UDPSendSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        multicastGroup = self._UDPSetupMulticastSend(UDPSendSocket)
 
         sendPort = int(self.config.get('UDP', 'send_port'))
 
@@ -308,7 +311,15 @@ class ConfigurationWizard:
                 pass
             else:
                 self.logger.debug("tUDPSend: Got json to send: {}".format(message))
-                if self.config.getboolean('UDP', 'use_local_only'):
+                if multicastGroup:
+                    try:
+                        UDPSendSocket.sendto(message, (multicastGroup, sendPort))
+                        self.logger.debug("tUDPSend: Put message out via UDP multicast")
+                    except socket.error as msg:
+                        self.logger.warn("tUDPSend: Failed to send via UDP multicast. Error code : {} Message: {}".format(msg[0], msg[1]))
+                    else:
+                        self.qJSONDebug.put([message, "TX"])
+                elif self.config.getboolean('UDP', 'use_local_only'):
                     try:
                         UDPSendSocket.sendto(message, ('127.0.0.255', sendPort))
                         self.logger.debug("tUDPSend: Put message out via UDP to local only")
@@ -345,6 +356,35 @@ class ConfigurationWizard:
             self.logger.exception("tUDPSend: Failed to close socket")
         return
 
+    def _UDPJoinMulticast(self, UDPListenSocket):
+        """ Join the Message Bridge multicast group when delivery is multicast
+        """
+        if self.config.get('UDP', 'delivery').lower() != "multicast":
+            return
+        group = self.config.get('UDP', 'multicast_group')
+        try:
+            UDPListenSocket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                                       socket.inet_aton(group) + socket.inet_aton(self.config.get('UDP', 'multicast_interface')))
+        except socket.error as msg:
+            self.logger.error("tUDPListen: Failed to join multicast group {}. Error code : {} Message : {}".format(group, msg[0], msg[1]))
+        else:
+            self.logger.info("tUDPListen: Joined multicast group {}".format(group))
+
+    def _UDPSetupMulticastSend(self, UDPSendSocket):
+        """ Set the multicast TTL and interface when delivery is multicast
+            Returns the group to send to, None when broadcasting
+        """
+        if self.config.get('UDP', 'delivery').lower() != "multicast":
+            return None
+        try:
+            UDPSendSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.config.getint('UDP', 'multicast_ttl'))
+            UDPSendSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            UDPSendSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                                     socket.inet_aton(self.config.get('UDP', 'multicast_interface')))
+        except socket.error as msg:
+            self.logger.error("tUDPSend: Failed to setup multicast. Error code : {} Message : {}".format(msg[0], msg[1]))
+        return self.config.get('UDP', 'multicast_group')
+
     # MARK: - UDP listen
     def _initUDPListenThread(self):
         """ Start the UDP Listen thread and queues
@@ -383,6 +423,7 @@ class ConfigurationWizard:
         except socket.error:
             self.logger.exception("tUDPListen: Failed to bind port")
             return
+        self._UDPJoinMulticast(UDPListenSocket)
         UDPListenSocket.setblocking(0)
 
         self.tUDPListenStarted.set()
@@ -1428,6 +1469,7 @@ class ConfigurationWizard:
                        "timeout": self.config.get('DCR', 'timeout'),
                        "keepAwake":self._keepAwake,
                        "devType": self.device['DTY'],
+                       "progress": 1,
                        "toQuery": query
                        }
               }
@@ -1454,6 +1496,8 @@ class ConfigurationWizard:
                     "timeout": self.config.get('DCR', 'timeout'),
                     "keepAwake":self._keepAwake,
                     "devType": self.device['DTY'],
+                    "progress": 1,
+                    "pipeline": self._pipelineDepth(),
                     "toQuery": query
                     }
                     }
@@ -1462,6 +1506,14 @@ class ConfigurationWizard:
         self._lastDCR.append(dcr)
         self._sendRequest(dcr)
 
+    def _pipelineDepth(self):
+        """ How many queries the Message Bridge may send the device at once
+            based on its APVER and the Pipelining entry of the language file
+        """
+        if self.device.get('APVER', 0) >= self._pipelining.get('ProtocolFrom', float('inf')):
+            return self._pipelining.get('Depth', 1)
+        return 1
+
     def _entryAppend(self, query, command, value):
         """
             The following are use to append the correct Language of Things commands
@@ -1570,6 +1622,7 @@ class ConfigurationWizard:
                "data":{
                        "id": str(uuid.uuid4()),
                        "timeout": 30,   # short time out
+                       "cache": self._cacheAge,
                        "toQuery": query
                        }
               }
@@ -1803,9 +1856,13 @@ class ConfigurationWizard:
                     "timeout": 60,
                     "keepAwake":self._keepAwake,
                     "devType": self.device['DTY'],
+                    "cache": self._cacheAge,
                     "toQuery": query
                     }
                 }
+        if self.device['devID'] not in ("", "??"):
+            # lets the Message Bridge answer from its cache without waiting for the device
+            dcr['data']['devID'] = self.device['devID']
 
         self._lastDCR.append(dcr)
         self._sendRequest(dcr)
@@ -1938,6 +1995,11 @@ class ConfigurationWizard:
                     # added this to cope with receiving multiple replies
                     # e.g. if there are multiple network interfaces active
                     self.master.after(500, self._replyCheck)
+                elif json['data'].get('state') == "PARTIAL":
+                    # the device is answering, give it the full timeout again from now
+                    self.logger.debug("partial reply, got: {}".format(json['data']['replies'].keys()))
+                    self._starttime = time()
+                    self.master.after(100, self._replyCheck)
                 else:
                     self.logger.debug("reply is expected ID: {}".format(json['data']['id']))
                     # close wait diag and return reply
@@ -2191,6 +2253,7 @@ class ConfigurationWizard:
             self._genericCommands = json.loads(read_data)['Generic Commands']
             self._cyclicCommands = json.loads(read_data)['Cyclic Commands']
             self._readingPeriods = json.loads(read_data)['Reading Periods']
+            self._pipelining = json.loads(read_data).get('Pipelining', {})
     
         except IOError:
             # TODO: better fail condition
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Binary UDP listener
+
+    listen for the Message Bridge binary format on port 50143
+    set binary_port = 50143 in the [UDP] section of MessageBridge.cfg
+    and filters by give ID and network if passed on the command line
+
+    usage
+    $ python binaryUDPListen.py
+    or
+    $ ./binaryUDPListen.py
+
+    Optionally
+    $ ./binaryUDPListen.py MA Serial
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import sys
+import socket
+import wirelessThingsBinary
+
+FROM_PORT = 50143
+# set to the Message Bridge multicast_group (eg "239.255.50.140") if it uses multicast delivery
+MULTICAST_GROUP = None
+
+sock = socket.socket(socket.AF_INET, # Internet
+              socket.SOCK_DGRAM) # UDP
+
+sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+if sys.platform == 'darwin':
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+sock.bind(('', FROM_PORT))
+if MULTICAST_GROUP:
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                    socket.inet_aton(MULTICAST_GROUP) + socket.inet_aton('0.0.0.0'))
+
+while True:
+    data, addr = sock.recvfrom(1024*8)
+    try:
+        messages = wirelessThingsBinary.decode(data)
+    except ValueError as e:
+        print("Invalid datagram from {}: {}".format(addr, e))
+        continue
+    for message in messages:
+        if message['type'] != 'WirelessMessage':
+            print("Got {} from address {}".format(message['type'], addr))
+            continue
+        if len(sys.argv) == 3 and message['network'] != sys.argv[2]:
+            continue
+        if len(sys.argv) >= 2 and message['id'] != sys.argv[1]:
+            continue
+        print("Device: {} Data: {} Time(ms): {} Network: {}".format(message['id'], message['data'][0], message['epochMs'], message['network']))
@@ -36,6 +36,8 @@ import json
 
 FROM_PORT = 50140
 TO_PORT = 50141
+# set to the Message Bridge multicast_group (eg "239.255.50.140") if it uses multicast delivery
+MULTICAST_GROUP = None
 
 sock = socket.socket(socket.AF_INET, # Internet
               socket.SOCK_DGRAM) # UDP
@@ -46,20 +48,31 @@ if sys.platform == 'darwin':
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
 sock.bind(('', FROM_PORT))
+if MULTICAST_GROUP:
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                    socket.inet_aton(MULTICAST_GROUP) + socket.inet_aton('0.0.0.0'))
 lasttime = time()
 
+def printMessage(pydata):
+    global lasttime
+    if len(sys.argv) == 3:
+        if pydata['network'] != sys.argv[2]:
+            return
+    if len(sys.argv) >= 2:
+        if pydata['id'] == sys.argv[1]:
+            now = time()
+            timediff = now - lasttime
+            lasttime = now
+            print("Device: {} Data: {} Time: {} Network: {} Timesince: {}".format(pydata['id'], pydata['data'][0], pydata['timestamp'], pydata['network'], timediff))
+    else:
+        print("Device: {} Data: {}".format(pydata['id'], pydata['data'][0]))
+
 while True:
     data, addr = sock.recvfrom(1024*8)
     pydata = json.loads(data)
     if pydata['type'] == 'WirelessMessage':
-        if len(sys.argv) == 3:
-            if pydata['network'] != sys.argv[2]:
-                continue
-        if len(sys.argv) >= 2:
-            if pydata['id'] == sys.argv[1]:
-		now = time()
-                timediff = now - lasttime
-		lasttime = now
-                print("Device: {} Data: {} Time: {} Network: {} Timesince: {}".format(pydata['id'], pydata['data'][0], pydata['timestamp'], pydata['network'], timediff))
-        else:
-            print("Device: {} Data: {}".format(pydata['id'], pydata['data'][0]))
+        printMessage(pydata)
+    elif pydata['type'] == 'WirelessMessageBatch':
+        # Message Bridge batch_mode, several WirelessMessage's in one datagram
+        for message in pydata['messages']:
+            printMessage(message)
@@ -26,6 +26,8 @@ import socket
 
 FROM_PORT = 50140
 TO_PORT = 50141
+# set to the Message Bridge multicast_group (eg "239.255.50.140") if it uses multicast delivery
+MULTICAST_GROUP = None
 
 sock = socket.socket(socket.AF_INET, # Internet
               socket.SOCK_DGRAM) # UDP
@@ -36,6 +38,9 @@ if sys.platform == 'darwin':
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
 sock.bind(('', FROM_PORT))
+if MULTICAST_GROUP:
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                    socket.inet_aton(MULTICAST_GROUP) + socket.inet_aton('0.0.0.0'))
 
 while True:
     data, addr = sock.recvfrom(1024)
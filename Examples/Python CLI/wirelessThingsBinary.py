@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Decoder for the Message Bridge binary format
+
+    Copy this file next to your own program, it only needs the standard
+    library. The Message Bridge sends the binary format to [UDP] binary_port
+    and to subscribers that asked for "format": "binary", it also accepts it
+    on its listen port.
+
+    A datagram is the version byte 0xA1 followed by records
+    0x01 WirelessMessage: 8 byte epoch milliseconds, 1 byte network length,
+         network, 2 byte ID, 1 byte count then 1 byte length + command for each
+    0x02 JSON: 2 byte length then the JSON text
+    all numbers are big endian
+
+    usage
+    import wirelessThingsBinary
+    for message in wirelessThingsBinary.decode(data):
+        print(message['id'], message['data'], message['epochMs'])
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import json
+import struct
+from time import time
+
+VERSION = b'\xa1'
+WIRELESS_MESSAGE = 1
+JSON = 2
+
+_header = struct.Struct('>QB')
+_length = struct.Struct('>H')
+
+def isBinary(data):
+    return data[:1] == VERSION
+
+def decode(data):
+    """ List of the messages in a datagram from the Message Bridge
+        WirelessMessage's are dicts with type, network, id, data and epochMs
+        anything else is the dict from its JSON
+        raises ValueError if data is not a valid binary datagram
+    """
+    if not isBinary(data):
+        raise ValueError("Not a binary datagram")
+    data = bytearray(data)
+    messages = []
+    position = 1
+    try:
+        while position < len(data):
+            recordType = data[position]
+            position += 1
+            if recordType == WIRELESS_MESSAGE:
+                (epochMs, length) = _header.unpack_from(bytes(data), position)
+                position += _header.size
+                network = data[position:position + length].decode('utf-8')
+                deviceID = data[position + length:position + length + 2].decode('utf-8')
+                count = data[position + length + 2]
+                position += length + 3
+                commands = []
+                for n in range(count):
+                    length = data[position]
+                    commands.append(data[position + 1:position + 1 + length].decode('utf-8'))
+                    position += 1 + length
+                if position > len(data) or len(deviceID) != 2:
+                    raise ValueError("Truncated WirelessMessage record")
+                messages.append({'type': "WirelessMessage",
+                                 'network': network,
+                                 'id': deviceID,
+                                 'data': commands,
+                                 'epochMs': epochMs})
+            elif recordType == JSON:
+                (length,) = _length.unpack_from(bytes(data), position)
+                position += _length.size
+                if position + length > len(data):
+                    raise ValueError("Truncated JSON record")
+                messages.append(json.loads(data[position:position + length].decode('utf-8')))
+                position += length
+            else:
+                raise ValueError("Unknown record type {}".format(recordType))
+    except (struct.error, IndexError):
+        raise ValueError("Truncated record")
+    return messages
+
+def encodeWirelessMessage(network, deviceID, commands, epochMs=None):
+    """ A binary datagram holding one WirelessMessage to send to the Message Bridge
+    """
+    if epochMs is None:
+        epochMs = int(time() * 1000)
+    network = network.encode('utf-8')
+    record = bytearray(VERSION)
+    record.append(WIRELESS_MESSAGE)
+    record += _header.pack(epochMs, len(network))
+    record += network
+    record += deviceID.encode('utf-8')
+    record.append(len(commands))
+    for command in commands:
+        command = command.encode('utf-8')
+        record.append(len(command))
+        record += command
+    return bytes(record)
@@ -942,6 +942,7 @@ class LaunchPad:
         except socket.error:
             self.logger.error("tUDPListen: Failed to bind port, Exiting")
 
+        self._UDPJoinMulticast(UDPListenSocket)
         UDPListenSocket.setblocking(0)
 
         self.logger.debug("tUDPListen: listening")
@@ -972,6 +973,35 @@ class LaunchPad:
             self.logger.error("tUDPListen: Failed to close socket")
         return
 
+    def _UDPJoinMulticast(self, UDPListenSocket):
+        """ Join the Message Bridge multicast group when delivery is multicast
+        """
+        if self.config.get('UDP', 'delivery').lower() != "multicast":
+            return
+        group = self.config.get('UDP', 'multicast_group')
+        try:
+            UDPListenSocket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                                       socket.inet_aton(group) + socket.inet_aton(self.config.get('UDP', 'multicast_interface')))
+        except socket.error as msg:
+            self.logger.error("tUDPListen: Failed to join multicast group {}. Error code : {} Message : {}".format(group, msg[0], msg[1]))
+        else:
+            self.logger.info("tUDPListen: Joined multicast group {}".format(group))
+
+    def _UDPSetupMulticastSend(self, UDPSendSocket):
+        """ Set the multicast TTL and interface when delivery is multicast
+            Returns the group to send to, None when broadcasting
+        """
+        if self.config.get('UDP', 'delivery').lower() != "multicast":
+            return None
+        try:
+            UDPSendSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.config.getint('UDP', 'multicast_ttl'))
+            UDPSendSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            UDPSendSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                                     socket.inet_aton(self.config.get('UDP', 'multicast_interface')))
+        except socket.error as msg:
+            self.logger.error("tUDPSend: Failed to setup multicast. Error code : {} Message : {}".format(msg[0], msg[1]))
+        return self.config.get('UDP', 'multicast_group')
+
     def _updateMessageBridgeDetailsFromJSON(self, jsonin, address):
         # update Message Bridge entry in our list
         # TODO: this needs to be a intelligent merge not just overwrite
@@ -1043,6 +1073,7 @@ class LaunchPad:
 
         UDPSendSocket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
         UDPSendSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        multicastGroup = self._UDPSetupMulticastSend(UDPSendSocket)
 
         sendPort = int(self.config.get('UDP', 'send_port'))
 
@@ -1057,7 +1088,7 @@ class LaunchPad:
             else:
                 self.logger.debug("tUDPSend: Got json to send: {}".format(message))
                 try:
-                    UDPSendSocket.sendto(message, ('<broadcast>', sendPort))
+                    UDPSendSocket.sendto(message, (multicastGroup or '<broadcast>', sendPort))
                     self.logger.debug("tUDPSend: Put message out via UDP")
                 except socket.error as msg:
                     if msg[0] == 101:
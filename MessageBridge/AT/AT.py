@@ -25,6 +25,9 @@ import serial
 import logging
 
 class AT():
+    """ serialHandle can be any transport with the pySerial Serial interface
+        (see Transport.makeTransport), a new serial.Serial is used if none is given
+    """
 
     _inATMode = False
 
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" DCR Batch
+    Configures a list of devices through DCR sessions and reports on them all
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import logging
+from collections import deque
+
+class DCRBatch():
+    """ One DeviceConfigurationBatch
+
+        Each entry of data.devices is a device to configure, picked out by
+        devType and/or devID, with the toQuery to send it and optionally
+        setENC, pipeline, timeout and cache as in a DeviceConfigurationRequest.
+        The batch's own timeout and cache apply to entries without them.
+        Every entry becomes a DeviceConfigurationRequest started through
+        submit(request, reply), at most concurrency of them at a time, and
+        waits for its device to send CONFIGME. An entry that fails is put to
+        the back of the queue and tried again until it has had attempts goes.
+
+        Once every entry has finished report(request, state) is called with
+        data.results holding the state, attempts and replies of each entry,
+        in the same order as data.devices, and the state PASS if all of them
+        passed or FAIL if not. With "progress": 1 the report is also made
+        with the state PARTIAL each time an entry finishes.
+
+        The callbacks are made from the DCR engine so need no locking of
+        their own.
+    """
+
+    PASS = "PASS"
+    PARTIAL = "PARTIAL"
+    FAIL = "FAIL"
+    INVALID = "INVALID"
+
+    # entry fields passed on to its DeviceConfigurationRequest
+    _requestFields = ('devType', 'devID', 'toQuery', 'setENC', 'pipeline', 'timeout', 'cache')
+    # batch fields used for entries that do not give their own
+    _defaultFields = ('timeout', 'cache')
+
+    def __init__(self, request, submit, report, concurrency, logger=None):
+        self.request = request
+        self._submit = submit
+        self._report = report
+        self.logger = logger or logging.getLogger('DCR Batch')
+
+        data = request['data']
+        # the report carries the results instead of the devices
+        self._devices = data.pop('devices', None)
+        if not isinstance(self._devices, list):
+            self._devices = []
+        self.concurrency = max(1, int(data.get('concurrency', concurrency)))
+        self.attempts = max(1, int(data.get('attempts', 1)))
+        self.progress = data.get('progress', 0) == 1
+
+        self.results = []
+        self._queue = deque()
+        self._running = 0
+        self._starting = False
+        for (index, device) in enumerate(self._devices):
+            result = {'state': None, 'attempts': 0}
+            if isinstance(device, dict):
+                for field in ('devType', 'devID'):
+                    if device.has_key(field):
+                        result[field] = device[field]
+            if self._valid(device):
+                self._queue.append(index)
+            else:
+                result['state'] = self.INVALID
+            self.results.append(result)
+        data['results'] = self.results
+        data['passed'] = 0
+        data['failed'] = len(self.results) - len(self._queue)
+
+    def _valid(self, device):
+        """ An entry needs a toQuery of commands
+        """
+        if not isinstance(device, dict) or not isinstance(device.get('toQuery'), list) or not device['toQuery']:
+            return False
+        return all(isinstance(query, dict) and isinstance(query.get('command'), basestring)
+                   for query in device['toQuery'])
+
+    def start(self):
+        self.logger.debug("tDCR: Starting batch of {} devices, {} at a time".format(len(self.results), self.concurrency))
+        self._next()
+
+    def _next(self):
+        """ Start waiting entries up to the concurrency limit, report if all are done
+        """
+        if self._starting:
+            # an entry answered from the cache as it was started, the loop below carries on
+            return
+        self._starting = True
+        try:
+            while self._running < self.concurrency and self._queue:
+                self._start(self._queue.popleft())
+        finally:
+            self._starting = False
+        if not self._running and not self._queue:
+            data = self.request['data']
+            self._report(self.request, self.PASS if data['passed'] == len(self.results) else self.FAIL)
+
+    def _start(self, index):
+        device = self._devices[index]
+        self.results[index]['attempts'] += 1
+        data = dict((field, device[field]) for field in self._requestFields if device.has_key(field))
+        data['id'] = "{}.{}".format(self.request['data'].get('id', ""), index)
+        for field in self._defaultFields:
+            if not data.has_key(field) and self.request['data'].has_key(field):
+                data[field] = self.request['data'][field]
+        dcr = {'type': "DeviceConfigurationRequest",
+               'network': self.request.get('network'),
+               'data': data
+               }
+        self._running += 1
+        self._submit(dcr, lambda request, state: self._finished(index, request, state))
+
+    def _finished(self, index, request, state):
+        if state == self.PARTIAL:
+            return
+        self._running -= 1
+        result = self.results[index]
+        if state != self.PASS and result['attempts'] < self.attempts:
+            self.logger.debug("tDCR: Batch entry {} {}, trying again".format(index, state))
+            self._queue.append(index)
+        else:
+            result['state'] = state
+            result['replies'] = request['data'].get('replies', {})
+            data = self.request['data']
+            if state == self.PASS:
+                data['passed'] += 1
+            else:
+                data['failed'] += 1
+            if self.progress and (self._running or self._queue):
+                self._report(self.request, self.PARTIAL)
+        self._next()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" DCR Cache
+    The last configuration replies seen from each device
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import threading
+from time import time, strftime, gmtime
+
+class DCRCache():
+    """ Replies from DCR sessions by device ID then command, each kept with
+        the time it was seen and the id of the request it came from
+
+        Only replies carrying a value are kept, so actions such as REBOOT or
+        CYCLE that echo their command back are never answered from here.
+        "??" is not a device ID to keep replies under, it is shared by every
+        device that has not been given one.
+    """
+
+    def __init__(self):
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cacheable(deviceID):
+        return bool(deviceID) and deviceID != "??"
+
+    def learn(self, deviceID, replies, source, previousID=None):
+        """ Keep replies, a DCR replies dict, for deviceID
+            previousID is the ID the device had before the session changed it
+        """
+        if not self.cacheable(deviceID):
+            return
+        now = time()
+        with self._lock:
+            entry = self._devices.setdefault(deviceID, {})
+            if previousID and previousID != deviceID:
+                # same device under its new ID
+                entry.update(self._devices.pop(previousID, {}))
+            for (command, reply) in replies.items():
+                if reply.has_key('cached') or not reply.get('reply'):
+                    continue
+                entry[command] = {'reply': reply['reply'],
+                                  'timestamp': now,
+                                  'source': source
+                                  }
+
+    def answer(self, deviceID, command, maxAge):
+        """ A DCR replies entry for command from deviceID's cached reply if it
+            is no older than maxAge seconds, or None
+        """
+        with self._lock:
+            cached = self._devices.get(deviceID, {}).get(command)
+        if cached is None or time() - cached['timestamp'] > maxAge:
+            return None
+        return {'value': "",
+                'reply': cached['reply'],
+                'cached': self._timestamp(cached['timestamp']),
+                'source': cached['source']
+                }
+
+    def toDict(self):
+        """ The cache for the dcrCache MessageBridge request
+        """
+        with self._lock:
+            return dict((deviceID, dict((command, {'reply': cached['reply'],
+                                                   'timestamp': self._timestamp(cached['timestamp']),
+                                                   'source': cached['source']})
+                                        for (command, cached) in entry.items()))
+                        for (deviceID, entry) in self._devices.items())
+
+    @staticmethod
+    def _timestamp(seconds):
+        return strftime("%d %b %Y %H:%M:%S +0000", gmtime(seconds))
@@ -0,0 +1,454 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" DCR Engine
+    Runs DeviceConfigurationRequest's for one radio as independent sessions
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import re
+import heapq
+import itertools
+import threading
+import logging
+from time import time
+from DCRCache import DCRCache
+
+class DCRSession():
+    """ One DeviceConfigurationRequest and how far it has got
+    """
+
+    def __init__(self, request, toQuery, timeout, retryCount, pipeline=1, reply=None, cache=0):
+        self.request = request
+        self.toQuery = toQuery          # the queries to send, including any added for setENC
+        self.pipeline = pipeline        # how many queries may wait for a reply at once
+        self.next = 0                   # index in toQuery of the next query to send
+        self.outstanding = []           # indexes of the queries sent and waiting for a reply, oldest first
+        self.waiting = {}               # reply key to the outstanding indexes waiting on it, oldest first
+        self.keyLengths = {}            # length of the keys in waiting to how many there are
+        self.answered = 0
+        self.sends = {}                 # index to how many times it has been sent in this window
+        self.devType = request['data'].get('devType', None)
+        self.devID = request['data'].get('devID', None)
+        # what the device that opens a window is asked to make sure it is the one we want
+        if self.devType:
+            self.check = ("DTY", self.devType)
+        elif self.devID:
+            self.check = ("CHDEVID", self.devID)
+        else:
+            self.check = None
+        self.identified = self.check is None
+        # serve read-only queries from cached replies no older than this many seconds, 0 never
+        self.cache = cache
+        # the device's ID once confirmed, without one a cache session asks CHDEVID first
+        self.deviceID = self.devID if self.check and self.check[0] == "CHDEVID" else None
+        self.lookup = bool(cache) and not self.devID
+        # the request's own queries by command, replies are stored against these
+        self.index = dict((query['command'], query) for query in request['data']['toQuery'])
+        self.progress = request['data'].get('progress', 0) == 1
+        self.timeout = timeout
+        self.retryCount = retryCount
+        self.reply = reply              # called instead of the engine's reply if set
+        self.deadline = 0
+        self.done = False
+
+    def wants(self, check):
+        """ Would this session take the device that answered check, a (command, value)
+        """
+        return self.check is None or self.check == check
+
+    def sent(self, position, key):
+        """ The query at position is waiting for a reply that starts with key
+        """
+        self.outstanding.append(position)
+        positions = self.waiting.setdefault(key, [])
+        if not positions:
+            self.keyLengths[len(key)] = self.keyLengths.get(len(key), 0) + 1
+        positions.append(position)
+
+    def replied(self, position, key):
+        """ The query at position has had its reply
+        """
+        self.outstanding.remove(position)
+        positions = self.waiting[key]
+        positions.remove(position)
+        if not positions:
+            del self.waiting[key]
+            self.keyLengths[len(key)] -= 1
+            if not self.keyLengths[len(key)]:
+                del self.keyLengths[len(key)]
+
+class DCREngine():
+    """ Keeps a session for every DeviceConfigurationRequest waiting on a
+        device and feeds them the a?? messages from the radio
+
+        Every device in configuration mode talks as ??, so the radio can
+        only hold one conversation at a time. A CONFIGME opens a window for
+        the first waiting session. If the sessions name a devType the device
+        is asked its DTY first, or CHDEVID for a devID, and the window goes to
+        the first session that wants that device, the others keep waiting for
+        their own device instead of queueing behind each other.
+
+        Each session has its own timeout held in a heap, restarted by every
+        reply. Replies are handled as configFrame() is called by the serial
+        thread or event loop, only the timeouts need waiting for, either in
+        run() on its own thread, woken through a condition variable, or as a
+        timer on the EventLoop given to attach().
+
+        A request with "pipeline": N keeps up to N queries waiting for a
+        reply at once instead of one, replies are matched to them by command
+        and a CONFIGME resends only those still missing. The last query is
+        held back until all the others are answered so a closing REBOOT or
+        CHDEVID acts on a fully configured device.
+
+        send(text) puts a?? text out over the air and returns False if it
+        could not, reply(request, state) returns a finished request. A
+        request with "progress": 1 is also returned with the state PARTIAL
+        after each reply but the last.
+
+        The replies of every session are kept in cache, a DCRCache. A request
+        with "cache": N has its queries without a value answered from replies
+        no more than N seconds old. With a devID that is done as it is
+        submitted, finishing it there and then if nothing is missing,
+        otherwise the device that opens the window is asked its CHDEVID
+        first and only the misses are sent to it.
+    """
+
+    PASS = "PASS"
+    PARTIAL = "PARTIAL"
+    FAIL_TIMEOUT = "FAIL_TIMEOUT"
+    FAIL_RETRY = "FAIL_RETRY"
+
+    _encryptionCommandMatch = re.compile('^EN[1-6]')
+
+    def __init__(self, send, reply, logger=None):
+        self._send = send
+        self._reply = reply
+        self.logger = logger or logging.getLogger('DCR Engine')
+
+        self._condition = threading.Condition()
+        self._waiting = []      # sessions without a device, oldest first
+        self._active = None     # session talking to the device that sent the last CONFIGME
+        self._timers = []       # heap of (deadline, sequence, session)
+        self._sequence = itertools.count()
+        self._loop = None
+        self._loopTimer = None
+        self.cache = DCRCache()
+
+    def attach(self, loop):
+        """ Run the timeouts on an EventLoop instead of run()
+        """
+        self._loop = loop
+
+    def busy(self):
+        """ True while a session is talking to a device
+        """
+        return self._active is not None
+
+    def pending(self):
+        """ Number of sessions not yet finished
+        """
+        with self._condition:
+            return len(self._waiting) + (1 if self._active else 0)
+
+    def submit(self, request, toQuery, timeout, retryCount, pipeline=1, reply=None, cache=0):
+        """ Start a session for request that sends toQuery to the next
+            suitable device to wake up, reply if given is called with the
+            result instead of the engine's reply
+        """
+        session = DCRSession(request, toQuery, timeout, retryCount, pipeline, reply, cache)
+        with self._condition:
+            if session.cache and session.devID:
+                self._serve(session, session.devID)
+                if not session.toQuery:
+                    self.logger.debug("tDCR: Answered all toQuery for {} from the cache".format(session.devID))
+                    self._finish(session, self.PASS)
+                    return session
+            self._waiting.append(session)
+            self._arm(session)
+        self.logger.debug("tDCR: started DCR timeout with period: {}".format(timeout))
+        return session
+
+    def synchronized(self, callback, *args):
+        """ Call callback(*args) holding the engine lock, for helpers such
+            as DCRBatch that keep their own state between sessions
+        """
+        with self._condition:
+            return callback(*args)
+
+    def configFrame(self, message):
+        """ Process the text of an a?? message from the radio
+            Returns True if a session used it, False if it was left alone
+        """
+        with self._condition:
+            session = self._active
+            if session is None:
+                if message != "CONFIGME" or not self._waiting:
+                    return False
+                session = self._active = self._waiting.pop(0)
+                session.identified = session.check is None
+                session.sends = {}
+                self.logger.debug("tDCR: CONFIGME, starting a session with {} queries".format(len(session.toQuery)))
+                self._ask(session)
+                return True
+
+            if not session.identified:
+                command = session.check[0]
+                if message.startswith(command):
+                    self._checkReply(session, (command, message[len(command):]))
+                elif message == "CONFIGME":
+                    self._ask(session)
+                return True
+
+            if session.lookup:
+                if message.startswith("CHDEVID"):
+                    self._lookup(session, message[len("CHDEVID"):])
+                elif message == "CONFIGME":
+                    self._ask(session)
+                return True
+
+            position = self._match(session, message)
+            if position is not None:
+                command = session.toQuery[position]['command']
+                if self._encryptionCommandMatch.match(command):
+                    message = command + message
+                self._store(session, command, message)
+                session.replied(position, self._replyKey(command))
+                session.answered += 1
+                if session.answered == len(session.toQuery):
+                    self.logger.debug("tDCR: Got answers for all toQuery")
+                    self._finish(session, self.PASS)
+                else:
+                    self._arm(session)
+                    if session.progress:
+                        (session.reply or self._reply)(session.request, self.PARTIAL)
+                    self.logger.debug("tDCR: Send next toQuery, {} left".format(len(session.toQuery) - session.answered))
+                    self._fill(session)
+            elif message == "CONFIGME":
+                if session.devType:
+                    # out of sync, check it is still the same device
+                    # (a devID is not checked again as the session may have changed it)
+                    self.logger.debug("tDCR: Checking DTY again before sending next toQuery")
+                    session.identified = False
+                else:
+                    self.logger.debug("tDCR: Retry {} toQuery".format(len(session.outstanding)))
+                self._ask(session)
+            return True
+
+    def run(self, stopEvent):
+        """ Expire sessions as their timeouts pass until stopEvent is set
+            and wake() is called
+        """
+        with self._condition:
+            while not stopEvent.is_set():
+                self._expire()
+                if self._timers:
+                    self._condition.wait(max(0, self._timers[0][0] - time()))
+                else:
+                    # nothing to time out, sleep until submit() or wake()
+                    self._condition.wait()
+
+    def wake(self):
+        with self._condition:
+            self._condition.notify()
+
+    def _ask(self, session):
+        """ Send a session's device the DTY check, or the queries still
+            missing a reply and any more the pipeline has room for
+        """
+        if not session.identified:
+            self.logger.debug("tDCR: Checking {} is {}".format(*session.check))
+            self._send(session.check[0])
+            return
+        if session.lookup:
+            self.logger.debug("tDCR: Asking CHDEVID to look the device up in the cache")
+            self._send("CHDEVID")
+            return
+        for position in list(session.outstanding):
+            if not self._sendQuery(session, position):
+                return
+        self._fill(session)
+
+    def _fill(self, session):
+        """ Send further queries until pipeline are waiting for a reply
+        """
+        last = len(session.toQuery) - 1
+        while len(session.outstanding) < session.pipeline and session.next <= last:
+            if session.next == last and session.outstanding:
+                # the last query waits for all the others
+                return
+            position = session.next
+            session.next += 1
+            session.sent(position, self._replyKey(session.toQuery[position]['command']))
+            if not self._sendQuery(session, position):
+                return
+
+    def _sendQuery(self, session, position):
+        """ Send one query, False if it has used up its retries and the session failed
+        """
+        sends = session.sends.get(position, 0)
+        query = session.toQuery[position]
+        if sends >= session.retryCount:
+            self.logger.warn("tDCR: Failed DCR due to retry count on {}".format(query['command']))
+            self._finish(session, self.FAIL_RETRY)
+            return False
+        if self._send("{}{}".format(query['command'], query.get('value', ""))):
+            session.sends[position] = sends + 1
+        return True
+
+    def _replyKey(self, command):
+        """ What a reply to command starts with, ENx encryption key queries
+            are all answered ENACK
+        """
+        if self._encryptionCommandMatch.match(command):
+            return "ENACK"
+        return command
+
+    def _match(self, session, message):
+        """ Index in toQuery of the oldest waiting query message answers, or None
+            message is looked up in session.waiting by its first few
+            characters for each length of key waiting, not checked against
+            every outstanding query
+        """
+        oldest = None
+        for length in session.keyLengths:
+            positions = session.waiting.get(message[:length])
+            # queries are sent in toQuery order, the lowest index waited longest
+            if positions and (oldest is None or positions[0] < oldest):
+                oldest = positions[0]
+        return oldest
+
+    def _checkReply(self, session, check):
+        """ The device that opened the window answered the session's DTY or
+            CHDEVID check, check is the (command, value) it gave
+        """
+        if check == session.check:
+            self.logger.debug("tDCR: Confirmed {} {}".format(*check))
+            session.identified = True
+            self._ask(session)
+            return
+        # not the device this session wants, give the window to one that does
+        self._waiting.insert(0, session)
+        self._active = None
+        for candidate in self._waiting[1:]:
+            if candidate.wants(check):
+                self.logger.debug("tDCR: {} {} is not {}, switching session".format(check[0], check[1], session.check[1]))
+                self._waiting.remove(candidate)
+                self._active = candidate
+                candidate.identified = True
+                candidate.sends = {}
+                self._ask(candidate)
+                return
+        self.logger.debug("tDCR: {} {} is not wanted by any session".format(*check))
+
+    def _lookup(self, session, deviceID):
+        """ The device answered the CHDEVID asked to look it up in the cache
+        """
+        session.lookup = False
+        session.deviceID = deviceID
+        if "CHDEVID" in session.index and not session.index["CHDEVID"].get('value'):
+            # that was also the request's own CHDEVID query
+            self._store(session, "CHDEVID", "CHDEVID" + deviceID)
+            session.toQuery = [query for query in session.toQuery if query['command'] != "CHDEVID"]
+        self._serve(session, deviceID)
+        if not session.toQuery:
+            self.logger.debug("tDCR: Answered all toQuery for {} from the cache".format(deviceID))
+            self._finish(session, self.PASS)
+        else:
+            self._ask(session)
+
+    def _serve(self, session, deviceID):
+        """ Answer the session's queries without a value that deviceID has
+            fresh cached replies for, leaving toQuery with the ones to send
+            Only called before any query is sent
+        """
+        if not self.cache.cacheable(deviceID):
+            return
+        replies = session.request['data']['replies']
+        toQuery = []
+        for query in session.toQuery:
+            command = query['command']
+            answer = None
+            if not query.get('value') and command in session.index:
+                answer = self.cache.answer(deviceID, command, session.cache)
+            if answer is None:
+                toQuery.append(query)
+            else:
+                replies[command] = answer
+        self.logger.debug("tDCR: {} of {} toQuery answered from the cache".format(len(session.toQuery) - len(toQuery), len(session.toQuery)))
+        session.toQuery = toQuery
+
+    def _store(self, session, command, message):
+        """ Keep the reply to command if it is one of the request's own queries
+        """
+        query = session.index.get(command)
+        if query is None:
+            # added by the Message Bridge, eg for setENC
+            return
+        replies = session.request['data']['replies']
+        replies[command] = {'value': query.get('value', ""),
+                            'reply': message[len(command):]
+                            }
+        self.logger.debug("tDCR: Stored reply '{}':{}".format(command, replies[command]))
+
+    def _arm(self, session):
+        """ (Re)start a session's timeout
+        """
+        session.deadline = time() + session.timeout
+        heapq.heappush(self._timers, (session.deadline, next(self._sequence), session))
+        if self._loop:
+            self._loopSchedule()
+        else:
+            self._condition.notify()
+
+    def _expire(self):
+        now = time()
+        while self._timers and (self._timers[0][0] <= now or self._timers[0][2].done):
+            (deadline, sequence, session) = heapq.heappop(self._timers)
+            # a reply restarts the timeout leaving the old entry behind
+            if session.done or session.deadline != deadline:
+                continue
+            self.logger.warn("tDCR: Failed DCR due to timeout")
+            self._finish(session, self.FAIL_TIMEOUT)
+
+    def _finish(self, session, state):
+        session.done = True
+        # keep what the device told us, under its new ID if the session changed it
+        replies = session.request['data']['replies']
+        deviceID = replies.get('CHDEVID', {}).get('reply') or session.deviceID
+        self.cache.learn(deviceID, replies, session.request['data'].get('id'), session.deviceID or session.devID)
+        if self._active is session:
+            self._active = None
+        elif session in self._waiting:
+            self._waiting.remove(session)
+        (session.reply or self._reply)(session.request, state)
+
+    def _loopSchedule(self):
+        """ Have the event loop call us at the earliest deadline
+        """
+        if not self._timers:
+            return
+        when = self._timers[0][0]
+        if self._loopTimer:
+            if self._loopTimer.when <= when:
+                return
+            self._loopTimer.cancel()
+        self._loopTimer = self._loop.callLater(max(0, when - time()), self._loopExpire)
+
+    def _loopExpire(self):
+        with self._condition:
+            self._loopTimer = None
+            self._expire()
+            self._loopSchedule()
@@ -0,0 +1,5 @@
+from DCREngine import DCREngine, DCRSession
+from DCRBatch import DCRBatch
+from DCRCache import DCRCache
+
+__ALL__ = ['DCREngine', 'DCRSession', 'DCRBatch', 'DCRCache']
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Device Store
+    The last message and recent readings from each device
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import threading
+import calendar
+from bisect import bisect_left, bisect_right, insort
+from array import array
+from collections import OrderedDict
+from time import strftime, strptime, gmtime
+
+class ReadingRing():
+    """ The last depth readings from one device in preallocated slots
+
+        Times are kept in an array of doubles next to a list of the
+        messages, so a device's memory does not grow however long it runs.
+    """
+
+    __slots__ = ('times', 'data', 'next', 'count')
+
+    def __init__(self, depth):
+        self.times = array('d', [0.0]) * depth
+        self.data = [None] * depth
+        self.next = 0
+        self.count = 0
+
+    def add(self, epoch, data):
+        self.times[self.next] = epoch
+        self.data[self.next] = data
+        self.next = (self.next + 1) % len(self.data)
+        if self.count < len(self.data):
+            self.count += 1
+
+    def newestFirst(self):
+        """ (epoch, data) of every reading, newest first
+        """
+        depth = len(self.data)
+        for n in xrange(1, self.count + 1):
+            slot = (self.next - n) % depth
+            yield (self.times[slot], self.data[slot])
+
+class DeviceStore():
+    """ Per network, the last message from each device as reported by the
+        deviceStore MessageBridge request and, if depth is not 0, a
+        ReadingRing of its last depth readings for history()
+
+        Every message takes the next number of a sequence shared by the
+        whole store and the device IDs of each network are kept sorted, so
+        page() can hand out the devices a page at a time from a cursor (the
+        last ID of the page before), only those under an ID prefix and only
+        those heard from since an earlier sequence number.
+        A page bisects to its cursor and stops after limit IDs, and the
+        devices of each network are also kept in the order they were last
+        heard from so changedSince only looks at the ones that have changed.
+    """
+
+    timestampFormat = "%d %b %Y %H:%M:%S +0000"
+
+    def __init__(self, depth=0):
+        self.depth = depth
+        self._latest = {}       # network to device ID to {'data', 'timestamp'}
+        self._rings = {}        # network to device ID to ReadingRing
+        self._ids = {}          # network to sorted list of device IDs
+        self._sequences = {}    # network to OrderedDict of device ID to the sequence number of its last message, oldest first
+        self.sequence = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parseTime(cls, value):
+        """ Epoch seconds from a number or a timestamp as the Message Bridge
+            formats them, None stays None
+            raises ValueError or TypeError if it is neither
+        """
+        if value is None:
+            return None
+        if isinstance(value, basestring):
+            return calendar.timegm(strptime(value, cls.timestampFormat))
+        return float(value)
+
+    def add(self, network, deviceID, data, timestamp, epoch):
+        """ Keep a message from deviceID, timestamp is its formatted time and
+            epoch the same in seconds
+        """
+        with self._lock:
+            latest = self._latest.setdefault(network, {})
+            if deviceID not in latest:
+                insort(self._ids.setdefault(network, []), deviceID)
+            latest[deviceID] = {'data': data,
+                                'timestamp': timestamp}
+            self.sequence += 1
+            sequences = self._sequences.setdefault(network, OrderedDict())
+            # moved to the end, the most recently heard from
+            sequences.pop(deviceID, None)
+            sequences[deviceID] = self.sequence
+            if self.depth:
+                rings = self._rings.setdefault(network, {})
+                ring = rings.get(deviceID)
+                if ring is None:
+                    ring = rings[deviceID] = ReadingRing(self.depth)
+                ring.add(epoch, data)
+
+    def latest(self, network):
+        """ Copy of the last message from each device on network
+        """
+        with self._lock:
+            return dict(self._latest.get(network, {}))
+
+    def devices(self, network):
+        with self._lock:
+            return list(self._ids.get(network, []))
+
+    def page(self, network, prefix="", cursor=None, limit=0, changedSince=None, countOnly=False):
+        """ The last message of up to limit devices (0 for all) whose ID
+            starts with prefix, in ID order after cursor, and with
+            changedSince only those whose last message has a higher
+            sequence number
+            Returns (entries, cursor for the next page or None if this is
+            the last, count of all the devices that match from the start,
+            sequence number now). countOnly leaves entries empty
+        """
+        entries = {}
+        nextCursor = None
+        with self._lock:
+            latest = self._latest.get(network, {})
+            if changedSince is None:
+                ids = self._ids.get(network, [])
+                (start, end) = self._prefixRange(ids, prefix)
+            else:
+                ids = sorted(deviceID for deviceID in self._changedSince(network, changedSince)
+                             if deviceID.startswith(prefix))
+                (start, end) = (0, len(ids))
+            count = end - start
+            first = bisect_right(ids, cursor, start, end) if cursor is not None else start
+            if not countOnly:
+                last = min(first + limit, end) if limit else end
+                for index in xrange(first, last):
+                    entries[ids[index]] = dict(latest[ids[index]])
+                if last < end:
+                    # more to come, the next page starts after the last one we have
+                    nextCursor = ids[last - 1]
+            return (entries, nextCursor, count, self.sequence)
+
+    def _prefixRange(self, ids, prefix):
+        """ (start, end) of the IDs in sorted ids that start with prefix
+        """
+        start = bisect_left(ids, prefix)
+        # those that start with prefix all sort together from start
+        (low, high) = (start, len(ids))
+        while low < high:
+            middle = (low + high) // 2
+            if ids[middle].startswith(prefix):
+                low = middle + 1
+            else:
+                high = middle
+        return (start, low)
+
+    def _changedSince(self, network, changedSince):
+        """ IDs of the devices on network whose last message has a higher
+            sequence number than changedSince, most recent first
+        """
+        sequences = self._sequences.get(network, OrderedDict())
+        for deviceID in reversed(sequences):
+            if sequences[deviceID] <= changedSince:
+                break
+            yield deviceID
+
+    def history(self, network, deviceID, last=0, since=None, prefix=None):
+        """ Readings from deviceID, oldest first, as {'data', 'timestamp'}
+            last keeps only the newest last of them (0 for all), since only
+            those after that many epoch seconds and prefix only the messages
+            starting with it
+        """
+        readings = []
+        with self._lock:
+            ring = self._rings.get(network, {}).get(deviceID)
+            if ring is None:
+                return readings
+            for (epoch, data) in ring.newestFirst():
+                if since is not None and epoch <= since:
+                    # readings are in time order so the rest are older still
+                    break
+                if prefix and not data.startswith(prefix):
+                    continue
+                readings.append((epoch, data))
+                if last and len(readings) == last:
+                    break
+        readings.reverse()
+        return [{'data': data, 'timestamp': strftime(self.timestampFormat, gmtime(epoch))}
+                for (epoch, data) in readings]
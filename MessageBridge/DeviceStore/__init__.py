@@ -0,0 +1,3 @@
+from DeviceStore import DeviceStore, ReadingRing
+
+__ALL__ = ['DeviceStore', 'ReadingRing']
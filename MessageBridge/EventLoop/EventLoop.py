@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Event Loop
+    Single threaded select() loop with timers for the Message Bridge
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import sys
+import errno
+import select
+import heapq
+import logging
+from time import time
+from TXQueue import WakeupPipe
+
+class Timer():
+    """ Handle for a callback scheduled with callLater(), cancel() stops it
+        running if it has not run yet
+    """
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __lt__(self, other):
+        return self.when < other.when
+
+class EventLoop():
+    """ Wait on file descriptors and timers in one thread
+
+        Readers are anything select() accepts (a file descriptor or an
+        object with fileno()), each with a callback run when it becomes
+        readable. Timers run their callback once their time comes, the
+        loop sleeps in select() until then so there is no polling.
+
+        callSoon() is the only method that may be called from another
+        thread, it wakes the loop through a pipe.
+    """
+
+    def __init__(self, stopEvent, logger=None):
+        self.stopEvent = stopEvent
+        self.logger = logger or logging.getLogger('Message Bridge.EventLoop')
+        self._readers = {}
+        self._timers = []
+        self._soon = []
+        self.running = False
+        self._wakeup = WakeupPipe()
+        self.addReader(self._wakeup.fileno(), self._wakeup.clear)
+
+    @staticmethod
+    def available():
+        """ select() can not be used on pipes or serial ports on win32
+        """
+        return sys.platform != 'win32'
+
+    def addReader(self, reader, callback, *args):
+        self._readers[reader] = (callback, args)
+
+    def removeReader(self, reader):
+        self._readers.pop(reader, None)
+
+    def callLater(self, delay, callback, *args):
+        """ Run callback(*args) after delay seconds, returns a Timer
+        """
+        timer = Timer(time() + max(0, delay), callback, args)
+        heapq.heappush(self._timers, timer)
+        return timer
+
+    def callSoon(self, callback, *args):
+        """ Run callback(*args) on the loop as soon as possible, thread safe
+        """
+        self._soon.append((callback, args))
+        self._wakeup.wake()
+
+    def stop(self):
+        self.stopEvent.set()
+        self._wakeup.wake()
+
+    def run(self):
+        """ Run until stopEvent is set
+        """
+        self.running = True
+        try:
+            while not self.stopEvent.is_set():
+                self.runOnce()
+        finally:
+            self.running = False
+            self._wakeup.close()
+
+    def runOnce(self, maxWait=1.0):
+        """ Wait for the next reader or timer, or maxWait seconds, and run
+            the callbacks that are due
+        """
+        while self._timers and self._timers[0].cancelled:
+            heapq.heappop(self._timers)
+        timeout = maxWait
+        if self._soon:
+            timeout = 0
+        elif self._timers:
+            timeout = min(timeout, max(0, self._timers[0].when - time()))
+
+        try:
+            readable = select.select(self._readers.keys(), [], [], timeout)[0]
+        except select.error as e:
+            if e[0] == errno.EINTR:
+                # a signal, let the caller check stopEvent
+                return
+            raise
+
+        for reader in readable:
+            # an earlier callback may have removed it
+            if self._readers.has_key(reader):
+                (callback, args) = self._readers[reader]
+                self._run(callback, args)
+
+        while self._soon:
+            (callback, args) = self._soon.pop(0)
+            self._run(callback, args)
+
+        now = time()
+        while self._timers and self._timers[0].when <= now:
+            timer = heapq.heappop(self._timers)
+            if not timer.cancelled:
+                self._run(timer.callback, timer.args)
+
+    def _run(self, callback, args):
+        """ One failing callback should not take down the whole loop
+        """
+        try:
+            callback(*args)
+        except (SystemExit, KeyboardInterrupt):
+            raise
+        except:
+            self.logger.exception("EventLoop: Unhandled exception in {}".format(callback))
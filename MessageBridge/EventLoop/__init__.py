@@ -0,0 +1,3 @@
+from EventLoop import EventLoop, Timer
+
+__ALL__ = ['EventLoop', 'Timer']
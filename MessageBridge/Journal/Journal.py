@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Journal
+    Append only file of records that have to survive a restart
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import os
+import json
+import threading
+import logging
+from time import time
+
+class Journal():
+    """ Records by integer key kept in a file of one JSON object per line
+
+        add() appends {"key": n, "value": ...}, update() the same for an
+        existing key and remove() appends {"key": n}, the file is never
+        rewritten in place. Opening it replays the lines to find the
+        records still live, a torn last line from a power cut is skipped.
+
+        Writes are buffered and fsync'd at most every syncInterval seconds,
+        so on an SD card a burst of changes costs one flush. sync() should
+        be called now and then so the last changes do not wait for the next
+        write, close() always syncs. Once the file holds compactRatio times
+        more lines than live records (and at least compactMinimum) it is
+        compacted, the live records are written to a new file which is
+        renamed over the old one.
+
+        If the file can not be written (disk full, card gone read only) the
+        error is logged once and the records are only kept in memory.
+    """
+
+    _compactMinimum = 1000
+    _compactRatio = 4
+
+    def __init__(self, path, syncInterval=5, logger=None):
+        self.path = path
+        self._syncInterval = syncInterval
+        self.logger = logger or logging.getLogger('Journal')
+        self._lock = threading.Lock()
+        self._records = {}
+        self._lines = 0
+        self._nextKey = 1
+        self._dirty = False
+        self._lastSync = 0
+        self._file = None
+        self.syncs = 0
+        self.compactions = 0
+
+    def open(self):
+        """ Replay the file and compact it, ready for new records
+            raises IOError or OSError if it can not be written
+        """
+        with self._lock:
+            self._replay()
+            self._compact()
+        self.logger.info("Journal {} opened with {} records".format(self.path, len(self._records)))
+
+    def items(self):
+        """ List of (key, value) of the live records, oldest first
+        """
+        with self._lock:
+            return sorted(self._records.items())
+
+    def add(self, value):
+        """ Journal a new record, returns its key
+        """
+        with self._lock:
+            key = self._nextKey
+            self._nextKey += 1
+            self._records[key] = value
+            self._write({'key': key, 'value': value})
+        return key
+
+    def update(self, key, value):
+        with self._lock:
+            if key not in self._records:
+                return
+            self._records[key] = value
+            self._write({'key': key, 'value': value})
+
+    def remove(self, key):
+        with self._lock:
+            if self._records.pop(key, None) is None:
+                return
+            self._write({'key': key})
+
+    def sync(self, force=False):
+        """ fsync anything written since the last sync once syncInterval has passed
+        """
+        with self._lock:
+            try:
+                self._sync(force)
+            except (IOError, OSError) as e:
+                self._failed(e)
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            try:
+                self._sync(True)
+                self._file.close()
+            except (IOError, OSError) as e:
+                self.logger.error("Journal {}: {}".format(self.path, e))
+            self._file = None
+
+    def stats(self):
+        with self._lock:
+            return {'records': len(self._records),
+                    'lines': self._lines,
+                    'syncs': self.syncs,
+                    'compactions': self.compactions
+                    }
+
+    def _replay(self):
+        self._records = {}
+        self._lines = 0
+        try:
+            journal = open(self.path, 'r')
+        except IOError:
+            # first run
+            return
+        with journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                    key = int(record['key'])
+                except (ValueError, KeyError, TypeError):
+                    self.logger.warn("Journal {}: skipped damaged line {}".format(self.path, self._lines + 1))
+                    continue
+                self._lines += 1
+                self._nextKey = max(self._nextKey, key + 1)
+                if record.has_key('value'):
+                    self._records[key] = record['value']
+                else:
+                    self._records.pop(key, None)
+
+    def _write(self, record):
+        if self._file is None:
+            return
+        try:
+            self._file.write(json.dumps(record, separators=(',', ':')) + "\n")
+            self._lines += 1
+            self._dirty = True
+            if self._lines >= max(self._compactMinimum, self._compactRatio * len(self._records)):
+                self._compact()
+            else:
+                self._sync()
+        except (IOError, OSError) as e:
+            self._failed(e)
+
+    def _failed(self, error):
+        self.logger.error("Journal {}: {}, records are no longer saved".format(self.path, error))
+        try:
+            self._file.close()
+        except (AttributeError, IOError, OSError):
+            pass
+        self._file = None
+
+    def _sync(self, force=False):
+        if self._file is None or not self._dirty:
+            return
+        now = time()
+        if not force and now - self._lastSync < self._syncInterval:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._dirty = False
+        self._lastSync = now
+        self.syncs += 1
+
+    def _compact(self):
+        """ Write the live records to a new file and swap it for the current one
+        """
+        if self._file is not None:
+            self._file.close()
+        temporary = self.path + ".new"
+        with open(temporary, 'w') as compacted:
+            for (key, value) in sorted(self._records.items()):
+                compacted.write(json.dumps({'key': key, 'value': value}, separators=(',', ':')) + "\n")
+            compacted.flush()
+            os.fsync(compacted.fileno())
+        if os.name == 'nt' and os.path.exists(self.path):
+            # rename will not replace a file on Windows
+            os.remove(self.path)
+        os.rename(temporary, self.path)
+        self._lines = len(self._records)
+        self._file = open(self.path, 'a')
+        self._dirty = False
+        self._lastSync = time()
+        self.compactions += 1
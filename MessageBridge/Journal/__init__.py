@@ -0,0 +1,3 @@
+from Journal import Journal
+
+__ALL__ = ['Journal']
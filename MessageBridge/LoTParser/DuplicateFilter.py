@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Language of Things duplicate filter
+    Drops repeated copies of a frame received within a short window
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+from time import time
+from LoTParser import LoTParser
+
+class DuplicateFilter():
+    """ Spot repeats of the same frame from a device
+
+        Devices and repeaters often send a message more than once, only the
+        first copy seen within window seconds is let through. The window is
+        timed from that first copy, so a device that really does send the
+        same reading every few minutes is not affected.
+
+        Memory is fixed, one slot holding the last frame and when it was
+        first seen for every possible two character ID.
+    """
+
+    def __init__(self, window):
+        self.window = float(window)
+        self._slots = len(LoTParser.validID) ** 2
+        self._index = dict((char, n) for n, char in enumerate(LoTParser.validID))
+        self._frames = [None] * self._slots
+        self._times = [0.0] * self._slots
+        self.suppressed = 0
+
+    def isDuplicate(self, frame, now=None):
+        """ True if frame is a repeat inside the window, otherwise record it
+            frame is a complete 12 byte frame from LoTParser.feed()
+        """
+        slot = self._index[frame[1]] * len(self._index) + self._index[frame[2]]
+        if now is None:
+            now = time()
+        if self._frames[slot] == frame and now - self._times[slot] < self.window:
+            self.suppressed += 1
+            return True
+        self._frames[slot] = frame
+        self._times[slot] = now
+        return False
+
+    def reset(self):
+        """ Forget everything seen so far
+        """
+        self._frames = [None] * self._slots
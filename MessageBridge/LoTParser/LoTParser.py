@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Language of Things frame parser
+    Buffered, incremental parser for the serial RX side of the Message Bridge
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import re
+
+class LoTParser():
+    """ Turn a stream of serial bytes into 12 byte Language of Things frames
+
+        Bytes are passed in with feed() in whatever chunks the serial port
+        hands them over, any partial frame is kept until the next call.
+        Each byte is classified once per feed via a precomputed translate
+        table, the class string is then matched with a single regex so all
+        complete frames in the buffer are found in one pass.
+
+        A frame is an 'a' followed by 2 ID and 9 data characters, an 'a'
+        inside a frame restarts it, any other invalid byte drops it.
+    """
+
+    frameLength = 12
+
+    validID = "ABCDEFGHIJKLMNOPQRSTUVWXYZ-#@?\\*"
+    validData = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 !\"#$%&'()*+,-.:;<=>?@[\\\/]^_`{|}~"
+
+    # byte classes used in the translate table
+    _classStart = 'a'
+    _classID = 'I'      # valid as ID and as data
+    _classData = 'D'    # only valid as data
+    _classInvalid = 'x'
+
+    _frameMatch = re.compile("aII[ID]{9}")
+    _partialMatch = re.compile("a(?:I(?:I[ID]{0,8})?)?$")
+
+    def __init__(self):
+        self._classTable = self._buildClassTable()
+        self._buffer = ""
+        self.frames = 0
+        self.discarded = 0
+
+    def _buildClassTable(self):
+        """ Precompute the 256 entry byte class table
+        """
+        table = []
+        for byte in range(256):
+            char = chr(byte)
+            if char == 'a':
+                table.append(self._classStart)
+            elif char in self.validID:
+                table.append(self._classID)
+            elif char in self.validData:
+                table.append(self._classData)
+            else:
+                table.append(self._classInvalid)
+        return "".join(table)
+
+    def feed(self, data):
+        """ Add data to the buffer and return a list of all the complete
+            frames now available
+        """
+        buffer = self._buffer + data if self._buffer else data
+        if not buffer:
+            return []
+
+        classes = buffer.translate(self._classTable)
+        frames = []
+        position = 0
+        for match in self._frameMatch.finditer(classes):
+            start = match.start()
+            self.discarded += start - position
+            frames.append(buffer[start:start + self.frameLength])
+            position = start + self.frameLength
+
+        # keep a trailing partial frame for the next feed
+        start = classes.rfind(self._classStart, position)
+        if start != -1 and self._partialMatch.match(classes, start):
+            self.discarded += start - position
+            self._buffer = buffer[start:]
+        else:
+            self.discarded += len(buffer) - position
+            self._buffer = ""
+
+        self.frames += len(frames)
+        return frames
+
+    def pending(self):
+        """ Number of bytes held back waiting for the rest of a frame
+        """
+        return len(self._buffer)
+
+    def reset(self):
+        """ Throw away any partial frame, used when the port is (re)opened
+        """
+        self.discarded += len(self._buffer)
+        self._buffer = ""
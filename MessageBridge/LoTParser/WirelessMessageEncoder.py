@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" WirelessMessage encoder
+    Turns a received Language of Things frame into WirelessMessage JSON
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import json
+from operator import itemgetter
+from time import time, gmtime, strftime
+
+class WirelessMessageEncoder():
+    """ Produce the same JSON as json.dumps() of a WirelessMessage dict
+        without going through json.dumps() for every frame
+
+        Every WirelessMessage has the same shape, so the layout is taken once
+        from json.dumps() of a dict holding marker values and the fields are
+        dropped into it. Strings of plain printable ASCII are quoted as they
+        are, anything else still goes through json.dumps(). The timestamp
+        only changes once a second and the network hardly ever, both are
+        kept ready formatted.
+
+        Safe to use from several serial threads at once.
+    """
+
+    timestampFormat = "%d %b %Y %H:%M:%S +0000"
+
+    _fields = ('network', 'timestamp', 'id', 'data')
+    # characters json.dumps() passes through as they are
+    _plain = ''.join(chr(code) for code in range(32, 127) if chr(code) not in '"\\')
+
+    def __init__(self):
+        markers = dict((field, "@{}@".format(field)) for field in self._fields)
+        # same keys added in the same order as the dict returned by encode()
+        layout = {'type': "WirelessMessage"}
+        layout['network'] = markers['network']
+        layout['timestamp'] = markers['timestamp']
+        layout['id'] = markers['id']
+        layout['data'] = [markers['data']]
+        layout = json.dumps(layout).replace('%', '%%')
+
+        order = sorted(self._fields, key=lambda field: layout.index(markers[field]))
+        # picks (network, timestamp, id, data) in the order they appear in the layout
+        self._ordered = itemgetter(*[self._fields.index(field) for field in order])
+        # _template takes the values already encoded, _plainTemplate takes
+        # plain strings and keeps the quotes from the layout
+        self._template = layout
+        self._plainTemplate = layout
+        for field in self._fields:
+            self._template = self._template.replace(json.dumps(markers[field]), '%s')
+            self._plainTemplate = self._plainTemplate.replace(markers[field], '%s')
+
+        self._networks = {}             # network to True if it is plain
+        self._second = (None, None)     # (whole second, formatted timestamp)
+
+    def timestamp(self):
+        """ The current time formatted for a WirelessMessage
+        """
+        now = int(time())
+        (second, formatted) = self._second
+        if second != now:
+            formatted = strftime(self.timestampFormat, gmtime(now))
+            self._second = (now, formatted)
+        return formatted
+
+    def encode(self, message, network):
+        """ Encode a 12 character Language of Things frame
+            returns the JSON and the dict it represents
+        """
+        # same as timestamp(), inline as this is called for every frame
+        now = int(time())
+        (second, timestamp) = self._second
+        if second != now:
+            timestamp = strftime(self.timestampFormat, gmtime(now))
+            self._second = (now, timestamp)
+        deviceID = message[1:3]
+        data = message[3:].strip("-")
+
+        plainNetwork = self._networks.get(network)
+        if plainNetwork is None:
+            plainNetwork = self._networks[network] = self._isPlain(network)
+
+        # only " and \ from the Language of Things character set need escaping
+        if plainNetwork and self._isPlain(message):
+            jsonout = self._plainTemplate % self._ordered((network, timestamp, deviceID, data))
+        else:
+            jsonout = self._template % self._ordered((json.dumps(network), json.dumps(timestamp),
+                                                      json.dumps(deviceID), json.dumps(data)))
+
+        jsonDict = {'type': "WirelessMessage"}
+        jsonDict['network'] = network
+        jsonDict['timestamp'] = timestamp
+        jsonDict['id'] = deviceID
+        jsonDict['data'] = [data]
+        return (jsonout, jsonDict)
+
+    def _isPlain(self, value):
+        """ Would json.dumps() leave value as it is
+        """
+        return type(value) is str and not value.translate(None, self._plain)
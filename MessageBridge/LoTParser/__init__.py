@@ -0,0 +1,5 @@
+from LoTParser import LoTParser
+from DuplicateFilter import DuplicateFilter
+from WirelessMessageEncoder import WirelessMessageEncoder
+
+__ALL__ = ['LoTParser', 'DuplicateFilter', 'WirelessMessageEncoder']
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Mailbox
+    Messages waiting for sleeping devices to wake up
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import threading
+from collections import deque
+from time import time, strftime, gmtime
+
+class Mailbox():
+    """ The sendOn WirelessMessage's waiting for each device
+
+        Each sendOn request is an entry of steps (on, send). The first step
+        is sent when the device says on (eg AWAKE), each later one when the
+        device replies to the step before. A device's entries are worked
+        through oldest first.
+
+        Entries are kept in a dict by device ID so the check made for every
+        frame received is a single lookup. An entry expires ttl seconds after
+        it was put and a device holds at most depth entries, putting another
+        evicts its oldest. Devices that never wake are swept out every
+        sweepInterval seconds as entries are put and delivered.
+
+        Once attach()ed to a Journal every change to an entry is journaled
+        so the entries still waiting come back after a restart.
+    """
+
+    def __init__(self, sweepInterval=60):
+        self._devices = {}      # device ID to deque of entries, oldest first
+        self._lock = threading.Lock()
+        self._sweepInterval = sweepInterval
+        self._nextSweep = time() + sweepInterval
+        self.added = 0
+        self.delivered = 0
+        self.expired = 0
+        self.evicted = 0
+        self._journal = None
+        self._network = None
+
+    def __contains__(self, deviceID):
+        return deviceID in self._devices
+
+    def attach(self, journal, network):
+        """ Journal this mailbox as network and take back the entries the
+            journal holds for it from before a restart
+        """
+        now = time()
+        restored = 0
+        with self._lock:
+            if self._journal is not None:
+                return 0
+            for (key, record) in journal.items():
+                if record.get('type') != "sendOn" or record.get('network') != network:
+                    continue
+                entry = {'steps': deque(tuple(step) for step in record['steps']),
+                         'expires': record['expires'],
+                         'key': key}
+                if self._hasExpired(entry, now) or not entry['steps']:
+                    journal.remove(key)
+                    continue
+                self._devices.setdefault(record['id'], deque()).append(entry)
+                restored += 1
+            self._journal = journal
+            self._network = network
+            # anything put before now
+            for (deviceID, entries) in self._devices.items():
+                for entry in entries:
+                    if entry.get('key') is None:
+                        entry['key'] = journal.add(self._record(deviceID, entry))
+        return restored
+
+    def put(self, deviceID, steps, ttl=0, depth=0):
+        """ Add an entry of steps, a list of (on, send), for deviceID
+            ttl of 0 never expires, depth of 0 is unlimited
+            Returns the number of entries evicted to make room
+        """
+        now = time()
+        entry = {'steps': deque(steps), 'expires': now + ttl if ttl else None, 'key': None}
+        evicted = 0
+        with self._lock:
+            self._sweep(now)
+            if self._journal is not None:
+                entry['key'] = self._journal.add(self._record(deviceID, entry))
+            entries = self._devices.setdefault(deviceID, deque())
+            entries.append(entry)
+            self.added += 1
+            while depth and len(entries) > depth:
+                self._drop(entries.popleft())
+                evicted += 1
+            self.evicted += evicted
+        return evicted
+
+    def deliver(self, deviceID, command, send):
+        """ deviceID said command, if that is what its next step is waiting
+            on call send(text) with the step's message. The step is used up
+            if send returns True
+            Returns True if a step was sent
+        """
+        now = time()
+        sent = False
+        with self._lock:
+            entries = self._devices.get(deviceID)
+            if entries is None:
+                return False
+            while entries and self._hasExpired(entries[0], now):
+                self._drop(entries.popleft())
+                self.expired += 1
+            if entries:
+                steps = entries[0]['steps']
+                (on, text) = steps[0]
+                if on == command and send(text):
+                    sent = True
+                    self.delivered += 1
+                    steps.popleft()
+                    if not steps:
+                        self._drop(entries.popleft())
+                    elif self._journal is not None:
+                        self._journal.update(entries[0]['key'], self._record(deviceID, entries[0]))
+            if not entries:
+                del self._devices[deviceID]
+            self._sweep(now)
+        return sent
+
+    def status(self):
+        """ Counters and waiting entries for the mailbox MessageBridge request
+        """
+        with self._lock:
+            self._sweep(time(), True)
+            return {'devices': len(self._devices),
+                    'entries': sum(len(entries) for entries in self._devices.values()),
+                    'added': self.added,
+                    'delivered': self.delivered,
+                    'expired': self.expired,
+                    'evicted': self.evicted,
+                    'mailboxes': dict((deviceID, [{'steps': [list(step) for step in entry['steps']],
+                                                   'expires': self._timestamp(entry['expires'])}
+                                                  for entry in entries])
+                                      for (deviceID, entries) in self._devices.items())
+                    }
+
+    def _sweep(self, now, force=False):
+        """ Drop expired entries from every device, at most every sweepInterval
+            unless forced. Called holding the lock
+        """
+        if not force and now < self._nextSweep:
+            return
+        self._nextSweep = now + self._sweepInterval
+        for deviceID in list(self._devices):
+            entries = self._devices[deviceID]
+            live = deque()
+            for entry in entries:
+                if self._hasExpired(entry, now):
+                    self._drop(entry)
+                    self.expired += 1
+                else:
+                    live.append(entry)
+            if live:
+                self._devices[deviceID] = live
+            else:
+                del self._devices[deviceID]
+
+    def _drop(self, entry):
+        """ An entry has gone, take it out of the journal
+        """
+        if self._journal is not None and entry['key'] is not None:
+            self._journal.remove(entry['key'])
+
+    def _record(self, deviceID, entry):
+        return {'type': "sendOn",
+                'network': self._network,
+                'id': deviceID,
+                'steps': [list(step) for step in entry['steps']],
+                'expires': entry['expires']
+                }
+
+    @staticmethod
+    def _hasExpired(entry, now):
+        return entry['expires'] is not None and entry['expires'] <= now
+
+    @staticmethod
+    def _timestamp(seconds):
+        if seconds is None:
+            return None
+        return strftime("%d %b %Y %H:%M:%S +0000", gmtime(seconds))
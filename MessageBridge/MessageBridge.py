@@ -28,15 +28,23 @@ import errno
 import Queue
 import argparse
 import ConfigParser
-import serial
 import threading
 import socket
 import select
 import json
+import copy
 import logging
 import LogHandler
-import AT
-import re
+import Radio
+import LoTParser
+import Subscribers
+import Stream
+import Settings
+import TXQueue
+import EventLoop
+import WireFormat
+import Journal
+import DeviceStore
 if sys.platform == 'win32':
     pass
 else:
@@ -74,10 +82,14 @@ class MessageBridge():
     """Core logic and master thread control
 
     MessageBridge looks after the following threads
-    Serial
-    DCR
+    Serial (one per radio)
+    DCR (one per radio)
     UDP Send
     UDP Listen
+    Stream (if enabled)
+
+    With [Run] core = eventloop the serial, DCR and UDP work is done from
+    a single EventLoop instead and only the Stream keeps its own thread.
 
     It starts by loading the MessageBridge.cfg file
     Setting up debug out put and logging
@@ -94,37 +106,21 @@ class MessageBridge():
     _pidFileTimeout = 5
     _background = False
 
-    _SerialFailCount = 0
-    _SerialFailCountLimit = 3
-    _serialTimeout = 1     # serial port time out setting
     _UDPListenTimeout = 5   # timeout for UDP listen
-    _ATLHRetriesCount = 3
+    _UDPListenDrainMax = 256    # most datagrams read per wakeup before checking for anything else to do
+    _UDPTypeKeys = ('"WirelessMessage"', '"DeviceConfigurationRequest"', '"DeviceConfigurationBatch"', '"MessageBridge"')
+    _networkNameTimeout = 10    # how long to wait for a radio to report its network name
+    _batchOverhead = len('{"type": "WirelessMessageBatch", "messages": []}')    # bytes added by batching
+    _housekeepingInterval = 0.5     # how often the event loop core does what the main thread loop does
+    _historyMaxBytes = 6144         # most bytes of readings in one history reply, clients read 8192
+    _deviceStorePageSize = 100      # most devices in one paged deviceStore reply
 
     _version = 0.17
 
-    _sendOnIDs = []
-    _sendOnRequests = {}
-
-    _currentDCR = False
-    devType = None
-    _SerialDTYSync = False
-    _DCRStartTime = 0
-    _DCRCurrentTimeout = 0
-
-    _panID = 0
-    _encryption = False
-    _encryptionKey = None
-
-    _validID = "ABCDEFGHIJKLMNOPQRSTUVWXYZ-#@?\\*"
-    _validData = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 !\"#$%&'()*+,-.:;<=>?@[\\\/]^_`{|}~"
-    _encryptionCommandMatch = re.compile('^EN[1-6]')
-
     _state = ""
     Running = "Running"
     Error = "Error"
 
-    _deviceStore = {}
-
     _ActionHelp = """
 start = Starts as a background daemon/service
 stop = Stops a daemon/service if running
@@ -152,9 +148,21 @@ is running then run in the current terminal
                               }
 
         self.tMainStop = threading.Event()
-        self.fNetworkNameSet = threading.Event()
+        self._radios = []
+        self._networks = {}     # network name to Radio lookup for routing JSON
+        self._networkKeys = ('"ALL"',)  # quoted network names a received JSON must contain, None to not check
+        self._UDPListenSocket = None
+        self._UDPStats = {'received': 0, 'filtered': 0, 'parseErrors': 0}
         self.qMessageBridge = Queue.Queue()
         self.qSendOn = Queue.Queue()
+        self._stream = None
+        self.journal = None     # Journal keeping sendOn's and outgoing messages over a restart
+        self._deviceStore = DeviceStore.DeviceStore()
+        self._loop = None       # EventLoop when using the eventloop core
+        self.settings = None    # Settings snapshot of self.config, replaced on reload
+        self._fh = None
+        self.debugLog = True    # False when no handler would output a debug message
+        self._encoder = LoTParser.WirelessMessageEncoder()
         # setup initial Logging
         logging.getLogger().setLevel(logging.NOTSET)
         self.logger = logging.getLogger('Message Bridge')
@@ -354,92 +362,10 @@ is running then run in the current terminal
         try:
             self._readConfig()          # read in the config file
             self._initLogging()         # setup the logging options
-            self.tMainStop.wait(1)
-            self._initSerialThread()    # start the serial port thread
-            self.tMainStop.wait(1)
-            self.fNetworkNameSet.wait(10) # waiting until serial network to be set
-            self._initDCRThread()       # start the DeviceConfigurationRequest thread
-            self._initUDPSendThread()   # start the UDP sender
-            self._initUDPListenThread() # start the UDP listener
-
-            self._state = self.Running
-
-            # main thread looks after the Message Bridge status for us
-            while not self.tMainStop.is_set():
-                # check threads are running
-                if not self.tDCR.is_alive():
-                    self.logger.error("tMain: DCR thread stopped")
-                    self._state = self.Error
-                    self.tMainStop.wait(1)
-                    self._startDCR()
-                    self.tMainStop.wait(1)
-                    if self.tDCR.is_alive():
-                        self._state = self.Running
-
-                if not self.tUDPSend.is_alive():
-                    self.logger.error("tMain: UDPSend thread stopped")
-                    self._state = self.Error
-                    self.tMainStop.wait(1)
-                    self._startUDPSend()
-                    self.tMainStop.wait(1)
-                    if self.tUDPSend.is_alive():
-                        self._state = self.Running
-
-                if not self.tSerial.is_alive():
-                    self.logger.error("tMain: Serial thread stopped, wait 1 before trying to re-establish ")
-                    self._state = self.Error
-                    self.tMainStop.wait(1)
-                    self._startSerial()
-                    self.tMainStop.wait(1)
-                    if self.tSerial.is_alive():
-                        self._state = self.Running
-                    else:
-                        self._SerialFailCount += 1
-                        if self._SerialFailCount > self._SerialFailCountLimit:
-                            self.logger.error("tMain: Serial thread failed to recover after {} retries, Exiting".format(self._SerialFailCountLimit))
-                            self.die()
-
-                if not self.tUDPListen.is_alive():
-                    self.logger.error("tMain: UDPListen thread stopped")
-                    self._state = self.Error
-                    self.tMainStop.wait(1)
-                    self._startUDPListen()
-                    self.tMainStop.wait(1)
-                    if self.tUDPSend.is_alive():
-                        self._state = self.Running
-
-                #check if the serial have done the encryption on the radio
-                if self.fRadioEncryptionDone.is_set():
-                    self.fRadioEncryptionDone.clear()
-                    self.logger.debug("tMain: Processing Reply Encryption message")
-                    if not self.qReplyEncryption.empty():
-                        try:
-                            message = self.qReplyEncryption.get_nowait()
-                        except Queue.Empty():
-                            pass
-                        else:
-                            message['timestamp'] = strftime("%d %b %Y %H:%M:%S +0000", gmtime())
-                            message['data']['result'] = self._setRadioEncryption
-                            try:
-                                self.qUDPSend.put(json.dumps(message))
-                            except Queue.Full:
-                                self.logger.debug("tMain: Failed to put {} on qUDPSend as it's full".format(message))
-                            else:
-                                self.logger.debug("tMain: Put {} on qUDPSend".format(message))
-                        self.qReplyEncryption.task_done()
-
-                # process any "MessageBridge" messages
-                if not self.qMessageBridge.empty():
-                    self.logger.debug("tMain: Processing MessageBridge JSON message")
-                    try:
-                        jsonMessage = self.qMessageBridge.get_nowait()
-                    except Queue.Empty():
-                        pass
-                    else:
-                        self._processMessageBridgeMessage(jsonMessage)
-
-                # flash led's if GPIO debug
-                self.tMainStop.wait(0.5)
+            if self._useEventLoop():
+                self._runEventLoop()
+            else:
+                self._runThreads()
 
         except KeyboardInterrupt:
             self.logger.info("Keyboard Interrupt - Exiting")
@@ -447,6 +373,153 @@ is running then run in the current terminal
 
         self.logger.debug("Exiting")
 
+    def _useEventLoop(self):
+        """ Should we run on the single threaded event loop core
+        """
+        core = self.settings.core
+        if core == "eventloop":
+            if EventLoop.EventLoop.available():
+                return True
+            self.logger.warn("The eventloop core is not available on {}, using threads".format(sys.platform))
+        elif core != "threaded":
+            self.logger.warn("Unknown core {}, using threads".format(core))
+        return False
+
+    def _runThreads(self):
+        """ Start a thread for each part and look after them from this one
+        """
+        self.tMainStop.wait(1)
+        self._initJournal()         # before the radios so they can take back what it holds
+        self._initDeviceStore()
+        self._initUDPSendThread()   # start the UDP sender, before the radios as they put their readings on qUDPSend
+        self._initRadios()          # start the serial port threads
+        self.tMainStop.wait(1)
+        for radio in self._radios:
+            radio.fNetworkNameSet.wait(self._networkNameTimeout) # waiting until serial network to be set
+            radio.initDCRThread()   # start the DeviceConfigurationRequest thread
+        self._initUDPListenThread() # start the UDP listener
+        self._initStream()          # start the TCP/Unix socket stream if enabled
+
+        self._state = self.Running
+
+        # main thread looks after the Message Bridge status for us
+        while not self.tMainStop.is_set():
+            # check threads are running
+            for radio in self._radios:
+                if not radio.checkThreads():
+                    self._state = self.Error
+                elif self._state == self.Error:
+                    self._state = self.Running
+
+            if not self.tUDPSend.is_alive():
+                self.logger.error("tMain: UDPSend thread stopped")
+                self._state = self.Error
+                self.tMainStop.wait(1)
+                self._startUDPSend()
+                self.tMainStop.wait(1)
+                if self.tUDPSend.is_alive():
+                    self._state = self.Running
+
+            if not self.tUDPListen.is_alive():
+                self.logger.error("tMain: UDPListen thread stopped")
+                self._state = self.Error
+                self.tMainStop.wait(1)
+                self._startUDPListen()
+                self.tMainStop.wait(1)
+                if self.tUDPListen.is_alive():
+                    self._state = self.Running
+
+            if self._stream and not self._stream.tStream.is_alive():
+                self.logger.error("tMain: Stream thread stopped")
+                self._state = self.Error
+                self.tMainStop.wait(1)
+                self._stream.startThread()
+                self.tMainStop.wait(1)
+                if self._stream.tStream.is_alive():
+                    self._state = self.Running
+
+            #check if the serial have done the encryption on the radio
+            for radio in self._radios:
+                radio.processEncryptionReply()
+
+            # process any "MessageBridge" messages
+            self._processMessageBridgeQueue()
+
+            if self.journal:
+                self.journal.sync()
+
+            # flash led's if GPIO debug
+            self.tMainStop.wait(0.5)
+
+    def _runEventLoop(self):
+        """ Run the radios and the UDP sockets from this thread
+        """
+        self.logger.info("Starting the eventloop core")
+        self._loop = EventLoop.EventLoop(self.tMainStop)
+        self.tMainStop.wait(1)
+        self._initJournal()
+        self._initDeviceStore()
+        self._initUDPSendLoop()     # before the radios as they put their readings on qUDPSend
+        self._initRadios()          # open the serial ports, blocks while the radios are checked
+        for radio in self._radios:
+            radio.initDCRLoop()
+        self._initUDPListenLoop()
+        self._initStream()          # the stream keeps its own thread
+
+        self._state = self.Running
+
+        self._loop.callLater(self._housekeepingInterval, self._loopHousekeeping)
+        self._loop.run()
+
+    def _loopHousekeeping(self):
+        """ What the main thread loop does for the threaded core
+        """
+        if self._stream and not self._stream.tStream.is_alive():
+            self.logger.error("tMain: Stream thread stopped")
+            self._stream.startThread()
+
+        if self.settings.listenPort != self._UDPListenPort:
+            # changed by a reload
+            self._UDPListenPort = self.settings.listenPort
+            self._UDPReceiveBuffer = self.settings.receiveBuffer
+            self._UDPListenMulticast = self._multicastOptions()
+            self._loop.removeReader(self._UDPListenSocket)
+            self._UDPListenSocket = self._UDPListenMove(self._UDPListenSocket)
+            self._loop.addReader(self._UDPListenSocket, self._UDPLoopListen)
+        elif self._multicastOptions() != self._UDPListenMulticast:
+            self._UDPListenMulticast = self._UDPRejoinMulticast(self._UDPListenSocket, self._UDPListenMulticast)
+        elif self.settings.receiveBuffer != self._UDPReceiveBuffer:
+            self._UDPReceiveBuffer = self.settings.receiveBuffer
+            self._UDPSetReceiveBuffer(self._UDPListenSocket)
+
+        if self._multicastOptions() != self._UDPSendMulticast:
+            # delivery changed by a reload
+            self._UDPSendMulticast = self._multicastOptions()
+            (self._UDPSendSocket, self._multicastGroup) = self._UDPSendReopen(self._UDPSendSocket)
+
+        #check if the serial have done the encryption on the radio
+        for radio in self._radios:
+            radio.processEncryptionReply()
+
+        if self.journal:
+            self.journal.sync()
+
+        self._loop.callLater(self._housekeepingInterval, self._loopHousekeeping)
+
+    def _processMessageBridgeQueue(self):
+        """ Answer the next MessageBridge JSON waiting on qMessageBridge
+            Returns False if there was not one
+        """
+        if self.qMessageBridge.empty():
+            return False
+        self.logger.debug("tMain: Processing MessageBridge JSON message")
+        try:
+            (radio, jsonMessage, address) = self.qMessageBridge.get_nowait()
+        except Queue.Empty:
+            return False
+        self._processMessageBridgeMessage(radio, jsonMessage, address)
+        return True
+
     def _readConfig(self):
         """Read the Message Bridge config file from disk
         """
@@ -465,16 +538,44 @@ is running then run in the current terminal
             self.logger.critical("No Config Loaded, Exiting")
             self.die()
 
+        try:
+            self.settings = Settings.Settings(self.config)
+        except (ConfigParser.Error, ValueError) as e:
+            self.logger.critical("Invalid Config: {}, Exiting".format(e))
+            self.die()
+
     def _writeConfig(self):
         self.logger.debug("Writing Config")
         with open(self._configFile, 'wb') as configFile:
             self.config.write(configFile)
 
-    def _reloadProgramConfig(self):
-        """ Reload the config file from disk
+    def _reloadProgramConfig(self, signal_number=None, stack_frame=None):
+        """ Reload the config file from disk, called on SIGUSR1
+            The new Settings replace the old in one go, if anything is invalid
+            the old ones are kept. Log levels, UDP, subscriber and DCR options
+            take effect straight away, serial ports, the stream and the core
+            still need a restart
         """
-        # TODO: do we want to be able reload config on SIGUSR1?
-        pass
+        self.logger.info("Reloading config files")
+        config = ConfigParser.SafeConfigParser()
+        try:
+            config.readfp(open(self._configFileDefault))
+        except IOError:
+            self.logger.debug("Could Not Load Default Settings File")
+        config.read(self._configFile)
+        try:
+            settings = Settings.Settings(config)
+        except (ConfigParser.Error, ValueError) as e:
+            self.logger.error("Invalid Config: {}, keeping the current settings".format(e))
+            return
+
+        changed = settings.changed(self.settings)
+        self.config = config
+        self.settings = settings
+        self._applyLogLevels()
+        if getattr(self, '_subscribers', None):
+            self._subscribers.setLimits(settings.subscriberLease, settings.subscriberMaxLease, settings.maxSubscribers)
+        self.logger.info("Reloaded config, changed: {}".format(", ".join(changed) or "nothing"))
 
     def _initLogging(self):
         """ now we have the config file loaded and the command line args setup
@@ -500,71 +601,110 @@ is running then run in the current terminal
             self._tr.setLevel(numeric_level)
             self.csvLogger.addHandler(self._tr)
 
-        # disable logging if no options are enabled
-        if (self.args.debug == False and
-            self.config.getboolean('Debug', 'console_debug') == False and
-            self.config.getboolean('Debug', 'file_debug') == False):
-            self.logger.debug("Disabling loggers")
-            # disable debug output
-            self.logger.setLevel(100)
-            return
-        # set console level
-        if (self.args.debug or self.config.getboolean('Debug', 'console_debug')):
-            self.logger.debug("Setting Console debug level")
-            if (self.args.log):
-                logLevel = self.args.log
-            else:
-                logLevel = self.config.get('Debug', 'console_level')
-
-            numeric_level = getattr(logging, logLevel.upper(), None)
-            if not isinstance(numeric_level, int):
-                raise ValueError('Invalid console log level: %s' % loglevel)
-            self._ch.setLevel(numeric_level)
-        else:
-            self._ch.setLevel(100)
-
         # add file logging if enabled
         # TODO: look at rotating log files
         # http://docs.python.org/2/library/logging.handlers.html#logging.handlers.TimedRotatingFileHandler
-        if (self.config.getboolean('Debug', 'file_debug')):
+        if self.settings.fileDebug:
             self.logger.debug("Setting file debugger")
             self._fh = logging.FileHandler(self.config.get('Debug', 'log_file'))
             self._fh.setFormatter(self._formatter)
-            logLevel = self.config.get('Debug', 'file_level')
-            numeric_level = getattr(logging, logLevel.upper(), None)
-            if not isinstance(numeric_level, int):
-                raise ValueError('Invalid console log level: %s' % loglevel)
-            self._fh.setLevel(numeric_level)
             self.logger.addHandler(self._fh)
+
+        self._applyLogLevels()
+        if self._fh:
             self.logger.info("File Logging started")
 
-    def _initDCRThread(self):
-        """ Setup the Thread and Queues for handling DeviceConfigurationRequest
+    def _applyLogLevels(self):
+        """ Set the console and file log levels from the settings
+            the file log can only be turned on at start up
+        """
+        # set console level
+        if self.args.debug or self.settings.consoleDebug:
+            self.logger.debug("Setting Console debug level")
+            if self.args.log:
+                self._ch.setLevel(Settings.Settings.logLevel(self.args.log))
+            else:
+                self._ch.setLevel(self.settings.consoleLevel)
+        else:
+            self._ch.setLevel(100)
+
+        fileDebug = self._fh is not None and self.settings.fileDebug
+        if self._fh:
+            self._fh.setLevel(self.settings.fileLevel if fileDebug else 100)
+
+        # disable logging if no options are enabled
+        if not (self.args.debug or self.settings.consoleDebug or fileDebug):
+            self.logger.debug("Disabling loggers")
+            # disable debug output
+            self.logger.setLevel(100)
+        else:
+            self.logger.setLevel(logging.NOTSET)
+
+        # lets the per message debug lines skip formatting strings nobody sees
+        self.debugLog = (self.logger.level != 100 and
+                         any(handler.level <= logging.DEBUG for handler in (self._ch, self._fh) if handler))
+
+    def _initRadios(self):
+        """ Create a Radio for [Serial] and each [Serial.<name>] config section
+            and start their serial threads
+        """
+        sections = ['Serial'] + sorted(section for section in self.config.sections()
+                                       if section.startswith('Serial.'))
+        for section in sections:
+            self.logger.info("Radio {} init".format(section))
+            radio = Radio.Radio(self, section)
+            self._radios.append(radio)
+            if self._loop:
+                radio.initSerialLoop(self._loop)
+            else:
+                radio.initSerialThread()
+
+    def _initJournal(self):
+        """ Open the journal of sendOn's and outgoing messages, if one is configured
         """
-        self.logger.info("DCR Thread init")
-
-        self.qDCRRequest = Queue.Queue()
-        self.qDCRSerial = Queue.Queue()
-
-        self.tDCRStop = threading.Event()
-        self.fAnsweredAll = threading.Event()
-        self.fRetryFail = threading.Event()
-        self.fTimeoutFail = threading.Event()
-        self.fKeepAwake = threading.Event()
-        self.fKeepAwake.clear()
-        self.fTimeoutFail.clear()
-        self.fRetryFail.clear()
-        self.fAnsweredAll.clear()
-
-        self._startDCR()
-
-    def _startDCR(self):
-        self.tDCR = threading.Thread(name='tDCR', target=self._DCRThread)
-        self.tDCR.daemon = False
+        if not self.settings.journal:
+            return
+        journal = Journal.Journal(self.settings.journal, self.settings.journalSyncInterval, self.logger)
         try:
-            self.tDCR.start()
-        except:
-            self.logger.exception("Failed to Start the DCR thread")
+            journal.open()
+        except (IOError, OSError) as e:
+            self.logger.error("Unable to open journal {}: {}, sendOn's will not survive a restart".format(self.settings.journal, e))
+            return
+        self.journal = journal
+
+    def _initDeviceStore(self):
+        """ Device store keeping the configured number of readings from each device
+        """
+        self._deviceStore = DeviceStore.DeviceStore(self.settings.historyDepth)
+
+    def registerNetwork(self, radio):
+        """ Called by a radio once it knows its network name so JSON for that
+            network can be routed to it
+        """
+        if self._networks.has_key(radio.network) and self._networks[radio.network] is not radio:
+            self.logger.error("Network name {} is used by more than one radio".format(radio.network))
+        self._networks[radio.network] = radio
+        self._networkKeys = self._makeNetworkKeys()
+
+    def _makeNetworkKeys(self):
+        """ The quoted network names for the cheap check in _UDPWanted
+            None if a name would not appear as it is in JSON so can not be checked
+        """
+        keys = ['"ALL"']
+        for network in self._networks.keys():
+            key = json.dumps(network)
+            if key[1:-1] != network:
+                return None
+            keys.append(key)
+        return tuple(keys)
+
+    def _radiosForNetwork(self, network):
+        """ Look up the radios a JSON message for network should go to
+        """
+        if network == "ALL":
+            return [radio for radio in self._radios if radio.fNetworkNameSet.is_set()]
+        radio = self._networks.get(network, None)
+        return [radio] if radio else []
 
     def _initUDPSendThread(self):
         """ Start the UDP output thread
@@ -572,11 +712,34 @@ is running then run in the current terminal
         self.logger.info("UDP Send Thread init")
 
         self.qUDPSend = Queue.Queue()
+        self._initSubscribers()
 
         self.tUDPSendStop = threading.Event()
 
         self._startUDPSend()
 
+    def _initUDPSendLoop(self):
+        """ Have the event loop send whatever is put on qUDPSend
+        """
+        self.logger.info("UDP Send event loop init")
+
+        # a WakeupQueue so the loop can select on it
+        self.qUDPSend = TXQueue.WakeupQueue()
+        self._initSubscribers()
+
+        self._UDPSendMulticast = self._multicastOptions()
+        (self._UDPSendSocket, self._multicastGroup) = self._UDPSendOpen()
+        self._loopBatch = []
+        self._loopBatchSize = 0
+        self._loopBatchTimer = None
+
+        self._loop.addReader(self.qUDPSend, self._UDPLoopSend)
+
+    def _initSubscribers(self):
+        self._subscribers = Subscribers.SubscriberRegistry(self.settings.subscriberLease,
+                                                           self.settings.subscriberMaxLease,
+                                                           self.settings.maxSubscribers)
+
     def _startUDPSend(self):
         self.tUDPSend = threading.Thread(name='tUDPSendThread', target=self._UDPSendThread)
         self.tUDPSend.daemon = False
@@ -585,41 +748,6 @@ is running then run in the current terminal
         except:
             self.logger.exception("Failed to Start the UDP send thread")
 
-    def _initSerialThread(self):
-        """ Setup the serial port and start the thread
-        """
-        self.logger.info("Serial port init")
-
-        # serial port base on config file, thread handles opening and closing
-        self._serial = serial.Serial()
-        if (self.args.port):
-            self._serial.port = self.args.port
-        else:
-            self._serial.port = self.config.get('Serial', 'port')
-
-        self._serial.baudrate = self.config.get('Serial', 'baudrate')
-        self._serial.timeout = self._serialTimeout
-        # setup queue
-        self.qSerialOut = Queue.Queue()
-        self.qSerialToQuery = Queue.Queue()
-        self.qReplyEncryption = Queue.Queue()
-        #setup flags
-        self.fSetRadioEncryption = threading.Event()
-        self.fRadioEncryptionDone = threading.Event()
-
-        # setup thread
-        self.tSerialStop = threading.Event()
-
-        self._startSerial()
-
-    def _startSerial(self):
-        self.tSerial = threading.Thread(name='tSerial', target=self._SerialThread)
-        self.tSerial.daemon = False
-        try:
-            self.tSerial.start()
-        except:
-            self.logger.exception("Failed to Start the Serial thread")
-
     def _initUDPListenThread(self):
         """ Start the UDP Listen thread and queues
         """
@@ -629,6 +757,17 @@ is running then run in the current terminal
 
         self._startUDPListen()
 
+    def _initUDPListenLoop(self):
+        """ Have the event loop read the UDP listen socket
+        """
+        self.logger.info("UDP Listen event loop init")
+
+        self._UDPListenMulticast = self._multicastOptions()
+        self._UDPListenSocket = self._UDPListenOpen()
+        self._UDPListenPort = self.settings.listenPort
+        self._UDPReceiveBuffer = self.settings.receiveBuffer
+        self._loop.addReader(self._UDPListenSocket, self._UDPLoopListen)
+
     def _startUDPListen(self):
         self.tUDPListen = threading.Thread(name='tUDPListen', target=self._UDPListenThread)
         self.tUDPListen.daemon = False
@@ -637,194 +776,64 @@ is running then run in the current terminal
         except:
             self.logger.exception("Failed to Start the UDP listen thread")
 
-    def _DCRThread(self):
-        """ Device Configuration Request thread
-            Main logic for dealing with DCR's
-            We check the incoming qDCRRequest and qDCRSerial
+    def _initStream(self):
+        """ Start the newline delimited JSON stream over TCP and/or a Unix socket
         """
-        self.logger.info("tDCR: DCR thread started")
-
-        while (not self.tDCRStop.is_set()):
-            # do we have a request
-            if not self.qDCRRequest.empty():
-                self.logger.debug("tDCR: Got a request to process")
-                # if we are not in the middle of an DCR
-                if not self._currentDCR:
-                    # lets get it out the queue and start processing it
-                    try:
-                        self._currentDCR = self.qDCRRequest.get_nowait()
-                    except Queue.Empty:
-                        self.logger.debug("tDCR: Failed to get item from qDCRRequest")
-                    else:
-                        # check the keepAwake
-                        if self._currentDCR['data'].get('keepAwake', None) == 1:
-                            self.logger.debug("tDCR: keepAwake turned on")
-                            self.fKeepAwake.set()
-                        elif self._currentDCR['data'].get('keepAwake', None) == 0:
-                            self.logger.debug("tDCR: keepAwake turned off")
-                            self.fKeepAwake.clear()
-
-                        if self._currentDCR['data'].get('toQuery', False):
-                            # make place for replies later
-                            self._currentDCR['data']['replies'] = {}
-                            # use a copy in case we are adding ENC stuff
-                            toQuery = list(self._currentDCR['data']['toQuery'])
-                            if self._currentDCR['data'].has_key('setENC'):
-                                if self._encryption:
-                                    self.logger.debug("tDCR: auto setting encryption")
-                                    toQuery.insert(0, {"command":"ENC", "value":"ON"})
-                                    for (index, hex) in enumerate(list(self._chunkstring(self._encryptionKey, 6))):
-                                        toQuery.insert(0, {"command":"EN{}".format(index+1), "value":hex})
-
-                            # pass queries on to the serial thread to send out
-                            try:
-                                self.qSerialToQuery.put_nowait(toQuery)
-                            except Queue.Full:
-                                self.logger.debug("tDCR: Failed to put item onto toQuery as it's full")
-                            else:
-                                self.devType = self._currentDCR['data'].get('devType', None)
-                                # reset flags
-                                self.fAnsweredAll.clear()
-                                self.fRetryFail.clear()
-                                self.fTimeoutFail.clear()
-                                # start timer
-                                self._DCRCurrentTimeout = int(self._currentDCR['data'].get('timeout', self.config.get('DCR', 'timeout')))
-                                self._DCRStartTime = time()
-                                self.logger.debug("tDCR: started DCR timeout with period: {}".format(self._DCRCurrentTimeout))
-                        else:
-                            # no toQuery section, so reply with all done
-                            self._DCRReturnDCR("PASS")
-                        self.qDCRRequest.task_done()
-
-            # do we have a reply from serial
-            while not self.qDCRSerial.empty():
-                self.logger.debug("tDCR: Something in qDCRSerial")
-                try:
-                    wirelessReply = self.qDCRSerial.get_nowait()
-                except Queue.Empty:
-                    self.logger.debug("tDCR: Failed to get item from qDCRSerial")
-                else:
-                    self.logger.debug("tDCR: Got {} to process".format(wirelessReply))
-                    if self._currentDCR:
-                        # we are working on a request check and store the reply
-                        for q in self._currentDCR['data']['toQuery']:
-                            if wirelessReply.strip('-').startswith(q['command']):
-                                self._currentDCR['data']['replies'][q['command']] = {'value': q.get('value', ""),
-                                                                                'reply': wirelessReply[len(q['command']):].strip('-')
-                                                                                }
-                                self.logger.debug("tDCR: Stored reply '{}':{}".format(q['command'], self._currentDCR['data']['replies'][q['command']]))
-                        # and reset the timeout
-                        self.logger.debug("tDCR: Reset timeout to 0")
-                        self._DCRStartTime = time()
-                    else:
-                        # drop it
-                        pass
-                    self.qDCRSerial.task_done()
-
-            # check the timeout
-            if self._currentDCR and ((time() - self._DCRStartTime) > self._DCRCurrentTimeout):
-                # if expired cancel the toQuery in tSerial
-                self.logger.debug("tDCR: DCR timeout expired")
-                self.fTimeoutFail.set()
-
-            # no point checking flags if we are not in the middle of a request
-            if self._currentDCR:
-                # has the serial thread finished getting all the query answers
-                if self.fAnsweredAll.is_set():
-                    # finished toQuery ok
-                    self.logger.debug("tDCR: Serial answered so send out json")
-                    self._DCRReturnDCR("PASS")
-                elif self.fRetryFail.is_set():
-                    # failed due to a message retry issue
-                    self.logger.warn("tDCR: Failed current DCR due to retry count")
-                    self._DCRReturnDCR("FAIL_RETRY")
-                elif self.fTimeoutFail.is_set():
-                    # failed due to expired timeout
-                    self.logger.warn("tDCR: Failed current DCR due to timeout")
-                    while not self.qSerialToQuery.empty():
-                        try:
-                            self.qSerialToQuery.get()
-                            self.logger.debug("tDCR: removed stale query from qSerialToQuery")
-                        except Queue.Empty:
-                            pass
-
-                    self._DCRReturnDCR("FAIL_TIMEOUT")
-
-            # wait a little
-            self.tDCRStop.wait(0.5)
-
-        self.logger.info("tDCR: Thread stopping")
-        return
-
-    def _DCRReturnDCR(self, state):
-        # prep the reply
-        self._currentDCR['timestamp'] = strftime("%d %b %Y %H:%M:%S +0000", gmtime())
-        self._currentDCR['network'] = self._network
-        self._currentDCR['keepAwake'] = 1 if self.fKeepAwake.is_set() else 0
-        self._currentDCR['data']['state'] = state
-
-        # encode json
-        jsonout = json.dumps(self._currentDCR)
-
-        # send to UDP thread
+        if not self.config.getboolean('Stream', 'stream_enable'):
+            return
+        self.logger.info("Stream init")
+        tcpAddress = None
+        if self.config.getint('Stream', 'tcp_port'):
+            tcpAddress = ('127.0.0.1' if self.config.getboolean('Stream', 'tcp_local_only') else '',
+                          self.config.getint('Stream', 'tcp_port'))
+        stream = Stream.StreamServer(tcpAddress,
+                                     self.config.get('Stream', 'unix_socket'),
+                                     self.config.getint('Stream', 'buffer_size'),
+                                     self.config.get('Stream', 'overflow').lower(),
+                                     self.config.getint('Stream', 'max_clients'))
         try:
-            self.qUDPSend.put_nowait(jsonout)
-        except Queue.Full:
-            self.logger.warn("tDCR: Failed to put {} on qUDPSend as it's full".format(wirelessMsg))
-        else:
-            self.logger.debug("tDCR: Sent DCR reply to qUDPSend")
-            # and clear DCR and SentAll flag
-            self._currentDCR = False
+            stream.start()
+        except socket.error:
+            self.logger.exception("Failed to start the stream")
+            return
+        self._stream = stream
 
     def _UDPSendThread(self):
         """ UDP Send thread
         """
         self.logger.info("tUDPSend: Send thread started")
-        # setup the UDP send socket
-        try:
-            UDPSendSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        except socket.error as msg:
-            self.logger.critical("tUDPSend: Failed to create socket, Exiting. Error code : {} Message : {} ".format(msg[0], msg[1]))
-            self.die()
-
-        UDPSendSocket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        UDPSendSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-
-        sendPort = int(self.config.get('UDP', 'send_port'))
+        multicastOptions = self._multicastOptions()
+        (UDPSendSocket, multicastGroup) = self._UDPSendOpen()
 
+        # qUDPSend holds (json, message) the encoded JSON and the dict it came from
+        # replies to a MessageBridge request add the address of the sender (json, message, replyTo)
+        # a message that did not fit in the last batch, sent next
+        carry = None
         while (not self.tUDPSendStop.is_set()):
-            try:
-                message = self.qUDPSend.get(timeout=1)     # block for up to 1 seconds
-            except Queue.Empty:
-                # UDP Send queue was empty
-                # extrem debug message
-                # self.logger.debug("tUDPSend: queue is empty")
-                pass
+            if self._multicastOptions() != multicastOptions:
+                # delivery changed by a reload
+                multicastOptions = self._multicastOptions()
+                (UDPSendSocket, multicastGroup) = self._UDPSendReopen(UDPSendSocket)
+            if carry:
+                item = carry
+                carry = None
             else:
-                self.logger.debug("tUDPSend: Got json to send: {}".format(message))
-                if self.config.getboolean('UDP', 'use_local_only'):
-                    try:
-                        UDPSendSocket.sendto(message, ('127.0.0.255', sendPort))
-                        self.logger.debug("tUDPSend: Put message out via UDP to local only")
-                    except socket.error as msg:
-                        self.logger.warn("tUDPSend: Failed to send via UDP local only. Error code : {} Message: {}".format(msg[0], msg[1]))
-                else:
-                    try:
-                        UDPSendSocket.sendto(message, ('<broadcast>', sendPort))
-                        self.logger.debug("tUDPSend: Put message out via UDP")
-                    except socket.error as msg:
-                        if msg[0] == 101:
-                            try:
-                                self.logger.warn("tUDPSend: External network unreachable retrying on local interface only")
-                                UDPSendSocket.sendto(message, ('127.0.0.255', sendPort))
-                                self.logger.debug("tUDPSend: Put message out via UDP to local only")
-                            except socket.error as msg:
-                                self.logger.warn("tUDPSend: Failed to send via UDP local only. Error code : {} Message: {}".format(msg[0], msg[1]))
-                        else:
-                            self.logger.warn("tUDPSend: Failed to send via UDP. Error code : {} Message: {}".format(msg[0], msg[1]))
+                try:
+                    item = self.qUDPSend.get(timeout=1)     # block for up to 1 seconds
+                except Queue.Empty:
+                    # UDP Send queue was empty
+                    # extrem debug message
+                    # self.logger.debug("tUDPSend: queue is empty")
+                    continue
                 # tidy up
                 self.qUDPSend.task_done()
 
+            if self.settings.batchMode and item[1]['type'] == "WirelessMessage":
+                (batch, carry) = self._UDPCollectBatch(item)
+            else:
+                batch = [item]
+            self._UDPSendBatch(UDPSendSocket, batch, multicastGroup)
+
         self.logger.info("tUDPSend: Thread stopping")
         try:
             UDPSendSocket.close()
@@ -832,458 +841,282 @@ is running then run in the current terminal
             self.logger.exception("tUDPSend: Failed to close socket")
         return
 
-    def _SerialThread(self):
-        """ Serial Thread
+    def _UDPSendOpen(self):
+        """ Setup the UDP send socket
+            Returns the socket and the multicast group to send to (None when broadcasting)
         """
-        self.logger.info("tSerial: Serial thread started")
-        self._SerialToQueryState = 0
-        self._SerialToQuery = []
-        self.tSerialStop.wait(1)
-        checkEncKeyCounter = 0
-
         try:
-            while (not self.tSerialStop.is_set()):
-                # open the port
-                try:
-                    self._serial.open()
-                    self.logger.info("tSerial: Opened the serial port")
-                except serial.SerialException:
-                    self.logger.exception("tSerial: Failed to open port {} Exiting".format(self._serial.port))
-                    self._serial.close()
-                    self.die()
-
-                self.tSerialStop.wait(0.1)
-
-                # we clear out any stale serial messages that might be in the buffer
-                self._serial.flushInput()
-
-                # check the ATLH settings
-                retries = 0
-                while not self._SerialCheckATLH():
-                    retries += 1
-                    self.logger.error("tSerial: Retrying Check ATLH attempt: {}".format(retries))
-                    if retries == self._ATLHRetriesCount:
-                        self.logger.critical("tSerial: Error on Check ATLH")
-                        self.die()
-
-                # main serial processing loop
-                while self._serial.isOpen() and not self.tSerialStop.is_set():
-                    # extrem debug message
-                    #self.logger.debug("tSerial: check serial port")
-                    if self._serial.inWaiting():
-                        self._SerialReadIncomingLanguageOfThings()
-                    #check if there's any change on the Encryption Key to set on radio
-                    elif self.fSetRadioEncryption.is_set():
-                        self.logger.debug("tSerial: fSetRadioEncryption set")
-                        self.fRadioEncryptionDone.clear()
-                        self.SetRadioEncryption()
-                        self.fRadioEncryptionDone.set() #informs the main thread that has some encryption result to send
-
-                    # do we have anything to send
-                    if not self.qSerialOut.empty():
-                        self.logger.debug("tSerial: got something to send")
-                        try:
-                            wirelessMsg = self.qSerialOut.get_nowait()
-                            self._serial.write(wirelessMsg)
-                        except Queue.Empty:
-                            self.logger.debug("tSerial: failed to get item from queue")
-                        except Serial.SerialException as e:
-                            self.logger.warn("tSerial: failed to write to the serial port {}: {}".format(self._serial.port, e))
-                        else:
-                             self.logger.debug("tSerial: TX:{}".format(wirelessMsg))
-                             self.qSerialOut.task_done()
-
-                    # sleep for a little
-                    if self._SerialToQueryState or self._serial.inWaiting():
-                        self.tSerialStop.wait(0.01)
-                    else:
-                        self.tSerialStop.wait(0.1)
-
-                # port closed for some reason (or tSerialStop), if tSerialStop is not set we will try reopening
-        except IOError:
-            self.logger.exception("tSerial: IOError on serial port")
-
-        # close the port
-        self.logger.info("tSerial: Closing serial port")
-        self._serial.close()
-
-        self.logger.info("tSerial: Thread stoping")
-        return
-
-    def SetRadioEncryption(self):
-        self.logger.info("tSerial: SetRadioEncryption: Checking Serial Number of the radio")
-        self.fSetRadioEncryption.clear()
-        changesToCommit = False
+            UDPSendSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        except socket.error as msg:
+            self.logger.critical("tUDPSend: Failed to create socket, Exiting. Error code : {} Message : {} ".format(msg[0], msg[1]))
+            self.die()
 
-        if not self._setRadioEncryption:
-            self.logger.error("tSerial: SetRadioEncryption: Encryption Key not received")
-            return False
+        UDPSendSocket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        UDPSendSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        return (UDPSendSocket, self._UDPSetupMulticastSend(UDPSendSocket))
 
+    def _UDPSendReopen(self, UDPSendSocket):
+        """ Swap the UDP send socket for a new one after delivery, the
+            multicast group, TTL or interface are changed by a reload
+            Returns the new socket and multicast group as _UDPSendOpen() does
+        """
+        self.logger.info("tUDPSend: Delivery changed, reopening the send socket")
         try:
-            if self.args.gpio:
-                at = AT.AT(self._serial, self.logger, self.tSerialStop, self.args.gpio)
-            elif self.config.getboolean('Serial', 'at_gpio'):
-                at = AT.AT(self._serial, self.logger, self.tSerialStop, self.config.getint('Serial', 'at_gpio_pin'))
-            else:
-                at = AT.AT(self._serial, self.logger, self.tSerialStop)
-        except:
-            at = AT.AT(self._serial, self.logger, self.tSerialStop)
-
-        if at.enterATMode():
-            if self._setRadioEncryption.has_key('PANID'):
-                atid = at.sendATWaitForResponse("ATID")
-                if atid:
-                    if self._setRadioEncryption['PANID'] in atid:
-                        self.logger.debug("tSerial: SetRadioEncryption: PANID already Set")
-                    else:
-                        if at.sendATWaitForOK("PANID{}".format(self._setRadioEncryption['PANID'])):
-                            self._panID = self._setRadioEncryption['PANID']
-                            changesToCommit = True
-                        else:
-                            self.logger.error("tSerial: SetRadioEncryption: Error setting PANID")
-                else:
-                    self.logger.error("tSerial: SetRadioEncryption: Error getting ATID response")
-
-            if self._setRadioEncryption.has_key('encryptionSet'):
-                atee = at.sendATWaitForResponse("ATEE")
-                if atee:
-                    try:
-                        if self._setRadioEncryption['encryptionSet'] == bool(int(atee)):
-                            self.logger.debug("tSerial: SetRadioEncryption: Encryption already Set")
-                        else:
-                            if at.sendATWaitForOK("ATEE{}".format(int(self._setRadioEncryption['encryptionSet']))):
-                                self._encryption = self._setRadioEncryption['encryptionSet']
-                                changesToCommit = True
-                            else:
-                                self.logger.error("tSerial: SetRadioEncryption: Error setting encryptionSet")
-                    except ValueError:
-                        self.logger.error("tSerial: SetRadioEncryption: Wrong value on encryptionSet: {}".format(self._setRadioEncryption['encryptionSet']))
-                else:
-                    self.logger.error("tSerial: SetRadioEncryption: Error getting ATEE response")
-
-            if self._setRadioEncryption.has_key('encryptionKey'):
-                status = "Fail"
-                atek = at.sendATWaitForResponse("ATEK")
-                if atek:
-                    self.logger.debug("atek {}".format(atek))
-                    if self._setRadioEncryption['encryptionKey'] in atek:
-                        self.logger.debug("tSerial: SetRadioEncryption: Encryption Key already Set")
-                        status = "Pass"
-                    else:
-                        if at.sendATWaitForOK("ATEK{}".format(self._setRadioEncryption['encryptionKey'])):
-                            self._encryptionKey = self._setRadioEncryption['encryptionKey']
-                            status = "Pass"
-                            changesToCommit = True
-                        else:
-                            self.logger.error("tSerial: SetRadioEncryption: Error setting encryption key")
-                else:
-                    self.logger.error("tSerial: SetRadioEncryption: Error getting ATEK response")
-                self._setRadioEncryption['encryptionKey'] = status
+            UDPSendSocket.close()
+        except socket.error:
+            self.logger.exception("tUDPSend: Failed to close socket")
+        return self._UDPSendOpen()
 
-            if changesToCommit:
-                if at.sendATWaitForOK("ATAC"):
-                    if at.sendATWaitForOK("ATWR"):
-                        self.logger.debug ("tSerial: SetRadioEncryption: Encryption settings commited")
-        else:
-            self.logger.error("tSerial: SetRadioEncryption: Failed on enter AT Mode")
-            at.leaveATMode() #make sure the radio is not stucked on AT mode
-            return False
+    def _UDPSendBatch(self, UDPSendSocket, batch, multicastGroup):
+        """ Send a list of qUDPSend items out to the stream, the network and any subscribers
+        """
+        if self.debugLog:
+            self.logger.debug("tUDPSend: Got json to send: {}".format(batch))
+        settings = self.settings
+        if self._stream:
+            for item in batch:
+                self._stream.publish(item[0], item[1])
+        if settings.broadcast:
+            self._UDPSend(UDPSendSocket, self._encodeWirelessMessageBatch([item[0] for item in batch]),
+                          settings.sendPort, multicastGroup, settings.useLocalOnly)
+            datagram = WireFormat.WireFormat.encode(batch) if settings.binaryPort else None
+            if datagram:
+                self._UDPSend(UDPSendSocket, datagram,
+                              settings.binaryPort, multicastGroup, settings.useLocalOnly)
+        if len(self._subscribers) or not settings.broadcast:
+            self._UDPSendSubscribers(UDPSendSocket, batch, not settings.broadcast)
+
+    def _UDPLoopSend(self):
+        """ Event loop callback when something is put on qUDPSend
+            In batch mode WirelessMessage's are held for up to batch_window
+            like _UDPCollectBatch() does for the send thread
+        """
+        self.qUDPSend.clearWakeup()
+        settings = self.settings
+        while True:
+            try:
+                item = self.qUDPSend.get_nowait()
+            except Queue.Empty:
+                break
+            self.qUDPSend.task_done()
+
+            if not settings.batchMode or item[1]['type'] != "WirelessMessage":
+                # keep the order, anything already batched goes first
+                self._UDPLoopFlush()
+                self._UDPSendBatch(self._UDPSendSocket, [item], self._multicastGroup)
+                continue
+
+            if self._loopBatch and self._loopBatchSize + len(item[0]) + 2 > settings.batchMaxBytes:
+                self._UDPLoopFlush()
+            if not self._loopBatch:
+                self._loopBatchSize = self._batchOverhead + len(item[0])
+                self._loopBatchTimer = self._loop.callLater(settings.batchWindow, self._UDPLoopFlush)
+            else:
+                self._loopBatchSize += len(item[0]) + 2
+            self._loopBatch.append(item)
+            if len(self._loopBatch) >= settings.batchMaxMessages:
+                self._UDPLoopFlush()
 
-        at.leaveATMode()
-        return True
+    def _UDPLoopFlush(self):
+        """ Send the batch being collected by _UDPLoopSend()
+        """
+        if self._loopBatchTimer:
+            self._loopBatchTimer.cancel()
+            self._loopBatchTimer = None
+        if self._loopBatch:
+            batch = self._loopBatch
+            self._loopBatch = []
+            self._UDPSendBatch(self._UDPSendSocket, batch, self._multicastGroup)
+
+    def _UDPSetupMulticastSend(self, UDPSendSocket):
+        """ Set the TTL and interface for multicast delivery
+            Returns the group to send to, None when broadcasting
+        """
+        settings = self.settings
+        if not settings.multicast:
+            return None
+        try:
+            UDPSendSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, settings.multicastTTL)
+            UDPSendSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            UDPSendSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                                     socket.inet_aton(settings.multicastInterface))
+        except socket.error as msg:
+            self.logger.error("tUDPSend: Failed to setup multicast. Error code : {} Message : {}".format(msg[0], msg[1]))
+        self.logger.info("tUDPSend: Sending to multicast group {} TTL {}".format(settings.multicastGroup, settings.multicastTTL))
+        return settings.multicastGroup
 
-    def _SerialCheckATLH(self):
-        """ check and possible set the the ATLH setting on the radio
+    def _multicastOptions(self):
+        """ The settings the send socket and the listen socket's group
+            membership are set up from, to spot when a reload changes them
         """
-        self.logger.info("tSerial: Setting ATLH1")
+        settings = self.settings
+        return (settings.multicast, settings.multicastGroup, settings.multicastTTL, settings.multicastInterface)
 
-        self._serial.flushInput()
+    def _UDPRejoinMulticast(self, UDPListenSocket, previous):
+        """ Leave the multicast group the listen socket joined with the
+            previous _multicastOptions() and join the one set now
+            Returns the _multicastOptions() joined with
+        """
+        options = self._multicastOptions()
+        (multicast, group, ttl, interface) = previous
+        if multicast:
+            try:
+                UDPListenSocket.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP,
+                                           socket.inet_aton(group) + socket.inet_aton(interface))
+            except socket.error as msg:
+                self.logger.warn("tUDPListen: Failed to leave multicast group {}. Error code : {} Message : {}".format(group, msg[0], msg[1]))
+            else:
+                self.logger.info("tUDPListen: Left multicast group {}".format(group))
+        self._UDPJoinMulticast(UDPListenSocket)
+        return options
 
+    def _UDPJoinMulticast(self, UDPListenSocket):
+        """ Join the multicast group so JSON sent to it by other programs is received
+        """
+        if not self.settings.multicast:
+            return
+        group = self.settings.multicastGroup
         try:
-            if self.args.gpio:
-                at = AT.AT(self._serial, self.logger, self.tSerialStop, self.args.gpio)
-            elif self.config.getboolean('Serial', 'at_gpio'):
-                at = AT.AT(self._serial, self.logger, self.tSerialStop, self.config.getint('Serial', 'at_gpio_pin'))
-            else:
-                at = AT.AT(self._serial, self.logger, self.tSerialStop)
-        except:
-            at = AT.AT(self._serial, self.logger, self.tSerialStop)
+            UDPListenSocket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                                       socket.inet_aton(group) + socket.inet_aton(self.settings.multicastInterface))
+        except socket.error as msg:
+            self.logger.error("tUDPListen: Failed to join multicast group {}. Error code : {} Message : {}".format(group, msg[0], msg[1]))
+        else:
+            self.logger.info("tUDPListen: Joined multicast group {}".format(group))
 
-        if at.enterATMode():
+    def _UDPSend(self, UDPSendSocket, message, sendPort, multicastGroup=None, useLocalOnly=False):
+        """ Send a single datagram out as a broadcast, or to the multicast group if given
+        """
+        if multicastGroup:
             try:
-                self.radioFirmwareVersion = at.sendATWaitForResponse("ATVR")
-                if not self.radioFirmwareVersion:
-                    self.logger.error("tSerial: Radio Firmware Version not valid")
-                    return False
-            except:
-                self.logger.error("tSerial: Error obtaining Radio Firmware Version")
-                return False
-
-            fwVersion = self.radioFirmwareVersion.split('B',1)[0]
-            if '0.' in fwVersion:
-                fwVersion = fwVersion.split('0.',1)[1]
-
-            if ("SRFV2" in self.radioFirmwareVersion) and (fwVersion >= 97):
-                serialNumberCommand = "ATSF"    # SRF fixed serial number (only avalible on SRFV2 firmware 97 or later)
-            else:
-                serialNumberCommand = "ATSN"    # SRF user settable serial number
-
+                UDPSendSocket.sendto(message, (multicastGroup, sendPort))
+                self.logger.debug("tUDPSend: Put message out via UDP multicast")
+            except socket.error as msg:
+                self.logger.warn("tUDPSend: Failed to send via UDP multicast. Error code : {} Message: {}".format(msg[0], msg[1]))
+        elif useLocalOnly:
             try:
-                self.radioSerialNumber = at.sendATWaitForResponse(serialNumberCommand)
-                if not self.radioSerialNumber:
-                    self.logger.error("tSerial: Radio Serial Number not valid")
-                    return False
-            except:
-                self.logger.error("tSerial: Error obtaining Radio Serial Number")
-                return False
-
-            if not self.fNetworkNameSet.is_set():
-                if self.args.network or self.config.getboolean('Serial', 'network_use_radio_serial_number'):
+                UDPSendSocket.sendto(message, ('127.0.0.255', sendPort))
+                self.logger.debug("tUDPSend: Put message out via UDP to local only")
+            except socket.error as msg:
+                self.logger.warn("tUDPSend: Failed to send via UDP local only. Error code : {} Message: {}".format(msg[0], msg[1]))
+        else:
+            try:
+                UDPSendSocket.sendto(message, ('<broadcast>', sendPort))
+                self.logger.debug("tUDPSend: Put message out via UDP")
+            except socket.error as msg:
+                if msg[0] == 101:
                     try:
-                        self._network = self.radioSerialNumber
-                    except:
-                        self.logger.error("tSerial: Error setting Network as radio Serial Number")
-                        self._network = self.config.get('Serial', 'network')
-                else:
-                    self._network = self.config.get('Serial', 'network')
-
-                self.fNetworkNameSet.set()  #informs the network now has a value
-
-            self.logger.info("tSerial: Radio Firmware Version: {}".format(self.radioFirmwareVersion))
-            self.logger.info("tSerial: Radio Serial Number: {}".format(self.radioSerialNumber))
-            #ask for the ATLH
-            atlh = at.sendATWaitForResponse("ATLH")
-            if atlh:
-                if atlh != "1": #if the ATLH returns diff from 1, we force the 1 status
-                    if at.sendATWaitForOK("ATLH1"):
-                        if at.sendATWaitForOK("ATAC"):
-                            if at.sendATWaitForOK("ATWR"):
-                                self.logger.debug("SerialCheckATLH: ATLH1 set")
-            else:
-                self.logger.error("tSerial: ATLH returned False, check radio firmware version")
-                return False
-
-            self._panID = at.sendATWaitForResponse("ATID")
-            if not self._panID:
-                self.logger.error("tSerial: Invalid PANID")
-                return False
-
-            self._encryption = at.sendATWaitForResponse("ATEE")
-            if not self._encryption:
-                self.logger.error("tSerial: Invalid Encryption")
-                return False
-            self._encryption = bool(int(self._encryption)) #convert the received encryption to bool
-
-            self._encryptionKey = at.sendATWaitForResponse("ATEK")
-            if not self._encryptionKey:
-                self.logger.error("tSerial: Invalid encryptionKey")
-                return False
-
-            at.leaveATMode()
-            return True
-
-        self.logger.debug("tSerial: Failed to enter on AT Mode")
-        return False
-
-
-
-    def _SerialReadIncomingLanguageOfThings(self):
-        char = self._serial.read()  # should not time out but we should check anyway
-        self.logger.debug("tSerial: RX:{}".format(char))
-
-        if char == 'a':
-            # this should be the start of a Language of Things message
-            # read 11 more or time out
-            wirelessMsg = "a"
-            count = 0
-            while count < 11:
-                char = self._serial.read()
-                if not char:
-                    self.logger.debug("tSerial: RX:{}".format(char))
-                    return
-
-                if char == 'a':
-                    # start again and
-                    count = 0
-                    wirelessMsg = "a"
-                    self.logger.debug("tSerial: RX:{}".format(char))
-                elif (count == 0 or count == 1) and char in self._validID:
-                    # we have a valid ID
-                    wirelessMsg += char
-                    count += 1
-                elif count >= 2 and char in self._validData:
-                    # we have a valid data
-                    wirelessMsg += char
-                    count +=1
-                else:
-                    self.logger.debug("tSerial: RX:{}".format(wirelessMsg[1:] + char))
-                    return
-
-            self.logger.debug("tSerial: RX:{}".format(wirelessMsg[1:]))
-
-            if len(wirelessMsg) == 12:  # just double check length
-                if wirelessMsg[1:3] == "??":
-                    self._SerialProcessQQ(wirelessMsg[3:].strip("-"))
+                        self.logger.warn("tUDPSend: External network unreachable retrying on local interface only")
+                        UDPSendSocket.sendto(message, ('127.0.0.255', sendPort))
+                        self.logger.debug("tUDPSend: Put message out via UDP to local only")
+                    except socket.error as msg:
+                        self.logger.warn("tUDPSend: Failed to send via UDP local only. Error code : {} Message: {}".format(msg[0], msg[1]))
                 else:
-                    #now will check if there's any message to be sent on the "sendOn" queue
-                    if wirelessMsg[1:3] in self._sendOnIDs:
-                        self.sendOnForMatchedID(wirelessMsg[1:3], wirelessMsg[3:].strip("-"))
-                    # not a configme Language of Things message so send out via UDP WirelessMessage
-                    try:
-                        self.qUDPSend.put_nowait(self.encodeWirelessMessageJson(wirelessMsg, self._network))
-                    except Queue.Full:
-                        self.logger.warn("tSerial: Failed to put {} on qUDPSend as it's full".format(wirelessMsg))
+                    self.logger.warn("tUDPSend: Failed to send via UDP. Error code : {} Message: {}".format(msg[0], msg[1]))
 
-    def _SerialProcessQQ(self, wirelessMsg):
-        """ process an incoming ?? Language of Things message
+    def _UDPSendSubscribers(self, UDPSendSocket, batch, replies):
+        """ Unicast to each subscriber the messages from batch that it wants
+            if replies is set a reply also goes straight to whoever asked
         """
-        # has the timeout expired
-        if not self.fTimeoutFail.is_set():
-            if self._SerialToQueryState:
-                # was it a reply to our DTY test
-                if self.devType and (not self._SerialDTYSync):
-                    # we should have a reply to DTY
-                    if wirelessMsg.startswith("DTY"):
-                        if wirelessMsg[3:] == self.devType:
-                            self._SerialDTYSync = True
-                            self.logger.debug("tSerial: Confirmed DTY, Send next toQuery, State: {}".format(self._SerialToQueryState))
-                            if not self._SerialSendDCRQuery():
-                                # failed to send question (serial or retry error)
-                                if self.fRetryFail.is_set():
-                                    # was a retry fail
-                                    # stop processing toQuery
-                                    self._SerialToQueryState = 0
-                            return
-
-                # check reply was to the last question
-                if wirelessMsg.startswith(self._SerialToQuery[self._SerialToQueryState-1]['command']) or (self._encryptionCommandMatch.match(self._SerialToQuery[self._SerialToQueryState-1]['command']) and wirelessMsg == "ENACK"):
-
-                    # special case for encryption
-                    if self._encryptionCommandMatch.match(self._SerialToQuery[self._SerialToQueryState-1]['command']):
-                        wirelessMsg = self._SerialToQuery[self._SerialToQueryState-1]['command'] + wirelessMsg
-
-                    # reduce the state count and reset retry count
-                    self._SerialToQueryState -= 1
-                    self._SerialRetryCount = 0
-
-                    # store the reply
-                    try:
-                        self.qDCRSerial.put_nowait(wirelessMsg)
-                    except Queue.Full:
-                        self.logger.warn("tSerial: Failed to put {} on qDCRSerial as it's full".format(wirelessMsg))
-
-                    # if we have replies for all state == 0:
-                    if self._SerialToQueryState == 0:
-                        # sent and received all
-                        self.fAnsweredAll.set()
-                        self.logger.debug("tSerial: Go answers for all toQuery")
-                    # else we have a another query to send
-                    else:
-                        # send next
-                        self.logger.debug("tSerial: Send next toQuery, State: {}".format(self._SerialToQueryState))
-                        if not self._SerialSendDCRQuery():
-                            # failed to send question (serial error)
-                            pass
-                # else if was not our answer so send it again
-                elif wirelessMsg == "CONFIGME":
-                    if self.devType:
-                        # out of sync should we recheck DTY?
-                        self._SerialDTYSync = False
-                        self.logger.debug("tSerial: Checking DTY again before sending next toQuery")
-                        self._SerialSendDTY()
-                        return
-                    else:
-                        # send last again
-                        self.logger.debug("tSerial: Retry toQuery, State: {}".format(self._SerialToQueryState))
-                        if not self._SerialSendDCRQuery():
-                            # failed to send question (serial or retry error)
-                            if self.fRetryFail.is_set():
-                                # was a retry fail
-                                # stop processing toQuery
-                                self._SerialToQueryState = 0
-                                return
-
-            elif wirelessMsg == "CONFIGME":
-                # do we have a waiting query and can we send one
-                try:
-                    self._SerialToQuery = self.qSerialToQuery.get_nowait()
-                except Queue.Empty:
-                    pass
-                else:
-                    self._SerialToQuery.reverse()
-                    self._SerialToQueryState = len(self._SerialToQuery)
-                    self.fAnsweredAll.clear()
-                    self.fRetryFail.clear()
-                    # clear retry count
-                    self._SerialRetryCount = 0
-                    # new query should we check DTY
-                    if self.devType:
-                        self.logger.debug("tSerial: Checking DTY before sending first toQuery")
-                        self._SerialSendDTY()
-                        return
-                    else:
-                        # send first
-                        self.logger.debug("tSerial: Send first toQuery, State: {}".format(self._SerialToQueryState))
-                        if not self._SerialSendDCRQuery():
-                            # failed to send question (serial or retry error)
-                            pass
-        elif self._SerialToQueryState:
-            # yes the time out expired, clear down any current toQuery
-            self.logger.debug("tSerial: toQuery Timed out")
-            self._SerialToQueryState = 0
-
-
-        # only thing left now would be a CONFIGME so do we need to send a keepAwake
-        if wirelessMsg == "CONFIGME" and self.fKeepAwake.is_set():
-            try:
-                self._serial.write("a??HELLO----")
-            except Serial.SerialException as e:
-                self.logger.warn("tSerial: failed to write to the serial port {}: {}".format(self._serial.port, e))
+        deliveries = {}
+        for item in batch:
+            subscribers = self._subscribers.match(item[1])
+            for subscriber in subscribers:
+                deliveries.setdefault((subscriber.address, subscriber.binary), []).append(item)
+            if replies and len(item) > 2 and item[2] not in [subscriber.address for subscriber in subscribers]:
+                deliveries.setdefault((item[2], False), []).append(item)
+        for (address, binary), items in deliveries.items():
+            if binary:
+                datagram = WireFormat.WireFormat.encode(items)
+                if datagram is None:
+                    continue
             else:
-                self.logger.debug("tSerial: TX:a??HELLO-----")
-            return
-
-    def _SerialSendDCRQuery(self):
-        """ send out the next query in the current DCR
+                datagram = self._encodeWirelessMessageBatch([item[0] for item in items])
+            try:
+                UDPSendSocket.sendto(datagram, address)
+                self.logger.debug("tUDPSend: Put message out via UDP to subscriber {}".format(address))
+            except socket.error as msg:
+                self.logger.warn("tUDPSend: Failed to send via UDP to subscriber {}. Error code : {} Message: {}".format(address, msg[0], msg[1]))
+
+    def _UDPCollectBatch(self, first):
+        """ Gather further WirelessMessage's from qUDPSend for up to batch_window
+            seconds after the first, stopping at the message or size limits
+            Only WirelessMessage's are batched, replies to DCR and MessageBridge
+            requests always go out on their own
+            Returns the list of (json, message) and any item taken from the
+            queue that did not fit (None if there was not one)
         """
-        # check retry count before sending
-        if self._SerialRetryCount < int(self.config.get('DCR', 'single_query_retry_count')):
-            wirelessToSend = "a??{}{}".format(self._SerialToQuery[self._SerialToQueryState-1]['command'],
-                                           self._SerialToQuery[self._SerialToQueryState-1].get('value', "")
-                                           )
-            while len(wirelessToSend) < 12:
-                wirelessToSend += "-"
+        settings = self.settings
+        window = settings.batchWindow
+        maxMessages = settings.batchMaxMessages
+        maxBytes = settings.batchMaxBytes
+
+        batch = [first]
+        size = self._batchOverhead + len(first[0])
+        end = time() + window
+        while len(batch) < maxMessages:
+            remaining = end - time()
             try:
-                self._serial.write(wirelessToSend)
-            except Serial.SerialException as e:
-                self.logger.warn("tSerial: failed to write to the serial port {}: {}".format(self._serial.port, e))
-                return False
-            else:
-                self.logger.debug("tSerial: TX:{}".format(wirelessToSend))
-                self._SerialRetryCount += 1
-                return True
-        self.logger.debug("tSerial: toQuery failed on retry count, letting tDCR know")
-        self.fRetryFail.set()
-        return False
-
-    def _SerialSendDTY(self):
-        """ Ask a Language of Things device it devType
+                if remaining > 0:
+                    item = self.qUDPSend.get(timeout=remaining)
+                else:
+                    item = self.qUDPSend.get_nowait()
+            except Queue.Empty:
+                break
+            self.qUDPSend.task_done()
+            if item[1]['type'] != "WirelessMessage" or size + len(item[0]) + 2 > maxBytes:
+                return (batch, item)
+            batch.append(item)
+            size += len(item[0]) + 2
+        return (batch, None)
+
+    def _encodeWirelessMessageBatch(self, batch):
+        """ Wrap already encoded WirelessMessage JSON strings into a single
+            WirelessMessageBatch, the messages are not decoded again
+            a single message is returned as it is
         """
-        try:
-          self._serial.write("a??DTY------")
-        except Serial.SerialException as e:
-          self.logger.warn("tSerial: failed to write to the serial port {}: {}".format(self._serial.port, e))
-          return False
-        else:
-          self.logger.debug("tSerial: TX:a??DTY------")
-          self._SerialDTYSync = False
-          return True
+        if len(batch) == 1:
+            return batch[0]
+        return '{"type": "WirelessMessageBatch", "messages": [' + ', '.join(batch) + ']}'
 
     def _UDPListenThread(self):
         """ UDP Listen Thread
         """
         self.logger.info("tUDPListen: UDP listen thread started")
 
+        listenMulticast = self._multicastOptions()
+        UDPListenSocket = self._UDPListenSocket = self._UDPListenOpen()
+        listenPort = self.settings.listenPort
+        receiveBuffer = self.settings.receiveBuffer
+
+        self.logger.info("tUDPListen: listening")
+        while not self.tUDPListenStop.is_set():
+            if self.settings.listenPort != listenPort:
+                # changed by a reload
+                listenPort = self.settings.listenPort
+                receiveBuffer = self.settings.receiveBuffer
+                listenMulticast = self._multicastOptions()
+                UDPListenSocket = self._UDPListenSocket = self._UDPListenMove(UDPListenSocket)
+            elif self._multicastOptions() != listenMulticast:
+                listenMulticast = self._UDPRejoinMulticast(UDPListenSocket, listenMulticast)
+            elif self.settings.receiveBuffer != receiveBuffer:
+                receiveBuffer = self.settings.receiveBuffer
+                self._UDPSetReceiveBuffer(UDPListenSocket)
+            datawaiting = select.select([UDPListenSocket], [], [], self._UDPListenTimeout)
+            if datawaiting[0]:
+                self._UDPListenDrain(UDPListenSocket)
+
+        self.logger.info("tUDPListen: Thread stopping")
+        try:
+            UDPListenSocket.close()
+        except socket.error:
+            self.logger.exception("tUDPListen: Failed to close socket")
+        return
+
+    def _UDPListenOpen(self, fatal=True):
+        """ Create and bind the UDP listen socket
+            If the port can not be bound we exit, or return None when not fatal
+        """
         try:
             UDPListenSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         except socket.error:
@@ -1296,191 +1129,396 @@ is running then run in the current terminal
             UDPListenSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
         try:
-            UDPListenSocket.bind(('', int(self.config.get('UDP', 'listen_port'))))
+            UDPListenSocket.bind(('', self.settings.listenPort))
         except socket.error:
+            if not fatal:
+                self.logger.exception("tUDPListen: Failed to bind port {}".format(self.settings.listenPort))
+                UDPListenSocket.close()
+                return None
             self.logger.exception("tUDPListen: Failed to bind port, Exiting")
             self.die()
 
+        self._UDPJoinMulticast(UDPListenSocket)
+        self._UDPSetReceiveBuffer(UDPListenSocket)
         UDPListenSocket.setblocking(0)
+        return UDPListenSocket
 
-        self.logger.info("tUDPListen: listening")
-        while not self.tUDPListenStop.is_set():
-            datawaiting = select.select([UDPListenSocket], [], [], self._UDPListenTimeout)
-            if datawaiting[0]:
-                (data, address) = UDPListenSocket.recvfrom(8192)
-                self.logger.debug("tUDPListen: Received JSON: {} From: {}".format(data, address))
+    def _UDPSetReceiveBuffer(self, UDPListenSocket):
+        """ Apply receive_buffer to the listen socket, 0 leaves it as it is
+        """
+        size = self.settings.receiveBuffer
+        if size <= 0:
+            return
+        try:
+            UDPListenSocket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+        except socket.error as msg:
+            self.logger.warn("tUDPListen: Failed to set receive buffer to {}. Error code : {} Message : {}".format(size, msg[0], msg[1]))
+            return
+        self.logger.info("tUDPListen: Receive buffer is {} bytes".format(
+                            UDPListenSocket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)))
 
-                # Test its actually json/catch errors
-                try :
-                    jsonin = json.loads(data)
-                except ValueError:
-                    self.logger.debug("tUDPListen: Invalid JSON received")
-                    continue
+    def _UDPListenDrain(self, UDPListenSocket):
+        """ Read and process every datagram waiting on the listen socket
+            up to _UDPListenDrainMax so one wakeup handles a burst
+        """
+        for n in xrange(self._UDPListenDrainMax):
+            try:
+                (data, address) = UDPListenSocket.recvfrom(8192)
+            except socket.error as msg:
+                if msg[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self.logger.debug("tUDPListen: Failed to read socket. Error code : {} Message : {}".format(msg[0], msg[1]))
+                return
+            self._UDPProcessDatagram(data, address)
+
+    def _UDPListenStats(self):
+        """ Counters for the udpStats MessageBridge request
+            kernelDrops is None where the system does not report it
+        """
+        stats = dict(self._UDPStats)
+        stats['kernelDrops'] = self._UDPKernelDrops(self._UDPListenSocket)
+        return stats
 
-                # TODO: error checking, dict should have keys for network
-                if (jsonin['network'] == self._network or
-                    jsonin['network'] == "ALL"):
-                    # yep its for our network or "ALL"
-                    # TODO: error checking, dict should have keys for type
-                    if jsonin['type'] == "WirelessMessage":
-                        self.logger.debug("tUDPListen: JSON of type WirelessMessage, send out messages")
-                        # got a WirelessMessage type json, need to generate the Language of Things message and
-                        # put them on the TX queue
-                        # TODO: error checking, dict should have keys for data
-                        if jsonin.has_key('sendOn'):
-                            self.processSendOnJSON(jsonin)
-                            continue
-
-                        for command in jsonin['data']:
-                            wirelessMsg = "a{}{}".format(jsonin['id'], command[0:9].upper())
-                            while len(wirelessMsg) <12:
-                                wirelessMsg += '-'
-                            try:
-                                self.qSerialOut.put_nowait(wirelessMsg)
-                            except Queue.Full:
-                                self.logger.debug("tUDPListen: Failed to put {} on qDCRSerial as it's full".format(wirelessMsg))
-                            else:
-                                self.logger.debug("tUDPListen: Put {} on qSerialOut".format(wirelessMsg))
-
-                    elif jsonin['type'] == "DeviceConfigurationRequest" and self.config.getboolean('DCR', 'dcr_enable'):
-                        # we have a DeviceConfigurationRequest pass in onto the DCR thread
-                        # TODO: error checking, dict should have keys for data
-                        self.logger.debug("tUDPListen: JSON of type DeviceConfigurationRequest, passing to qDCRRequest")
-                        try:
-                            self.qDCRRequest.put_nowait(jsonin)
-                        except Queue.Full:
-                            self.logger.debug("tUDPListen: Failed to put json on qDCRRequest")
-
-                    elif jsonin['type'] == "MessageBridge":
-                        # we have a MessageBridge json do stuff with it
-                        self.logger.debug("tUDPListen: JSON of type MessageBridge, passing to qMessageBridge")
-                        try:
-                            self.qMessageBridge.put(jsonin)
-                        except Queue.Full():
-                            self.logger.debug("tUDPListen: Failed to put json on qMessageBridge")
+    def _UDPKernelDrops(self, UDPListenSocket):
+        """ Datagrams the kernel dropped because the listen socket's
+            receive buffer was full, read from /proc/net/udp on Linux
+        """
+        if UDPListenSocket is None or not sys.platform.startswith('linux'):
+            return None
+        try:
+            inode = str(os.fstat(UDPListenSocket.fileno()).st_ino)
+            with open('/proc/net/udp') as f:
+                for line in f:
+                    fields = line.split()
+                    # sl local rem st tx:rx tr:tm retrnsmt uid timeout inode ref pointer drops
+                    if len(fields) > 12 and fields[9] == inode:
+                        return int(fields[12])
+        except (IOError, OSError, socket.error, ValueError):
+            pass
+        return None
 
-        self.logger.info("tUDPListen: Thread stopping")
+    def _UDPListenMove(self, UDPListenSocket):
+        """ Bind a new listen socket to listen_port after a reload
+            Returns the socket to use, the old one if the new port can not be bound
+        """
+        self.logger.info("tUDPListen: Moving to listen port {}".format(self.settings.listenPort))
+        newSocket = self._UDPListenOpen(fatal=False)
+        if newSocket is None:
+            return UDPListenSocket
         try:
             UDPListenSocket.close()
         except socket.error:
             self.logger.exception("tUDPListen: Failed to close socket")
-        return
+        return newSocket
 
-    def processSendOnJSON(self, jsonin):
-        _id = jsonin['id']
-        request = { _id:[] }
-        request[_id].append({
-                            "on":jsonin['sendOn'],
-                            "send":jsonin['data'][0]
-                            })
+    def _UDPLoopListen(self):
+        """ Event loop callback when the UDP listen socket has data
+        """
+        self._UDPListenDrain(self._UDPListenSocket)
+        # no main thread loop to answer MessageBridge JSON so do it now
+        while self._processMessageBridgeQueue():
+            pass
 
-        for i in range(0, len(jsonin['data'])-1):
-            request[_id].append({ "on":jsonin['data'][i], "send":jsonin['data'][i+1] })
+    def _UDPProcessDatagram(self, data, address):
+        """ Pass a received JSON on to the radios for its network
+        """
+        self._UDPStats['received'] += 1
+        if WireFormat.WireFormat.isBinary(data):
+            if self.debugLog:
+                self.logger.debug("tUDPListen: Received binary: {!r} From: {}".format(data, address))
+            try:
+                messages = WireFormat.WireFormat.decode(data)
+            except ValueError as e:
+                self._UDPStats['parseErrors'] += 1
+                self.logger.debug("tUDPListen: Invalid binary received: {}".format(e))
+                return
+            for jsonin in messages:
+                self._UDPRouteMessage(jsonin, address)
+            return
 
-        if not _id in self._sendOnIDs:
-            self._sendOnIDs.append(_id)
+        if self.debugLog:
+            self.logger.debug("tUDPListen: Received JSON: {} From: {}".format(data, address))
 
-        if self._sendOnRequests.has_key(_id):
-            for i in range(0, len(request[_id])):
-                self._sendOnRequests[_id].append(request[_id][i])
-        else:
-            self._sendOnRequests.update(request)
+        if not self._UDPWanted(data):
+            self._UDPStats['filtered'] += 1
+            return
 
-    def sendOnForMatchedID(self, _id, command):
-        if self._sendOnRequests.has_key(_id):
-            if self._sendOnRequests[_id][0]['on'] == command:
-                wirelessMsg = "a{}{}".format(_id, self._sendOnRequests[_id][0]['send'])
-                while len(wirelessMsg) <12:
-                    wirelessMsg += '-'
+        # Test its actually json/catch errors
+        try :
+            jsonin = json.loads(data)
+        except ValueError:
+            self._UDPStats['parseErrors'] += 1
+            self.logger.debug("tUDPListen: Invalid JSON received")
+            return
+        self._UDPRouteMessage(jsonin, address)
+
+    def _UDPWanted(self, data):
+        """ Cheap look at a received JSON before decoding it
+            False if it can not name one of our networks or a type we handle,
+            e.g. traffic for another Message Bridge's network. Anything that
+            passes, our own messages included, is still checked in full by
+            _UDPRouteMessage()
+        """
+        networkKeys = self._networkKeys
+        if networkKeys is not None and not any(key in data for key in networkKeys):
+            return False
+        return any(key in data for key in self._UDPTypeKeys)
 
+    def _UDPRouteMessage(self, jsonin, address):
+        """ Hand a received message to the radios for its network
+        """
+        try:
+            radios = self._radiosForNetwork(jsonin['network'])
+            jsonin['type']
+        except (KeyError, TypeError):
+            self._UDPStats['parseErrors'] += 1
+            self.logger.debug("tUDPListen: JSON without a network and type received")
+            return
+        if not radios:
+            self._UDPStats['filtered'] += 1
+        for radio in radios:
+            if len(radios) > 1:
+                # each radio gets its own copy as DCR and MessageBridge replies modify it
+                message = copy.deepcopy(jsonin)
+            else:
+                message = jsonin
+            # yep its for this radio's network or "ALL"
+            # TODO: error checking, dict should have keys for type
+            if message['type'] == "WirelessMessage":
+                self.logger.debug("tUDPListen: JSON of type WirelessMessage, send out messages")
+                # got a WirelessMessage type json, need to generate the Language of Things message and
+                # put them on the TX queue
+                radio.sendWirelessMessageJSON(message)
+
+            elif message['type'] == "DeviceConfigurationRequest" and self.settings.dcrEnable:
+                # we have a DeviceConfigurationRequest pass in onto the DCR thread
+                # TODO: error checking, dict should have keys for data
+                self.logger.debug("tUDPListen: JSON of type DeviceConfigurationRequest, passing to qDCRRequest")
+                radio.putDCRRequest(message)
+
+            elif message['type'] == "DeviceConfigurationBatch" and self.settings.dcrEnable:
+                # a list of devices to configure, each as a DCR
+                self.logger.debug("tUDPListen: JSON of type DeviceConfigurationBatch, passing to the DCR engine")
+                radio.putDCRBatch(message)
+
+            elif message['type'] == "MessageBridge":
+                # we have a MessageBridge json do stuff with it
+                self.logger.debug("tUDPListen: JSON of type MessageBridge, passing to qMessageBridge")
                 try:
-                    self.qSerialOut.put_nowait(wirelessMsg)
+                    self.qMessageBridge.put((radio, message, address))
                 except Queue.Full:
-                    self.logger.debug("checkSendOnQueue: Failed to put {} on qSerialOut as it's full".format(wirelessMsg))
-                else:
-                    self.logger.debug("checkSendOnQueue: Put {} on qSerialOut".format(wirelessMsg))
-                    # if message sent, remove from the sendOnRequest
-                    self._sendOnRequests[_id].pop(0)
-                    # if is the last message for that ID, remove it from the sendOn arrays
-                    if len(self._sendOnRequests[_id]) == 0:
-                        self._sendOnIDs.remove(_id)
-                        self._sendOnRequests.pop(_id)
-
-    def _processMessageBridgeMessage(self, message):
+                    self.logger.debug("tUDPListen: Failed to put json on qMessageBridge")
+
+    def _UDPLoopClose(self):
+        """ Send anything still batched and close the event loop's UDP sockets
+        """
+        try:
+            self._UDPLoopFlush()
+            self._UDPSendSocket.close()
+            self._UDPListenSocket.close()
+        except (AttributeError, socket.error):
+            pass
+
+    def _processMessageBridgeMessage(self, radio, message, address):
+        """ Answer a MessageBridge JSON, address is where it came from
+        """
         message['timestamp'] = strftime("%d %b %Y %H:%M:%S +0000", gmtime())
-        message['network'] = self._network
+        message['network'] = radio.network
         message['state'] = self._state
         if message.has_key('data'):
             result = {}
             if message['data'].has_key('request'):
                 for request in message['data']['request']:
                     if request == "deviceStore":
-                        result['deviceStore'] = self._deviceStore
+                        result['deviceStore'] = self._deviceStore.latest(radio.network)
                     # TODO: implement other MessageBridge "requests"
                     elif request == "PANID":
-                        result['PANID'] = self._panID
+                        result['PANID'] = radio.panID
                     elif request == "encryptionSet":
-                        result['encryptionSet'] = self._encryption
+                        result['encryptionSet'] = radio.encryption
                     elif request == "version":
                         result['version'] = self._version
                     elif request == "radioFirmwareVersion":
-                        result['radioFirmwareVersion'] = self.radioFirmwareVersion
+                        result['radioFirmwareVersion'] = radio.radioFirmwareVersion
                     elif request == "radioSerialNumber":
-                        result['radioSerialNumber'] = self.radioSerialNumber
+                        result['radioSerialNumber'] = radio.radioSerialNumber
+                    elif request == "serialStats":
+                        result['serialStats'] = radio.stats()
+                    elif request == "dcrCache":
+                        result['dcrCache'] = radio.dcrCache()
+                    elif request == "mailbox":
+                        result['mailbox'] = radio.mailboxStatus()
+                    elif request == "udpStats":
+                        result['udpStats'] = self._UDPListenStats()
+                    elif request == "streamStats":
+                        result['streamStats'] = self._stream.stats() if self._stream else None
+                    elif request == "subscribers":
+                        result['subscribers'] = [subscriber.toDict() for subscriber in self._subscribers.subscribers(radio.network)]
                 message['data']['result'] = result
 
+            elif message['data'].has_key('subscribe'):
+                message['data']['result'] = {'subscribe': self._subscribe(radio, message['data']['subscribe'], address)}
+
+            elif isinstance(message['data'].get('deviceStore'), dict):
+                message['data']['result'] = self._deviceStorePage(radio, message['data']['deviceStore'])
+
+            elif message['data'].has_key('history'):
+                message['data']['result'] = {'history': self._deviceHistory(radio, message['data']['history'])}
+
+            elif message['data'].has_key('unsubscribe'):
+                try:
+                    port = int(message['data']['unsubscribe'].get('port', address[1]))
+                except (AttributeError, TypeError, ValueError):
+                    port = address[1]
+                message['data']['result'] = {'unsubscribe': self._subscribers.unsubscribe((address[0], port), radio.network)}
+
             elif message['data'].has_key('set'):
-                self.logger.debug("tSerial: received 'set' on json")
-                self._setRadioEncryption = {}
+                self.logger.debug("tMain: received 'set' on json")
+                setRadioEncryption = {}
                 for _set in message['data']['set']:
                     self.logger.debug("message['data']['set'][_set] {}".format(message['data']['set'][_set]))
                     if _set == "PANID":
-                         self._setRadioEncryption['PANID'] = message['data']['set'][_set]
+                         setRadioEncryption['PANID'] = message['data']['set'][_set]
                     elif _set == "encryptionSet":
-                         self._setRadioEncryption['encryptionSet'] = message['data']['set'][_set]
+                         setRadioEncryption['encryptionSet'] = message['data']['set'][_set]
                     elif _set == "encryptionKey":
-                         self._setRadioEncryption['encryptionKey'] = message['data']['set'][_set]
-                #in case of a 'set' received, set the flag to set encryption on radio
-                self.fSetRadioEncryption.set()
+                         setRadioEncryption['encryptionKey'] = message['data']['set'][_set]
+                #in case of a 'set' received, the radio replies once the encryption is set
+                radio.requestSetRadioEncryption(setRadioEncryption, message, address)
+                return
 
+        # just report state
         try:
-            # just report state
-            if message.has_key('data') and message['data'].has_key('set'):
-                    queueName = "qReplyEncryption"
-                    self.qReplyEncryption.put(message)
-            else:
-                queueName = "qUDPSend"
-                self.qUDPSend.put(json.dumps(message))
+            self.qUDPSend.put((json.dumps(message), message, address))
         except Queue.Full:
-            self.logger.debug("tMain: Failed to put {} on {} as it's full".format(message, queueName))
+            self.logger.debug("tMain: Failed to put {} on qUDPSend as it's full".format(message))
         else:
-            self.logger.debug("tMain: Put {} on {}".format(message, queueName))
+            self.logger.debug("tMain: Put {} on qUDPSend".format(message))
+
+    def _subscribe(self, radio, filters, address):
+        """ Register the sender of a subscribe request to have the messages
+            matching filters unicast to it for the lease time
+            Returns the registration for the reply or False if refused
+        """
+        try:
+            subscriber = self._subscribers.subscribe((address[0], int(filters.get('port', address[1]))),
+                                                     radio.network, filters, filters.get('lease'))
+        except (AttributeError, TypeError, ValueError):
+            self.logger.warn("tMain: Invalid subscribe {} from {}".format(filters, address))
+            return False
+        if not subscriber:
+            self.logger.warn("tMain: Too many subscribers, refused {}".format(address))
+            return False
+        self.logger.info("tMain: Subscribed {} to network {}".format(subscriber.address, subscriber.network))
+        return subscriber.toDict()
+
+    def _deviceStorePage(self, radio, query):
+        """ Result for a paged deviceStore request, the devices that match
+            and a deviceStorePage with the cursor for the next page, how
+            many match in all and the sequence number to ask for changes since
+        """
+        try:
+            prefix = query.get('prefix', "")
+            cursor = query.get('cursor')
+            if not isinstance(prefix, basestring) or not isinstance(cursor, (basestring, type(None))):
+                raise TypeError
+            limit = max(1, min(int(query.get('limit', self._deviceStorePageSize)), self._deviceStorePageSize))
+            changedSince = query.get('changedSince')
+            if changedSince is not None:
+                changedSince = int(changedSince)
+            countOnly = bool(query.get('countOnly', False))
+        except (TypeError, ValueError):
+            self.logger.warn("tMain: Invalid deviceStore request {}".format(query))
+            return {'deviceStore': False}
+
+        (entries, cursor, count, sequence) = self._deviceStore.page(radio.network, prefix, cursor, limit,
+                                                                     changedSince, countOnly)
+        result = {'deviceStorePage': {'cursor': cursor, 'count': count, 'sequence': sequence}}
+        if not countOnly:
+            result['deviceStore'] = entries
+        return result
+
+    def _deviceHistory(self, radio, query):
+        """ Readings from the device store for a history request, by device ID
+            at most _historyMaxBytes of them once encoded so the reply fits a
+            datagram. Devices that do not fit are left for the next page, the
+            reply's cursor is the last device ID in this one (None if it is
+            the last page) and is sent back as cursor to get the next
+            Returns False if the query is invalid
+        """
+        try:
+            deviceIDs = query.get('id') or self._deviceStore.devices(radio.network)
+            if isinstance(deviceIDs, basestring):
+                deviceIDs = [deviceIDs]
+            if not isinstance(deviceIDs, list) or not all(isinstance(deviceID, basestring) for deviceID in deviceIDs):
+                raise TypeError
+            cursor = query.get('cursor')
+            if cursor is not None:
+                if not isinstance(cursor, basestring):
+                    raise TypeError
+                if cursor in deviceIDs:
+                    deviceIDs = deviceIDs[deviceIDs.index(cursor) + 1:]
+                else:
+                    # all devices are in ID order
+                    deviceIDs = [deviceID for deviceID in deviceIDs if deviceID > cursor]
+            last = max(0, int(query.get('last', 0)))
+            since = DeviceStore.DeviceStore.parseTime(query.get('since'))
+            prefix = query.get('prefix')
+            if not isinstance(prefix, (basestring, type(None))):
+                raise TypeError
+        except (AttributeError, TypeError, ValueError):
+            self.logger.warn("tMain: Invalid history request {}".format(query))
+            return False
+
+        devices = {}
+        remaining = self._historyMaxBytes
+        truncated = False
+        cursor = None
+        lastID = None
+        for deviceID in deviceIDs:
+            readings = self._deviceStore.history(radio.network, deviceID, last, since, prefix)
+            if not readings:
+                continue
+            # "ID":[...] plus a separating comma
+            sizes = [len(json.dumps(reading)) + 2 for reading in readings]
+            size = len(json.dumps(deviceID)) + 3 + sum(sizes)
+            if size > remaining:
+                if devices:
+                    # the rest on the next page
+                    cursor = lastID
+                    break
+                # one device with more than a page keeps its newest
+                while readings and size > remaining:
+                    size -= sizes.pop(0)
+                    readings.pop(0)
+                truncated = True
+                if not readings:
+                    continue
+            devices[deviceID] = readings
+            remaining -= size
+            lastID = deviceID
+        return {'devices': devices, 'truncated': truncated, 'cursor': cursor}
 
     def encodeWirelessMessageJson(self, message, network=None):
         """Encode a single Language of Things message into an outgoing JSON message
+           returns the JSON and the dict it was made from, ready for qUDPSend
             """
-        self.logger.debug("tSerial: JSON: encoding {} to json WirelessMessage".format(message))
-        jsonDict = {'type':"WirelessMessage"}
-        jsonDict['network'] = network if network else "DEFAULT"
-        jsonDict['timestamp'] = strftime("%d %b %Y %H:%M:%S +0000", gmtime())
-        jsonDict['id'] = message[1:3]
-        jsonDict['data'] = [message[3:].strip("-")]
+        if self.debugLog:
+            self.logger.debug("tSerial: JSON: encoding {} to json WirelessMessage".format(message))
+        (jsonout, jsonDict) = self._encoder.encode(message, network if network else "DEFAULT")
 
         if self._csvLog:
             self.csvLogger.info(jsonDict['timestamp']+','+jsonDict['id']+','+jsonDict['data'][0])
 
-        jsonout = json.dumps(jsonDict)
         self._updateDeviceStore(jsonDict)
         # extrem debugging
         # self.logger.debug("JSON: {}".format(jsonout))
 
-        return jsonout
+        return (jsonout, jsonDict)
 
     def _updateDeviceStore(self, message):
-        self._deviceStore[message['id']] = {'data': message['data'][0], 'timestamp': message['timestamp']}
-
-    def _chunkstring(self, string, length):
-        return (string[0+i:length+i] for i in range(0, len(string), length))
+        """ Keep the last message seen from each device, per network
+        """
+        self._deviceStore.add(message['network'], message['id'], message['data'][0], message['timestamp'], time())
 
     # catch errors and add logging
     def _makePidlockfile(self, path, acquire_timeout):
@@ -1523,6 +1561,10 @@ is running then run in the current terminal
         """
         # first stop the main thread from try to restart stuff
         self.tMainStop.set()
+        if signal_number is not None and self._loop and self._loop.running:
+            # the signal interrupted the event loop, start() calls us again once run() returns
+            self._loop.stop()
+            return
         # writes the config file
         self._writeConfig()
         # now stop the other threads
@@ -1531,21 +1573,20 @@ is running then run in the current terminal
             self.tUDPListen.join()
         except:
             pass
-        try:
-            self.tSerialStop.set()
-            self.tSerial.join()
-        except:
-            pass
-        try:
-            self.tDCRStop.set()
-            self.tDCR.join()
-        except:
-            pass
+        for radio in self._radios:
+            radio.stop()
         try:
             self.tUDPSendStop.set()
-            self.tUDPListen.join()
+            self.tUDPSend.join()
         except:
             pass
+        if self._loop:
+            self._UDPLoopClose()
+        if self._stream:
+            self._stream.stop()
+        if self.journal:
+            # after the radios have journaled what they still had to send
+            self.journal.close()
 
         if not self._background:
             if not sys.platform == 'win32':
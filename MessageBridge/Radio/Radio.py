@@ -0,0 +1,925 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" WirelessThings Message Bridge Radio
+    A single radio on a serial port and the Language of Things network it serves
+
+    Requires pySerial
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+from time import gmtime, strftime, time
+import errno
+import copy
+import Queue
+import serial
+import threading
+import select
+import json
+import logging
+import AT
+import LoTParser
+import TXQueue
+import Transport
+import DCR
+import Mailbox
+
+class Radio():
+    """ Serial and DCR logic for one radio
+
+    Each Radio looks after the following threads
+    Serial
+    DCR
+
+    or with the eventloop core registers the same work with the Message
+    Bridge EventLoop, see initSerialLoop() and initDCRLoop().
+
+    The Message Bridge owns the radios and shares its UDP sockets, device
+    store and logging between them. A radio reads its settings from its own
+    config section, [Serial] for the first radio or [Serial.<name>] for any
+    others, missing options are taken from [Serial].
+    """
+
+    _serialTimeout = 1     # serial port time out setting
+    _serialSelectTimeout = 1    # longest the serial thread blocks waiting for RX or TX
+    _ATLHRetriesCount = 3
+    _SerialFailCountLimit = 3
+
+    def __init__(self, bridge, section):
+        """ bridge is the owning MessageBridge, section the config section
+            holding this radio's serial settings
+        """
+        self.bridge = bridge
+        self.name = section
+        self.logger = logging.getLogger('Message Bridge.{}'.format(section))
+
+        self.network = None
+        self.fNetworkNameSet = threading.Event()
+        self.radioFirmwareVersion = None
+        self.radioSerialNumber = None
+
+        self.panID = 0
+        self.encryption = False
+        self.encryptionKey = None
+        self._setRadioEncryption = {}
+
+        self._SerialFailCount = 0
+        self._loop = None       # EventLoop when not using threads
+        self._txTimer = None
+        self._serialFd = None
+
+        # sendOn messages waiting for their device to wake
+        self._mailbox = Mailbox.Mailbox()
+
+        # DeviceConfigurationRequest sessions, fed a?? messages by the serial side
+        self._dcr = DCR.DCREngine(self._SerialSendQQ, self._DCRReturnDCR, self.logger)
+        self.fKeepAwake = threading.Event()
+
+    def _config(self, option):
+        """ Read one of our serial options, falling back to [Serial]
+        """
+        if self.bridge.config.has_option(self.name, option):
+            return self.bridge.config.get(self.name, option)
+        return self.bridge.config.get('Serial', option)
+
+    def _configBoolean(self, option):
+        if self.bridge.config.has_option(self.name, option):
+            return self.bridge.config.getboolean(self.name, option)
+        return self.bridge.config.getboolean('Serial', option)
+
+    def _isPrimary(self):
+        """ The command line overrides only apply to the [Serial] radio
+        """
+        return self.name == 'Serial'
+
+    def _configNetwork(self):
+        """ Network name from the config, extra radios default to their section suffix
+        """
+        if self._isPrimary() or self.bridge.config.has_option(self.name, 'network'):
+            return self._config('network')
+        return self.name.split('.', 1)[1]
+
+    def _makeAT(self):
+        """ AT helper for this radio using the GPIO pin if one is configured
+        """
+        try:
+            if self._isPrimary() and self.bridge.args.gpio:
+                return AT.AT(self._serial, self.logger, self.tSerialStop, self.bridge.args.gpio)
+            elif self._configBoolean('at_gpio'):
+                return AT.AT(self._serial, self.logger, self.tSerialStop, int(self._config('at_gpio_pin')))
+        except:
+            pass
+        return AT.AT(self._serial, self.logger, self.tSerialStop)
+
+    def initDCRThread(self):
+        """ Setup the Thread that times out DeviceConfigurationRequest's
+        """
+        self.logger.info("DCR Thread init")
+        self._initDCR()
+        self.startDCR()
+
+    def initDCRLoop(self):
+        """ Time out DeviceConfigurationRequest's on the event loop given
+            to initSerialLoop() instead of in a thread
+        """
+        self.logger.info("DCR event loop init")
+        self._initDCR()
+        self._dcr.attach(self._loop)
+
+    def _initDCR(self):
+        self.tDCRStop = threading.Event()
+
+    def startDCR(self):
+        self.tDCR = threading.Thread(name='tDCR {}'.format(self.name), target=self._DCRThread)
+        self.tDCR.daemon = False
+        try:
+            self.tDCR.start()
+        except:
+            self.logger.exception("Failed to Start the DCR thread")
+
+    def initSerialThread(self):
+        """ Setup the serial port and start the thread
+        """
+        self._initSerial()
+        self.startSerial()
+
+    def initSerialLoop(self, loop):
+        """ Setup and open the serial port and have loop call us when there is
+            something to read or send, used instead of the serial thread
+            Opening blocks while the AT settings are checked
+        """
+        self._initSerial()
+        self._loop = loop
+        loop.addReader(self.qSerialOut, self._SerialLoopTX)
+        self._SerialLoopOpen()
+
+    def _initSerial(self):
+        self.logger.info("Serial port init")
+
+        # serial port (or simulated radio) base on config file, thread handles opening and closing
+        if self._isPrimary() and self.bridge.args.port:
+            self._serial = Transport.makeTransport(self.bridge.args.port)
+        else:
+            self._serial = Transport.makeTransport(self._config('port'))
+
+        self._serial.baudrate = self._config('baudrate')
+        self._serial.timeout = self._serialTimeout
+        # frame parser keeps partial messages between reads
+        self._LoTParser = LoTParser.LoTParser()
+        # optional suppression of repeated frames, 0 turns it off
+        window = float(self._config('duplicate_window'))
+        self._duplicateFilter = LoTParser.DuplicateFilter(window) if window > 0 else None
+        # setup queue, producers to qSerialOut wake the serial thread
+        depths = [self.bridge.config.getint('TX', '{}_queue_depth'.format(name.lower()))
+                  for name in TXQueue.TXScheduler.classNames]
+        self.qSerialOut = TXQueue.TXScheduler(depths,
+                                              self._serial.baudrate if self.bridge.config.getboolean('TX', 'pacing') else None)
+        self.qReplyEncryption = Queue.Queue()
+        #setup flags
+        self.fSetRadioEncryption = threading.Event()
+        self.fRadioEncryptionDone = threading.Event()
+
+        # setup thread
+        self.tSerialStop = threading.Event()
+
+    def startSerial(self):
+        self.tSerial = threading.Thread(name='tSerial {}'.format(self.name), target=self._SerialThread)
+        self.tSerial.daemon = False
+        try:
+            self.tSerial.start()
+        except:
+            self.logger.exception("Failed to Start the Serial thread")
+
+    def checkThreads(self):
+        """ Restart any of our threads that have stopped
+            Returns True if everything is running
+        """
+        running = True
+        if not self.tDCR.is_alive():
+            self.logger.error("tMain: DCR thread stopped")
+            self.bridge.tMainStop.wait(1)
+            self.startDCR()
+            self.bridge.tMainStop.wait(1)
+            running = running and self.tDCR.is_alive()
+
+        if not self.tSerial.is_alive():
+            self.logger.error("tMain: Serial thread stopped, wait 1 before trying to re-establish ")
+            self.bridge.tMainStop.wait(1)
+            self.startSerial()
+            self.bridge.tMainStop.wait(1)
+            if self.tSerial.is_alive():
+                self._SerialFailCount = 0
+            else:
+                running = False
+                self._SerialFailCount += 1
+                if self._SerialFailCount > self._SerialFailCountLimit:
+                    self.logger.error("tMain: Serial thread failed to recover after {} retries, Exiting".format(self._SerialFailCountLimit))
+                    self.bridge.die()
+        return running
+
+    def stop(self):
+        """ Stop the serial and DCR threads
+        """
+        if self._loop:
+            self.tSerialStop.set()
+            self._SerialLoopClose()
+        else:
+            try:
+                self.tSerialStop.set()
+                self.qSerialOut.wake()
+                self.tSerial.join()
+            except:
+                pass
+            try:
+                self.tDCRStop.set()
+                self._dcr.wake()
+                self.tDCR.join()
+            except:
+                pass
+        self._journalOutbound()
+
+    def stats(self):
+        """ Serial counters for the serialStats MessageBridge request
+        """
+        return {'frames': self._LoTParser.frames,
+                'discarded': self._LoTParser.discarded,
+                'duplicates': self._duplicateFilter.suppressed if self._duplicateFilter else 0,
+                'tx': self.qSerialOut.stats()
+                }
+
+    def mailboxStatus(self):
+        """ Waiting sendOn messages and counters for the mailbox MessageBridge request
+        """
+        status = self._mailbox.status()
+        if self.bridge.journal:
+            status['journal'] = self.bridge.journal.stats()
+        return status
+
+    def _attachJournal(self):
+        """ Journal our mailbox and take back the sendOn's and outgoing
+            messages the journal kept for our network over a restart
+        """
+        journal = self.bridge.journal
+        if journal is None:
+            return
+        restored = self._mailbox.attach(journal, self.network)
+        ttl = self.bridge.settings.journalOutboundTTL
+        now = time()
+        resent = 0
+        for (key, record) in journal.items():
+            if record.get('type') != "outbound" or record.get('network') != self.network:
+                continue
+            journal.remove(key)
+            if now - record['queued'] > ttl:
+                # too old to act on now, or resending is turned off with a ttl of 0
+                continue
+            try:
+                self.qSerialOut.put_nowait(str(record['frame']), record['priority'], record['queued'])
+            except Queue.Full:
+                self.logger.warn("tSerial: Failed to put journaled {} on qSerialOut as it's full".format(record['frame']))
+            else:
+                resent += 1
+        if restored or resent:
+            self.logger.info("tSerial: Restored {} sendOn's and {} outgoing messages from the journal".format(restored, resent))
+
+    def _journalOutbound(self):
+        """ Journal the WirelessMessage commands still waiting to go out so
+            they are sent once we start again
+        """
+        journal = self.bridge.journal
+        if (journal is None or self.network is None or not hasattr(self, 'qSerialOut') or
+                not self.bridge.settings.journalOutboundTTL):
+            return
+        waiting = self.qSerialOut.drain((TXQueue.TXScheduler.INTERACTIVE, TXQueue.TXScheduler.BULK))
+        for (frame, priority, queued) in waiting:
+            journal.add({'type': "outbound",
+                         'network': self.network,
+                         'frame': frame,
+                         'priority': priority,
+                         'queued': queued
+                         })
+        if waiting:
+            self.logger.info("Journaled {} outgoing messages".format(len(waiting)))
+
+    def dcrCache(self):
+        """ Configuration replies seen from each device for the dcrCache MessageBridge request
+        """
+        return self._dcr.cache.toDict()
+
+    def requestSetRadioEncryption(self, settings, message, address):
+        """ Ask the serial thread to change the radio PANID/encryption settings
+            message is sent back out with the result once it is done, address
+            is who asked
+        """
+        self._setRadioEncryption = settings
+        try:
+            self.qReplyEncryption.put((message, address))
+        except Queue.Full:
+            self.logger.debug("tMain: Failed to put {} on qReplyEncryption as it's full".format(message))
+        else:
+            self.logger.debug("tMain: Put {} on qReplyEncryption".format(message))
+        #set the flag to set encryption on radio
+        self.fSetRadioEncryption.set()
+        self.qSerialOut.wake()
+
+    def processEncryptionReply(self):
+        """ If the serial thread has finished setting the encryption send out the reply
+        """
+        if self.fRadioEncryptionDone.is_set():
+            self.fRadioEncryptionDone.clear()
+            self.logger.debug("tMain: Processing Reply Encryption message")
+            if not self.qReplyEncryption.empty():
+                try:
+                    (message, address) = self.qReplyEncryption.get_nowait()
+                except Queue.Empty:
+                    pass
+                else:
+                    message['timestamp'] = strftime("%d %b %Y %H:%M:%S +0000", gmtime())
+                    message['data']['result'] = self._setRadioEncryption
+                    try:
+                        self.bridge.qUDPSend.put((json.dumps(message), message, address))
+                    except Queue.Full:
+                        self.logger.debug("tMain: Failed to put {} on qUDPSend as it's full".format(message))
+                    else:
+                        self.logger.debug("tMain: Put {} on qUDPSend".format(message))
+                    self.qReplyEncryption.task_done()
+
+    def sendWirelessMessageJSON(self, jsonin):
+        """ Turn a WirelessMessage JSON into Language of Things messages on qSerialOut
+        """
+        # TODO: error checking, dict should have keys for data
+        if jsonin.has_key('sendOn'):
+            self.processSendOnJSON(jsonin)
+            return
+
+        if jsonin.get('priority', None) == "bulk":
+            priority = TXQueue.TXScheduler.BULK
+        else:
+            priority = TXQueue.TXScheduler.INTERACTIVE
+
+        for command in jsonin['data']:
+            wirelessMsg = "a{}{}".format(jsonin['id'], command[0:9].upper())
+            while len(wirelessMsg) <12:
+                wirelessMsg += '-'
+            try:
+                self.qSerialOut.put_nowait(wirelessMsg, priority)
+            except Queue.Full:
+                self.logger.debug("tUDPListen: Failed to put {} on qSerialOut as it's full".format(wirelessMsg))
+            else:
+                if self.bridge.debugLog:
+                    self.logger.debug("tUDPListen: Put {} on qSerialOut".format(wirelessMsg))
+
+    def putDCRRequest(self, jsonin):
+        """ Start a DeviceConfigurationRequest, it runs alongside any others
+            until a device answers it or it times out
+        """
+        # check the keepAwake
+        if jsonin['data'].get('keepAwake', None) == 1:
+            self.logger.debug("tDCR: keepAwake turned on")
+            self.fKeepAwake.set()
+        elif jsonin['data'].get('keepAwake', None) == 0:
+            self.logger.debug("tDCR: keepAwake turned off")
+            self.fKeepAwake.clear()
+
+        if not jsonin['data'].get('toQuery', False):
+            # no toQuery section, so reply with all done
+            self._DCRReturnDCR(jsonin, DCR.DCREngine.PASS)
+            return
+
+        self._submitDCR(jsonin)
+
+    def putDCRBatch(self, jsonin):
+        """ Start a DeviceConfigurationBatch, its devices are configured as
+            they send CONFIGME and one report is sent once all have finished
+        """
+        try:
+            batch = DCR.DCRBatch(jsonin, self._submitDCR, self._DCRReturnDCR,
+                                 self.bridge.settings.dcrBatchConcurrency, self.logger)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            self.logger.warn("tUDPListen: Invalid DeviceConfigurationBatch {}".format(jsonin))
+            return
+        self._dcr.synchronized(batch.start)
+
+    def _submitDCR(self, jsonin, reply=None):
+        """ Hand a DeviceConfigurationRequest with a toQuery to the DCR engine
+            reply if given gets the result instead of it going out on UDP
+        """
+        # make place for replies later
+        jsonin['data']['replies'] = {}
+        # use a copy in case we are adding ENC stuff
+        toQuery = list(jsonin['data']['toQuery'])
+        if jsonin['data'].has_key('setENC'):
+            if self.encryption:
+                self.logger.debug("tDCR: auto setting encryption")
+                toQuery.insert(0, {"command":"ENC", "value":"ON"})
+                for (index, hex) in enumerate(list(self._chunkstring(self.encryptionKey, 6))):
+                    toQuery.insert(0, {"command":"EN{}".format(index+1), "value":hex})
+
+        settings = self.bridge.settings
+        try:
+            timeout = int(jsonin['data'].get('timeout', settings.dcrTimeout))
+        except (TypeError, ValueError):
+            timeout = settings.dcrTimeout
+        # queries to keep in flight at once, 1 waits for each reply before sending the next
+        try:
+            pipeline = max(1, int(jsonin['data'].get('pipeline', 1)))
+        except (TypeError, ValueError):
+            pipeline = 1
+        # how old a cached reply may be to answer a query without asking the device
+        try:
+            cache = max(0, int(jsonin['data'].get('cache', 0)))
+        except (TypeError, ValueError):
+            cache = 0
+
+        self._dcr.submit(jsonin, toQuery, timeout, settings.dcrRetryCount, pipeline, reply, cache)
+
+    def _DCRThread(self):
+        """ Device Configuration Request thread
+            Replies are handled as the serial side passes them in, this
+            thread only wakes to time out requests
+        """
+        self.logger.info("tDCR: DCR thread started")
+
+        self._dcr.run(self.tDCRStop)
+
+        self.logger.info("tDCR: Thread stopping")
+        return
+
+    def _DCRReturnDCR(self, request, state):
+        if state == DCR.DCREngine.PARTIAL:
+            # the request carries on, send a copy of how far it has got
+            request = copy.deepcopy(request)
+        # prep the reply
+        request['timestamp'] = strftime("%d %b %Y %H:%M:%S +0000", gmtime())
+        request['network'] = self.network
+        request['keepAwake'] = 1 if self.fKeepAwake.is_set() else 0
+        request['data']['state'] = state
+
+        # encode json
+        jsonout = json.dumps(request)
+
+        # send to UDP thread
+        try:
+            self.bridge.qUDPSend.put_nowait((jsonout, request))
+        except Queue.Full:
+            self.logger.warn("tDCR: Failed to put {} on qUDPSend as it's full".format(jsonout))
+        else:
+            self.logger.debug("tDCR: Sent DCR reply to qUDPSend")
+
+    def _SerialThread(self):
+        """ Serial Thread
+        """
+        self.logger.info("tSerial: Serial thread started")
+        self.tSerialStop.wait(1)
+        checkEncKeyCounter = 0
+
+        try:
+            while (not self.tSerialStop.is_set()):
+                self._SerialOpen()
+
+                # main serial processing loop
+                while self._serial.isOpen() and not self.tSerialStop.is_set():
+                    if self._SerialWaitForEvent():
+                        self._SerialReadIncomingLanguageOfThings()
+
+                    self._SerialCheckEncryption()
+                    self._SerialSendWaiting()
+
+                # port closed for some reason (or tSerialStop), if tSerialStop is not set we will try reopening
+        except IOError:
+            self.logger.exception("tSerial: IOError on serial port")
+        finally:
+            # close the port, whatever stopped us, so a restarted thread can open it again
+            self.logger.info("tSerial: Closing serial port")
+            self._serial.close()
+
+        self.logger.info("tSerial: Thread stoping")
+        return
+
+    def _SerialOpen(self):
+        """ Open the port, clear out anything stale and check the radio settings
+        """
+        # open the port
+        try:
+            self._serial.open()
+            self.logger.info("tSerial: Opened the serial port")
+        except serial.SerialException:
+            self.logger.exception("tSerial: Failed to open port {} Exiting".format(self._serial.port))
+            self._serial.close()
+            self.bridge.die()
+
+        self.tSerialStop.wait(0.1)
+
+        # we clear out any stale serial messages that might be in the buffer
+        self._serial.flushInput()
+        self._LoTParser.reset()
+
+        # check the ATLH settings
+        retries = 0
+        while not self._SerialCheckATLH():
+            retries += 1
+            self.logger.error("tSerial: Retrying Check ATLH attempt: {}".format(retries))
+            if retries == self._ATLHRetriesCount:
+                self.logger.critical("tSerial: Error on Check ATLH")
+                self.bridge.die()
+
+        self._serialFd = self._SerialFileno()
+
+    def _SerialCheckEncryption(self):
+        """ Change the radio encryption if the main thread asked for it
+        """
+        #check if there's any change on the Encryption Key to set on radio
+        if self.fSetRadioEncryption.is_set():
+            self.logger.debug("tSerial: fSetRadioEncryption set")
+            self.fRadioEncryptionDone.clear()
+            self.SetRadioEncryption()
+            self.fRadioEncryptionDone.set() #informs the main thread that has some encryption result to send
+
+    def _SerialSendWaiting(self):
+        """ Write out everything on qSerialOut that pacing lets go now
+        """
+        # send everything that is waiting and not held back by pacing
+        while True:
+            try:
+                wirelessMsg = self.qSerialOut.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                self._serial.write(wirelessMsg)
+            except serial.SerialException as e:
+                self.logger.warn("tSerial: failed to write to the serial port {}: {}".format(self._serial.port, e))
+            else:
+                if self.bridge.debugLog:
+                    self.logger.debug("tSerial: TX:{}".format(wirelessMsg))
+            self.qSerialOut.task_done()
+
+    def _SerialFileno(self):
+        """ The selectable file descriptor of the open serial port
+            or None if the port or qSerialOut can not be used with select() (win32)
+        """
+        if self.qSerialOut.fileno() is None:
+            return None
+        try:
+            return self._serial.fileno()
+        except (AttributeError, ValueError, serial.SerialException):
+            return None
+
+    def _SerialWaitForEvent(self):
+        """ Block until the serial port has data to read or qSerialOut is woken
+            Returns True if there is serial data waiting
+        """
+        # don't sleep past the point qSerialOut pacing lets the next message go
+        timeout = self._serialSelectTimeout
+        sendIn = self.qSerialOut.nextSendIn()
+        if sendIn is not None:
+            timeout = min(timeout, sendIn)
+
+        if self._serialFd is None:
+            # no select() available, fall back to polling
+            if not self._serial.inWaiting() and sendIn != 0:
+                self.tSerialStop.wait(min(timeout, 0.01 if self._dcr.busy() else 0.1))
+            return self._serial.inWaiting() > 0
+
+        try:
+            readable = select.select([self._serialFd, self.qSerialOut], [], [], timeout)[0]
+        except select.error as e:
+            if e[0] == errno.EINTR:
+                return False
+            raise
+
+        if self.qSerialOut in readable:
+            # clear before we drain so a put from now on wakes us again
+            self.qSerialOut.clearWakeup()
+        return self._serialFd in readable
+
+    def _SerialLoopOpen(self):
+        """ Open the port and watch it for incoming data
+        """
+        try:
+            self._SerialOpen()
+        except IOError:
+            self.logger.exception("tSerial: IOError on serial port")
+            self._SerialLoopRetry()
+            return
+        if self._serialFd is None:
+            self.logger.critical("tSerial: Serial port {} can not be used with the event loop".format(self._serial.port))
+            self.bridge.die()
+        self._SerialFailCount = 0
+        self._loop.addReader(self._serialFd, self._SerialLoopRead)
+        self._SerialLoopTX()
+
+    def _SerialLoopClose(self):
+        if self._serialFd is not None:
+            self._loop.removeReader(self._serialFd)
+            self._serialFd = None
+        if self._txTimer:
+            self._txTimer.cancel()
+            self._txTimer = None
+        self.logger.info("tSerial: Closing serial port")
+        self._serial.close()
+
+    def _SerialLoopRetry(self):
+        """ Same limits as restarting the serial thread
+        """
+        self._SerialFailCount += 1
+        if self._SerialFailCount > self._SerialFailCountLimit:
+            self.logger.error("tMain: Serial port failed to recover after {} retries, Exiting".format(self._SerialFailCountLimit))
+            self.bridge.die()
+        self.logger.error("tMain: Serial port closed, wait 1 before trying to re-establish ")
+        self._loop.callLater(1, self._SerialLoopOpen)
+
+    def _SerialLoopRead(self):
+        """ Event loop callback when the serial port has data
+        """
+        try:
+            self._SerialReadIncomingLanguageOfThings()
+        except (IOError, serial.SerialException):
+            self.logger.exception("tSerial: IOError on serial port")
+            self._SerialLoopClose()
+            self._SerialLoopRetry()
+
+    def _SerialLoopTX(self):
+        """ Event loop callback when qSerialOut is woken or pacing lets the
+            next message go
+        """
+        self.qSerialOut.clearWakeup()
+        if self._txTimer:
+            self._txTimer.cancel()
+            self._txTimer = None
+        if self._serialFd is None or self.tSerialStop.is_set():
+            return
+        self._SerialCheckEncryption()
+        self._SerialSendWaiting()
+        sendIn = self.qSerialOut.nextSendIn()
+        if sendIn is not None:
+            self._txTimer = self._loop.callLater(sendIn, self._SerialLoopTX)
+
+    def SetRadioEncryption(self):
+        self.logger.info("tSerial: SetRadioEncryption: Checking Serial Number of the radio")
+        self.fSetRadioEncryption.clear()
+        changesToCommit = False
+
+        if not self._setRadioEncryption:
+            self.logger.error("tSerial: SetRadioEncryption: Encryption Key not received")
+            return False
+
+        at = self._makeAT()
+
+        if at.enterATMode():
+            if self._setRadioEncryption.has_key('PANID'):
+                atid = at.sendATWaitForResponse("ATID")
+                if atid:
+                    if self._setRadioEncryption['PANID'] in atid:
+                        self.logger.debug("tSerial: SetRadioEncryption: PANID already Set")
+                    else:
+                        if at.sendATWaitForOK("PANID{}".format(self._setRadioEncryption['PANID'])):
+                            self.panID = self._setRadioEncryption['PANID']
+                            changesToCommit = True
+                        else:
+                            self.logger.error("tSerial: SetRadioEncryption: Error setting PANID")
+                else:
+                    self.logger.error("tSerial: SetRadioEncryption: Error getting ATID response")
+
+            if self._setRadioEncryption.has_key('encryptionSet'):
+                atee = at.sendATWaitForResponse("ATEE")
+                if atee:
+                    try:
+                        if self._setRadioEncryption['encryptionSet'] == bool(int(atee)):
+                            self.logger.debug("tSerial: SetRadioEncryption: Encryption already Set")
+                        else:
+                            if at.sendATWaitForOK("ATEE{}".format(int(self._setRadioEncryption['encryptionSet']))):
+                                self.encryption = self._setRadioEncryption['encryptionSet']
+                                changesToCommit = True
+                            else:
+                                self.logger.error("tSerial: SetRadioEncryption: Error setting encryptionSet")
+                    except ValueError:
+                        self.logger.error("tSerial: SetRadioEncryption: Wrong value on encryptionSet: {}".format(self._setRadioEncryption['encryptionSet']))
+                else:
+                    self.logger.error("tSerial: SetRadioEncryption: Error getting ATEE response")
+
+            if self._setRadioEncryption.has_key('encryptionKey'):
+                status = "Fail"
+                atek = at.sendATWaitForResponse("ATEK")
+                if atek:
+                    self.logger.debug("atek {}".format(atek))
+                    if self._setRadioEncryption['encryptionKey'] in atek:
+                        self.logger.debug("tSerial: SetRadioEncryption: Encryption Key already Set")
+                        status = "Pass"
+                    else:
+                        if at.sendATWaitForOK("ATEK{}".format(self._setRadioEncryption['encryptionKey'])):
+                            self.encryptionKey = self._setRadioEncryption['encryptionKey']
+                            status = "Pass"
+                            changesToCommit = True
+                        else:
+                            self.logger.error("tSerial: SetRadioEncryption: Error setting encryption key")
+                else:
+                    self.logger.error("tSerial: SetRadioEncryption: Error getting ATEK response")
+                self._setRadioEncryption['encryptionKey'] = status
+
+            if changesToCommit:
+                if at.sendATWaitForOK("ATAC"):
+                    if at.sendATWaitForOK("ATWR"):
+                        self.logger.debug ("tSerial: SetRadioEncryption: Encryption settings commited")
+        else:
+            self.logger.error("tSerial: SetRadioEncryption: Failed on enter AT Mode")
+            at.leaveATMode() #make sure the radio is not stucked on AT mode
+            return False
+
+        at.leaveATMode()
+        return True
+
+    def _SerialCheckATLH(self):
+        """ check and possible set the the ATLH setting on the radio
+        """
+        self.logger.info("tSerial: Setting ATLH1")
+
+        self._serial.flushInput()
+
+        at = self._makeAT()
+
+        if at.enterATMode():
+            try:
+                self.radioFirmwareVersion = at.sendATWaitForResponse("ATVR")
+                if not self.radioFirmwareVersion:
+                    self.logger.error("tSerial: Radio Firmware Version not valid")
+                    return False
+            except:
+                self.logger.error("tSerial: Error obtaining Radio Firmware Version")
+                return False
+
+            fwVersion = self.radioFirmwareVersion.split('B',1)[0]
+            if '0.' in fwVersion:
+                fwVersion = fwVersion.split('0.',1)[1]
+
+            if ("SRFV2" in self.radioFirmwareVersion) and (fwVersion >= 97):
+                serialNumberCommand = "ATSF"    # SRF fixed serial number (only avalible on SRFV2 firmware 97 or later)
+            else:
+                serialNumberCommand = "ATSN"    # SRF user settable serial number
+
+            try:
+                self.radioSerialNumber = at.sendATWaitForResponse(serialNumberCommand)
+                if not self.radioSerialNumber:
+                    self.logger.error("tSerial: Radio Serial Number not valid")
+                    return False
+            except:
+                self.logger.error("tSerial: Error obtaining Radio Serial Number")
+                return False
+
+            if not self.fNetworkNameSet.is_set():
+                if self.bridge.args.network or self._configBoolean('network_use_radio_serial_number'):
+                    try:
+                        self.network = self.radioSerialNumber
+                    except:
+                        self.logger.error("tSerial: Error setting Network as radio Serial Number")
+                        self.network = self._configNetwork()
+                else:
+                    self.network = self._configNetwork()
+
+                self.bridge.registerNetwork(self)
+                self._attachJournal()
+                self.fNetworkNameSet.set()  #informs the network now has a value
+
+            self.logger.info("tSerial: Radio Firmware Version: {}".format(self.radioFirmwareVersion))
+            self.logger.info("tSerial: Radio Serial Number: {}".format(self.radioSerialNumber))
+            #ask for the ATLH
+            atlh = at.sendATWaitForResponse("ATLH")
+            if atlh:
+                if atlh != "1": #if the ATLH returns diff from 1, we force the 1 status
+                    if at.sendATWaitForOK("ATLH1"):
+                        if at.sendATWaitForOK("ATAC"):
+                            if at.sendATWaitForOK("ATWR"):
+                                self.logger.debug("SerialCheckATLH: ATLH1 set")
+            else:
+                self.logger.error("tSerial: ATLH returned False, check radio firmware version")
+                return False
+
+            self.panID = at.sendATWaitForResponse("ATID")
+            if not self.panID:
+                self.logger.error("tSerial: Invalid PANID")
+                return False
+
+            self.encryption = at.sendATWaitForResponse("ATEE")
+            if not self.encryption:
+                self.logger.error("tSerial: Invalid Encryption")
+                return False
+            self.encryption = bool(int(self.encryption)) #convert the received encryption to bool
+
+            self.encryptionKey = at.sendATWaitForResponse("ATEK")
+            if not self.encryptionKey:
+                self.logger.error("tSerial: Invalid encryptionKey")
+                return False
+
+            at.leaveATMode()
+            return True
+
+        self.logger.debug("tSerial: Failed to enter on AT Mode")
+        return False
+
+
+
+    def _SerialReadIncomingLanguageOfThings(self):
+        """ Read everything waiting on the serial port and process any complete
+            Language of Things messages, partial messages are held by the parser
+            until the next read
+        """
+        data = self._serial.read(self._serial.inWaiting() or 1)
+        if not data:
+            return
+
+        for wirelessMsg in self._LoTParser.feed(data):
+            if self.bridge.debugLog:
+                self.logger.debug("tSerial: RX:{}".format(wirelessMsg[1:]))
+            self._SerialProcessLanguageOfThings(wirelessMsg)
+
+    def _SerialProcessLanguageOfThings(self, wirelessMsg):
+        """ process a single complete 12 byte Language of Things message
+        """
+        if wirelessMsg[1:3] == "??":
+            self._SerialProcessQQ(wirelessMsg[3:].strip("-"))
+        elif self._duplicateFilter and self._duplicateFilter.isDuplicate(wirelessMsg):
+            self.logger.debug("tSerial: Dropped duplicate {}".format(wirelessMsg[1:]))
+        else:
+            #now will check if there's any message to be sent on the "sendOn" queue
+            if wirelessMsg[1:3] in self._mailbox:
+                self.sendOnForMatchedID(wirelessMsg[1:3], wirelessMsg[3:].strip("-"))
+            # not a configme Language of Things message so send out via UDP WirelessMessage
+            try:
+                self.bridge.qUDPSend.put_nowait(self.bridge.encodeWirelessMessageJson(wirelessMsg, self.network))
+            except Queue.Full:
+                self.logger.warn("tSerial: Failed to put {} on qUDPSend as it's full".format(wirelessMsg))
+
+    def _SerialProcessQQ(self, wirelessMsg):
+        """ process an incoming ?? Language of Things message
+        """
+        self._dcr.configFrame(wirelessMsg)
+
+        # a CONFIGME still gets its keepAwake, whether or not it opened a
+        # window for a DCR
+        if wirelessMsg == "CONFIGME" and self.fKeepAwake.is_set():
+            self._SerialSendQQ("HELLO")
+
+    def _SerialSendQQ(self, text):
+        """ Send a Language of Things message to a device in configuration mode
+        """
+        wirelessToSend = "a??{}".format(text)
+        while len(wirelessToSend) < 12:
+            wirelessToSend += "-"
+        try:
+            self.qSerialOut.put_nowait(wirelessToSend, TXQueue.TXScheduler.DCR)
+        except Queue.Full:
+            self.logger.warn("tSerial: Failed to put {} on qSerialOut as it's full".format(wirelessToSend))
+            return False
+        else:
+            self.logger.debug("tSerial: Put {} on qSerialOut".format(wirelessToSend))
+            return True
+
+    def processSendOnJSON(self, jsonin):
+        """ Put a sendOn WirelessMessage in the device's mailbox, the first
+            message goes when the device sends sendOn and each of the others
+            when it replies to the one before
+        """
+        _id = jsonin['id']
+        steps = [(jsonin['sendOn'], jsonin['data'][0])]
+        for i in range(0, len(jsonin['data'])-1):
+            steps.append((jsonin['data'][i], jsonin['data'][i+1]))
+
+        settings = self.bridge.settings
+        try:
+            ttl = max(0, int(jsonin.get('ttl', settings.sendOnTTL)))
+        except (TypeError, ValueError):
+            ttl = settings.sendOnTTL
+        evicted = self._mailbox.put(_id, steps, ttl, settings.sendOnMaxPerDevice)
+        if evicted:
+            self.logger.warn("tUDPListen: Mailbox for {} full, dropped its oldest sendOn".format(_id))
+
+    def sendOnForMatchedID(self, _id, command):
+        """ Send the next mailbox message for _id if it is waiting on command
+        """
+        def send(text):
+            wirelessMsg = "a{}{}".format(_id, text)
+            while len(wirelessMsg) <12:
+                wirelessMsg += '-'
+            try:
+                self.qSerialOut.put_nowait(wirelessMsg, TXQueue.TXScheduler.SENDON)
+            except Queue.Full:
+                self.logger.debug("checkSendOnQueue: Failed to put {} on qSerialOut as it's full".format(wirelessMsg))
+                return False
+            self.logger.debug("checkSendOnQueue: Put {} on qSerialOut".format(wirelessMsg))
+            return True
+
+        self._mailbox.deliver(_id, command, send)
+
+    def _chunkstring(self, string, length):
+        return (string[0+i:length+i] for i in range(0, len(string), length))
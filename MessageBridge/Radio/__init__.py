@@ -0,0 +1,3 @@
+from Radio import Radio
+
+__ALL__ = ['Radio']
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Settings
+    Typed read only snapshot of the Message Bridge config
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import logging
+
+class Settings():
+    """ The options read while passing messages, parsed once
+
+        Threads read plain attributes instead of going back to the
+        ConfigParser for every message. A Settings can not be changed once
+        made, a reload builds a new one and replaces the reference to it so
+        a reader always sees one whole snapshot, take a local reference to
+        it if several options need to agree.
+
+        Raises ValueError or a ConfigParser.Error if an option is invalid.
+    """
+
+    def __init__(self, config):
+        # [Debug]
+        self._set('consoleDebug', config.getboolean('Debug', 'console_debug'))
+        self._set('consoleLevel', self.logLevel(config.get('Debug', 'console_level')))
+        self._set('fileDebug', config.getboolean('Debug', 'file_debug'))
+        self._set('fileLevel', self.logLevel(config.get('Debug', 'file_level')))
+        # [UDP]
+        self._set('sendPort', config.getint('UDP', 'send_port'))
+        self._set('listenPort', config.getint('UDP', 'listen_port'))
+        self._set('useLocalOnly', config.getboolean('UDP', 'use_local_only'))
+        self._set('broadcast', config.getboolean('UDP', 'broadcast'))
+        self._set('multicast', config.get('UDP', 'delivery').lower() == "multicast")
+        self._set('multicastGroup', config.get('UDP', 'multicast_group'))
+        # a TTL of 0 keeps multicast on this machine
+        self._set('multicastTTL', 0 if self.useLocalOnly else config.getint('UDP', 'multicast_ttl'))
+        self._set('multicastInterface', config.get('UDP', 'multicast_interface'))
+        self._set('subscriberLease', config.getint('UDP', 'subscriber_lease'))
+        self._set('subscriberMaxLease', config.getint('UDP', 'subscriber_max_lease'))
+        self._set('maxSubscribers', config.getint('UDP', 'max_subscribers'))
+        self._set('batchMode', config.getboolean('UDP', 'batch_mode'))
+        self._set('batchWindow', config.getfloat('UDP', 'batch_window'))
+        self._set('batchMaxMessages', config.getint('UDP', 'batch_max_messages'))
+        self._set('batchMaxBytes', config.getint('UDP', 'batch_max_bytes'))
+        self._set('binaryPort', config.getint('UDP', 'binary_port'))
+        self._set('receiveBuffer', config.getint('UDP', 'receive_buffer'))
+        # [DCR]
+        self._set('dcrEnable', config.getboolean('DCR', 'dcr_enable'))
+        self._set('dcrTimeout', config.getint('DCR', 'timeout'))
+        self._set('dcrRetryCount', config.getint('DCR', 'single_query_retry_count'))
+        self._set('dcrBatchConcurrency', config.getint('DCR', 'batch_concurrency'))
+        # [SendOn]
+        self._set('sendOnTTL', config.getint('SendOn', 'ttl'))
+        self._set('sendOnMaxPerDevice', config.getint('SendOn', 'max_per_device'))
+        self._set('journal', config.get('SendOn', 'journal'))
+        self._set('journalSyncInterval', config.getfloat('SendOn', 'journal_sync_interval'))
+        self._set('journalOutboundTTL', config.getint('SendOn', 'journal_outbound_ttl'))
+        # [DeviceStore]
+        self._set('historyDepth', config.getint('DeviceStore', 'history_depth'))
+        # [Run]
+        self._set('core', config.get('Run', 'core').lower())
+
+    @staticmethod
+    def logLevel(name):
+        """ Numeric logging level for a level name
+        """
+        level = getattr(logging, str(name).upper(), None)
+        if not isinstance(level, int):
+            raise ValueError("Invalid log level: {}".format(name))
+        return level
+
+    def _set(self, name, value):
+        self.__dict__[name] = value
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Settings are read only, build a new Settings to change {}".format(name))
+
+    def changed(self, other):
+        """ Names of the settings that differ from other
+        """
+        return sorted(name for name, value in self.__dict__.items()
+                      if other is None or other.__dict__.get(name) != value)
@@ -0,0 +1,3 @@
+from Settings import Settings
+
+__ALL__ = ['Settings']
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Stream Server
+    Newline delimited JSON over TCP and Unix domain sockets for the Message Bridge
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import os
+import errno
+import socket
+import select
+import threading
+import json
+import logging
+from collections import deque
+from TXQueue import WakeupPipe
+from Subscribers import Subscriber
+
+class StreamClient():
+    """ One connected consumer, its buffer and counters
+
+        Messages wait in a bounded buffer until the socket can take them,
+        when the buffer is full the overflow policy either drops the oldest
+        message or disconnects the client. Every drop is counted.
+    """
+
+    def __init__(self, connection, name, bufferSize):
+        self.connection = connection
+        self.name = name
+        self.bufferSize = bufferSize
+        self.buffer = deque()
+        self.filter = None      # Subscriber used only for its filters
+        self.sent = 0
+        self.dropped = 0
+        self.overflowed = False
+        self.partial = ""       # rest of the message currently being written
+        self.received = ""      # start of a filter line from the client
+
+    def wantsWrite(self):
+        return bool(self.partial or self.buffer)
+
+    def stats(self):
+        return {'client': self.name,
+                'sent': self.sent,
+                'dropped': self.dropped,
+                'waiting': len(self.buffer)
+                }
+
+class StreamServer():
+    """ Push every JSON the Message Bridge sends out to connected stream clients
+
+        Clients connect over TCP or a Unix domain socket and get one JSON
+        per line. A client may send a line of JSON with the same filters as
+        a UDP subscribe (ids, idPrefixes, commands, types, network) to only
+        get matching messages.
+
+        publish() is called from the UDP send thread, the sockets are only
+        touched by the stream thread which is woken through a pipe.
+    """
+
+    DROP_OLDEST = "drop_oldest"
+    DISCONNECT = "disconnect"
+
+    _selectTimeout = 1
+    _pollTimeout = 0.1      # used where the wakeup pipe can not be selected on (win32)
+
+    def __init__(self, tcpAddress=None, unixPath=None, bufferSize=1000,
+                 overflow=DROP_OLDEST, maxClients=20, logger=None):
+        self.tcpAddress = tcpAddress
+        self.unixPath = unixPath
+        self.bufferSize = int(bufferSize)
+        self.overflow = overflow
+        self.maxClients = int(maxClients)
+        self.logger = logger or logging.getLogger('Message Bridge.Stream')
+
+        self._lock = threading.Lock()
+        self._wakeup = WakeupPipe()
+        self._listeners = []
+        self._clients = {}      # socket to StreamClient
+        self.disconnected = 0   # clients dropped by the disconnect policy
+        self.tStreamStop = threading.Event()
+        self.tStream = None
+
+    def start(self):
+        """ Open the listening sockets and start the stream thread
+        """
+        if self.tcpAddress:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind(self.tcpAddress)
+            self._listen(listener)
+            self.logger.info("tStream: Listening on TCP {}".format(self.tcpAddress))
+        if self.unixPath and hasattr(socket, 'AF_UNIX'):
+            try:
+                os.unlink(self.unixPath)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            listener.bind(self.unixPath)
+            self._listen(listener)
+            self.logger.info("tStream: Listening on {}".format(self.unixPath))
+        self.startThread()
+
+    def _listen(self, listener):
+        listener.listen(5)
+        listener.setblocking(0)
+        self._listeners.append(listener)
+
+    def startThread(self):
+        self.tStream = threading.Thread(name='tStream', target=self._StreamThread)
+        self.tStream.daemon = False
+        self.tStream.start()
+
+    def stop(self):
+        self.tStreamStop.set()
+        self._wakeup.wake()
+        if self.tStream:
+            self.tStream.join()
+        for listener in self._listeners:
+            listener.close()
+        for connection in self._clients.keys():
+            connection.close()
+        self._clients = {}
+        if self.unixPath and self._listeners:
+            try:
+                os.unlink(self.unixPath)
+            except OSError:
+                pass
+        self._wakeup.close()
+
+    def publish(self, jsonout, message):
+        """ Queue a JSON for every client that wants it
+        """
+        if not self._clients:
+            return
+        line = jsonout + "\n"
+        with self._lock:
+            for client in self._clients.values():
+                if client.filter and not (client.filter.wants(message) and
+                                          client.filter.network in (None, "ALL", message['network'])):
+                    continue
+                if len(client.buffer) >= client.bufferSize:
+                    client.dropped += 1
+                    if self.overflow == self.DISCONNECT:
+                        client.overflowed = True
+                        continue
+                    client.buffer.popleft()
+                client.buffer.append(line)
+        self._wakeup.wake()
+
+    def stats(self):
+        """ Counters for the streamStats MessageBridge request
+        """
+        with self._lock:
+            return {'clients': [client.stats() for client in self._clients.values()],
+                    'disconnected': self.disconnected
+                    }
+
+    def _StreamThread(self):
+        self.logger.info("tStream: Stream thread started")
+        wakeup = self._wakeup.fileno()
+        timeout = self._selectTimeout if wakeup is not None else self._pollTimeout
+        while not self.tStreamStop.is_set():
+            with self._lock:
+                for connection, client in self._clients.items():
+                    if client.overflowed:
+                        self.logger.warn("tStream: {} is too slow, disconnecting".format(client.name))
+                        self.disconnected += 1
+                        self._close(connection)
+                readers = self._listeners + self._clients.keys()
+                writers = [connection for connection, client in self._clients.items() if client.wantsWrite()]
+            if wakeup is not None:
+                readers = readers + [wakeup]
+            try:
+                (readable, writable, errored) = select.select(readers, writers, [], timeout)
+            except select.error as e:
+                if e[0] == errno.EINTR:
+                    continue
+                raise
+            for ready in readable:
+                if ready == wakeup:
+                    self._wakeup.clear()
+                elif ready in self._listeners:
+                    self._accept(ready)
+                else:
+                    self._read(ready)
+            for ready in writable:
+                self._write(ready)
+        self.logger.info("tStream: Thread stopping")
+
+    def _accept(self, listener):
+        try:
+            (connection, address) = listener.accept()
+        except socket.error:
+            return
+        if len(self._clients) >= self.maxClients:
+            self.logger.warn("tStream: Too many stream clients, refused {}".format(address))
+            connection.close()
+            return
+        connection.setblocking(0)
+        name = "{}:{}".format(*address) if isinstance(address, tuple) else "unix:{}".format(connection.fileno())
+        self.logger.info("tStream: Client {} connected".format(name))
+        with self._lock:
+            self._clients[connection] = StreamClient(connection, name, self.bufferSize)
+
+    def _read(self, connection):
+        """ Clients only send filter lines, anything else is ignored
+        """
+        client = self._clients.get(connection)
+        if client is None:
+            return
+        try:
+            data = connection.recv(4096)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = ""
+        if not data:
+            self.logger.info("tStream: Client {} disconnected".format(client.name))
+            with self._lock:
+                self._close(connection)
+            return
+        client.received = (client.received + data)[-8192:]
+        while "\n" in client.received:
+            (line, client.received) = client.received.split("\n", 1)
+            try:
+                filters = json.loads(line)
+                subscriber = Subscriber(None, filters.get('network'), filters, 0)
+            except (ValueError, AttributeError, TypeError):
+                self.logger.debug("tStream: Invalid filter from {}: {}".format(client.name, line))
+                continue
+            self.logger.debug("tStream: Filter for {}: {}".format(client.name, filters))
+            with self._lock:
+                client.filter = subscriber
+
+    def _write(self, connection):
+        client = self._clients.get(connection)
+        if client is None:
+            return
+        while True:
+            if not client.partial:
+                with self._lock:
+                    if not client.buffer:
+                        return
+                    client.partial = client.buffer.popleft()
+            try:
+                written = connection.send(client.partial)
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return
+                self.logger.info("tStream: Client {} write failed {}".format(client.name, e))
+                with self._lock:
+                    self._close(connection)
+                return
+            client.partial = client.partial[written:]
+            if client.partial:
+                return
+            client.sent += 1
+
+    def _close(self, connection):
+        """ Call holding _lock
+        """
+        self._clients.pop(connection, None)
+        try:
+            connection.close()
+        except socket.error:
+            pass
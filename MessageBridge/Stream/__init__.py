@@ -0,0 +1,3 @@
+from StreamServer import StreamServer, StreamClient
+
+__ALL__ = ['StreamServer', 'StreamClient']
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Subscriber Registry
+    Unicast subscribers with server side filtering for the Message Bridge
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import threading
+from time import time, gmtime, strftime
+
+class Subscriber():
+    """ One registration, an address on a network and what it wants to see
+    """
+
+    def __init__(self, address, network, filters, expires):
+        self.address = address
+        self.network = network
+        self.expires = expires
+        self.types = self._list(filters.get('types'))
+        self.ids = sorted(set(self._list(filters.get('ids'))))
+        self.idPrefixes = tuple(self._list(filters.get('idPrefixes')))
+        self.commands = tuple(self._list(filters.get('commands')))
+        self.binary = filters.get('format') == "binary"
+
+    def _list(self, value):
+        """ Filters are lists of strings, a single string is taken as a list of one
+        """
+        if not value:
+            return []
+        if isinstance(value, basestring):
+            return [str(value)]
+        return [str(entry) for entry in value]
+
+    def wants(self, message):
+        """ Does message pass our filters
+            ids, idPrefixes and commands only apply to WirelessMessage's
+        """
+        if self.types and message['type'] not in self.types:
+            return False
+        if message['type'] != "WirelessMessage":
+            return True
+        if (self.ids or self.idPrefixes) and not (message['id'] in self.ids or
+                                                  (self.idPrefixes and message['id'].startswith(self.idPrefixes))):
+            return False
+        if self.commands and not message['data'][0].startswith(self.commands):
+            return False
+        return True
+
+    def toDict(self):
+        """ Registration as it is reported in JSON
+        """
+        return {'address': self.address[0],
+                'port': self.address[1],
+                'network': self.network,
+                'types': self.types,
+                'ids': self.ids,
+                'idPrefixes': list(self.idPrefixes),
+                'commands': list(self.commands),
+                'format': "binary" if self.binary else "json",
+                'expires': strftime("%d %b %Y %H:%M:%S +0000", gmtime(self.expires))
+                }
+
+class SubscriberRegistry():
+    """ Registrations keyed by (host, port, network)
+
+        Subscribers listing only exact device ID's are indexed by ID so a
+        WirelessMessage is only checked against those that could want it
+        plus the ones with no ID list or with ID prefixes.
+        Registrations expire after their lease unless renewed by subscribing
+        again, expired ones are dropped as they are found.
+    """
+
+    _purgeInterval = 10     # seconds between sweeps for expired registrations
+
+    def __init__(self, defaultLease=300, maxLease=3600, maxSubscribers=50):
+        self.defaultLease = int(defaultLease)
+        self.maxLease = int(maxLease)
+        self.maxSubscribers = int(maxSubscribers)
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._byID = {}         # device ID to subscribers listing it in ids
+        self._wildcard = []     # subscribers without an ids list or with idPrefixes
+        self._nextPurge = 0
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def setLimits(self, defaultLease, maxLease, maxSubscribers):
+        """ Change the lease and size limits, existing registrations keep their expiry
+        """
+        self.defaultLease = int(defaultLease)
+        self.maxLease = int(maxLease)
+        self.maxSubscribers = int(maxSubscribers)
+
+    def subscribe(self, address, network, filters, lease=None):
+        """ Add or renew a registration, returns the Subscriber
+            or None if the registry is full
+        """
+        lease = min(int(lease or self.defaultLease), self.maxLease)
+        key = (address[0], address[1], network)
+        with self._lock:
+            self._purge(time())
+            if not self._subscribers.has_key(key) and len(self._subscribers) >= self.maxSubscribers:
+                return None
+            self._remove(key)
+            subscriber = Subscriber(address, network, filters, time() + lease)
+            self._subscribers[key] = subscriber
+            self._index(subscriber)
+        return subscriber
+
+    def unsubscribe(self, address, network):
+        """ Drop a registration, returns True if there was one
+        """
+        with self._lock:
+            return self._remove((address[0], address[1], network))
+
+    def subscribers(self, network=None):
+        """ Current registrations, optionally only those on network
+        """
+        with self._lock:
+            self._purge(time())
+            return [subscriber for subscriber in self._subscribers.values()
+                    if network is None or subscriber.network == network]
+
+    def match(self, message):
+        """ The subscribers that want message
+        """
+        now = time()
+        with self._lock:
+            if now >= self._nextPurge:
+                self._purge(now)
+            if message['type'] == "WirelessMessage":
+                candidates = self._byID.get(message['id'], []) + self._wildcard
+            else:
+                candidates = self._subscribers.values()
+            return [subscriber for subscriber in candidates
+                    if subscriber.network == message['network'] and subscriber.expires > now
+                    and subscriber.wants(message)]
+
+    def _index(self, subscriber):
+        if subscriber.ids and not subscriber.idPrefixes:
+            for deviceID in subscriber.ids:
+                self._byID.setdefault(deviceID, []).append(subscriber)
+        else:
+            self._wildcard.append(subscriber)
+
+    def _remove(self, key):
+        subscriber = self._subscribers.pop(key, None)
+        if subscriber is None:
+            return False
+        if subscriber in self._wildcard:
+            self._wildcard.remove(subscriber)
+        else:
+            for deviceID in subscriber.ids:
+                self._byID[deviceID].remove(subscriber)
+                if not self._byID[deviceID]:
+                    del self._byID[deviceID]
+        return True
+
+    def _purge(self, now):
+        for key, subscriber in self._subscribers.items():
+            if subscriber.expires <= now:
+                self._remove(key)
+        self._nextPurge = now + self._purgeInterval
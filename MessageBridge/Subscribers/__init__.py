@@ -0,0 +1,3 @@
+from SubscriberRegistry import SubscriberRegistry, Subscriber
+
+__ALL__ = ['SubscriberRegistry', 'Subscriber']
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" TX Scheduler
+    Priority aware transmit queue for the serial side of the Message Bridge
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import threading
+import Queue
+from collections import deque
+from time import time
+from WakeupQueue import WakeupPipe
+
+class TXScheduler():
+    """ Drop in replacement for the qSerialOut FIFO
+
+        Messages are queued into one of the priority classes below and
+        always taken from the highest priority class that has something
+        waiting. Each class has its own depth limit, putting to a full
+        class raises Queue.Full and is counted as a drop.
+
+        If a baud rate is given transmission is paced to the airtime of
+        the previous message, so a burst stays in the scheduler (where the
+        priority still applies) rather than in the UART buffer.
+        get_nowait() raises Queue.Empty while paced, nextSendIn() tells the
+        serial thread how long to wait.
+    """
+
+    SENDON = 0          # replies to a device inside its wake window
+    DCR = 1             # DeviceConfigurationRequest queries
+    INTERACTIVE = 2     # WirelessMessage commands from UDP
+    BULK = 3            # WirelessMessage commands flagged as bulk
+
+    classNames = ["sendOn", "DCR", "interactive", "bulk"]
+
+    _bitsPerByte = 10   # 8N1, start + 8 data + stop
+
+    def __init__(self, depths=None, baudrate=None):
+        """ depths is a list of queue depth limits indexed by class
+            0 or None means unlimited
+        """
+        self._depths = list(depths) if depths else [0] * len(self.classNames)
+        self._byteTime = float(self._bitsPerByte) / int(baudrate) if baudrate else 0
+        self._queues = [deque() for name in self.classNames]
+        self._lock = threading.Lock()
+        self._wakeup = WakeupPipe()
+        self._nextSend = 0
+        self._queued = [0] * len(self.classNames)
+        self._sent = [0] * len(self.classNames)
+        self._dropped = [0] * len(self.classNames)
+
+    def put_nowait(self, item, priority=INTERACTIVE, queued=None):
+        """ Queue item in the given priority class, queued is when it was
+            first queued if that was before now (eg before a restart)
+            raises Queue.Full if that class is at its depth limit
+        """
+        with self._lock:
+            if self._depths[priority] and len(self._queues[priority]) >= self._depths[priority]:
+                self._dropped[priority] += 1
+                raise Queue.Full
+            self._queues[priority].append((item, time() if queued is None else queued))
+            self._queued[priority] += 1
+        self._wakeup.wake()
+
+    put = put_nowait
+
+    def get_nowait(self):
+        """ Take the next item to send
+            raises Queue.Empty if nothing is waiting or pacing holds it back
+        """
+        with self._lock:
+            now = time()
+            if now < self._nextSend:
+                raise Queue.Empty
+            for priority, queue in enumerate(self._queues):
+                if queue:
+                    item = queue.popleft()[0]
+                    self._sent[priority] += 1
+                    self._nextSend = now + len(item) * self._byteTime
+                    return item
+        raise Queue.Empty
+
+    def nextSendIn(self):
+        """ Seconds until get_nowait() can return something
+            None if nothing is waiting
+        """
+        with self._lock:
+            if not any(self._queues):
+                return None
+            return max(0, self._nextSend - time())
+
+    def empty(self):
+        with self._lock:
+            return not any(self._queues)
+
+    def qsize(self):
+        with self._lock:
+            return sum(len(queue) for queue in self._queues)
+
+    def drain(self, priorities):
+        """ Take everything waiting in the given classes
+            Returns a list of (item, priority, queued) in the order they would
+            have been sent, queued is the time they were put
+        """
+        with self._lock:
+            items = []
+            for priority in sorted(priorities):
+                items.extend((item, priority, queued) for (item, queued) in self._queues[priority])
+                self._queues[priority].clear()
+            return items
+
+    def task_done(self):
+        """ Kept for Queue.Queue compatibility, counts are taken in get_nowait
+        """
+        pass
+
+    def stats(self):
+        """ Per class counters, ready to go into a JSON reply
+        """
+        with self._lock:
+            result = {}
+            for priority, name in enumerate(self.classNames):
+                result[name] = {'queued': self._queued[priority],
+                                'sent': self._sent[priority],
+                                'dropped': self._dropped[priority],
+                                'waiting': len(self._queues[priority])
+                                }
+            return result
+
+    def fileno(self):
+        """ Read end of the wakeup pipe, for use with select()
+            None if the scheduler can not be selected on (win32)
+        """
+        return self._wakeup.fileno()
+
+    def wake(self):
+        """ Wake up anyone waiting in select() on this scheduler
+        """
+        self._wakeup.wake()
+
+    def clearWakeup(self):
+        """ Empty the wakeup pipe
+        """
+        self._wakeup.clear()
+
+    def close(self):
+        """ Close the wakeup pipe
+        """
+        self._wakeup.close()
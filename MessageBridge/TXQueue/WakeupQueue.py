@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Wakeup Queue
+    Queue.Queue that can be waited on with select() alongside other file handles
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import os
+import errno
+import Queue
+try:
+    import fcntl
+except ImportError:
+    # win32, pipes can not be used with select() so there is no wakeup
+    fcntl = None
+
+class WakeupPipe():
+    """ Self pipe used to wake a thread blocked in select()
+
+        Where there is no selectable pipe (win32) fileno() returns None and
+        the waiting thread has to fall back to polling.
+    """
+
+    def __init__(self):
+        if fcntl is None:
+            self._wakeupRead = self._wakeupWrite = None
+            return
+        self._wakeupRead, self._wakeupWrite = os.pipe()
+        for fd in (self._wakeupRead, self._wakeupWrite):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def fileno(self):
+        """ Read end of the pipe, for use with select()
+        """
+        return self._wakeupRead
+
+    def wake(self):
+        """ Wake up anyone waiting in select() on this pipe
+        """
+        if self._wakeupWrite is None:
+            return
+        try:
+            os.write(self._wakeupWrite, 'w')
+        except OSError as e:
+            # pipe full means a wakeup is already pending
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def clear(self):
+        """ Empty the pipe
+        """
+        if self._wakeupRead is None:
+            return
+        try:
+            while os.read(self._wakeupRead, 512):
+                pass
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def close(self):
+        """ Close both ends of the pipe
+        """
+        if self._wakeupRead is None:
+            return
+        for fd in (self._wakeupRead, self._wakeupWrite):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._wakeupRead = self._wakeupWrite = None
+
+class WakeupQueue(Queue.Queue):
+    """ A Queue.Queue with a wakeup pipe
+
+        Every put writes a byte to the pipe so a consumer blocked in
+        select() on fileno() wakes the moment something is queued.
+        wake() can be used by other threads to break the consumer out of
+        select() without queueing anything (stop flags etc.)
+        The consumer must call clearWakeup() before draining the queue.
+    """
+
+    def __init__(self, maxsize=0):
+        Queue.Queue.__init__(self, maxsize)
+        self._wakeup = WakeupPipe()
+
+    def _put(self, item):
+        Queue.Queue._put(self, item)
+        self._wakeup.wake()
+
+    def fileno(self):
+        """ Read end of the wakeup pipe, for use with select()
+            None if the queue can not be selected on (win32)
+        """
+        return self._wakeup.fileno()
+
+    def wake(self):
+        """ Wake up anyone waiting in select() on this queue
+        """
+        self._wakeup.wake()
+
+    def clearWakeup(self):
+        """ Empty the wakeup pipe
+        """
+        self._wakeup.clear()
+
+    def close(self):
+        """ Close the wakeup pipe
+        """
+        self._wakeup.close()
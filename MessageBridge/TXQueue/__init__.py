@@ -0,0 +1,4 @@
+from WakeupQueue import WakeupQueue, WakeupPipe
+from TXScheduler import TXScheduler
+
+__ALL__ = ['WakeupQueue', 'WakeupPipe', 'TXScheduler']
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Radio Simulator
+    A simulated WirelessThings radio and fleet of Language of Things devices
+    on a pseudo-terminal, for testing the Message Bridge without hardware
+
+    usage
+    $ python RadioSimulator.py --devices 20 --reading-interval 5
+    then point the Message Bridge at the printed port
+    $ python MessageBridge.py --port /dev/pts/N
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import os
+import sys
+import tty
+import errno
+import select
+import threading
+import random
+import heapq
+import logging
+from time import time, sleep
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import LoTParser
+
+class RadioSimulator():
+    """ Emulates a radio on the master side of a pty
+
+        The radio answers the AT commands the Message Bridge uses (+++, ATVR,
+        ATSN, ATSF, ATLH, ATID, ATEE, ATEK, ATAC, ATWR, ATDN) and in normal
+        mode stands in for a fleet of devices.
+
+        Each device sends a reading every readingInterval seconds and echoes
+        back any message sent to its ID, the way a device ACKs a command.
+        If configmeInterval is set one extra device of type devType sits in
+        configuration mode, sending a??CONFIGME- every configmeInterval
+        seconds and answering a?? queries (DTY, APVER, ENx and any setting).
+
+        Timings are jittered from a seeded random so runs are repeatable.
+
+        onFrame, if set, is called with every Language of Things message the
+        Message Bridge sends out over the air.
+    """
+
+    firmwareVersion = "0.99BSRFV2"
+    _guardTime = 1.0        # delay before a +++ is answered with OK
+
+    def __init__(self, devices=10, readingInterval=10.0, configmeInterval=0,
+                 devType="SIMULATED", seed=0, logger=None):
+        self.devices = int(devices)
+        self.readingInterval = float(readingInterval)
+        self.configmeInterval = float(configmeInterval)
+        self.devType = devType
+        self.logger = logger or logging.getLogger('Radio Simulator')
+        self._random = random.Random(seed)
+
+        self._at = {'ATSN': "00000001",
+                    'ATSF': "00000001",
+                    'ATLH': "0",
+                    'ATID': "5AA5",
+                    'ATEE': "0",
+                    'ATEK': "00000000000000000000000000000000",
+                    }
+        self._configme = {'APVER': "2.0",
+                          'DTY': devType[0:9],
+                          'CHDEVID': "??",
+                          'INTVL': "005M",
+                          }
+        self._inATMode = False
+        self._atBuffer = ""
+        self._normalBuffer = ""
+        self._parser = LoTParser.LoTParser()
+        self._timers = []
+
+        self.ids = self._makeIDs(self.devices)
+        self.framesSent = 0
+        self.framesReceived = 0
+        self.onFrame = None
+        self._writeLock = threading.Lock()
+
+        self._master, self._slave = os.openpty()
+        # no echo or line editing on the radio side
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _makeIDs(self, count):
+        """ Two character device ID's AA, AB, ... ZZ
+        """
+        letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+        return [letters[i // 26 % 26] + letters[i % 26] for i in range(count)]
+
+    def start(self):
+        now = time()
+        for deviceID in self.ids:
+            self._schedule(now + self._random.uniform(0, self.readingInterval), self._sendReading, deviceID)
+        if self.configmeInterval:
+            self._schedule(now + self._random.uniform(0, self.configmeInterval), self._sendConfigme)
+        self._thread = threading.Thread(name='tRadioSimulator', target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _schedule(self, when, callback, *args):
+        heapq.heappush(self._timers, (when, callback, args))
+
+    def _run(self):
+        while not self._stop.is_set():
+            timeout = 0.5
+            if self._timers:
+                timeout = min(timeout, max(0, self._timers[0][0] - time()))
+            try:
+                readable = select.select([self._master], [], [], timeout)[0]
+            except select.error as e:
+                if e[0] == errno.EINTR:
+                    continue
+                raise
+            if readable:
+                try:
+                    data = os.read(self._master, 1024)
+                except OSError as e:
+                    # EIO when nothing has the slave open
+                    if e.errno != errno.EIO:
+                        raise
+                    self._stop.wait(0.1)
+                else:
+                    self._receive(data)
+
+            now = time()
+            while self._timers and self._timers[0][0] <= now:
+                (when, callback, args) = heapq.heappop(self._timers)
+                callback(*args)
+
+    def _write(self, data):
+        try:
+            os.write(self._master, data)
+        except OSError as e:
+            self.logger.debug("RadioSimulator: failed to write {}: {}".format(data, e))
+
+    def sendFrame(self, deviceID, data):
+        """ Send a Language of Things message from deviceID to the Message Bridge
+            can be called from any thread
+        """
+        frame = "a{}{}".format(deviceID, data)[0:12]
+        while len(frame) < 12:
+            frame += '-'
+        with self._writeLock:
+            self._write(frame)
+            self.framesSent += 1
+
+    def _receive(self, data):
+        """ Bytes written to the radio by the Message Bridge
+        """
+        if self._inATMode:
+            self._atBuffer += data
+            while '\r' in self._atBuffer:
+                (line, self._atBuffer) = self._atBuffer.split('\r', 1)
+                self._ATCommand(line)
+            return
+
+        self._normalBuffer = (self._normalBuffer + data)[-3:]
+        if self._normalBuffer == "+++":
+            self._normalBuffer = ""
+            self._schedule(time() + self._guardTime, self._enterATMode)
+            return
+
+        for frame in self._parser.feed(data):
+            self.framesReceived += 1
+            if self.onFrame:
+                self.onFrame(frame)
+            self._LoTMessage(frame)
+
+    def _enterATMode(self):
+        self._inATMode = True
+        self._atBuffer = ""
+        self._write("OK\r")
+
+    def _ATCommand(self, line):
+        """ Answer a single AT command
+        """
+        line = line.strip()
+        if line == "AT":
+            self._write("OK\r")
+        elif line == "ATDN":
+            self._write("OK\r")
+            self._inATMode = False
+            self._parser.reset()
+        elif line in ("ATAC", "ATWR"):
+            self._write("OK\r")
+        elif line == "ATVR":
+            self._write("{}\rOK\r".format(self.firmwareVersion))
+        elif line.startswith("PANID"):
+            self._at['ATID'] = line[5:]
+            self._write("OK\r")
+        elif self._at.has_key(line):
+            self._write("{}\rOK\r".format(self._at[line]))
+        elif self._at.has_key(line[0:4]):
+            self._at[line[0:4]] = line[4:]
+            self._write("OK\r")
+        else:
+            self._write("ERR\r")
+
+    def _LoTMessage(self, frame):
+        """ A Language of Things message sent out over the air
+        """
+        deviceID = frame[1:3]
+        data = frame[3:].strip('-')
+        if deviceID == "??":
+            if self.configmeInterval:
+                self._configmeQuery(data)
+        elif deviceID in self.ids:
+            # devices ACK by sending the message back
+            self.sendFrame(deviceID, data)
+
+    def _configmeQuery(self, data):
+        """ Answer a query sent to the device in configuration mode
+        """
+        if data.startswith("EN") and len(data) > 2 and data[2] in "123456":
+            self.sendFrame("??", "{}ACK".format(data[0:3]))
+            return
+        for command in sorted(self._configme.keys(), key=len, reverse=True):
+            if data.startswith(command):
+                if data[len(command):] and command not in ("APVER", "DTY"):
+                    self._configme[command] = data[len(command):]
+                self.sendFrame("??", command + self._configme[command])
+                return
+        # any other setting is accepted and echoed back
+        self.sendFrame("??", data)
+
+    def _sendReading(self, deviceID):
+        self.sendFrame(deviceID, "TMPA{:.2f}".format(self._random.uniform(15, 25)))
+        self._schedule(time() + self.readingInterval * self._random.uniform(0.9, 1.1), self._sendReading, deviceID)
+
+    def _sendConfigme(self):
+        self.sendFrame("??", "CONFIGME")
+        self._schedule(time() + self.configmeInterval, self._sendConfigme)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='WirelessThings Radio Simulator')
+    parser.add_argument('-n', '--devices', type=int, default=10,
+                        help='Number of devices sending readings')
+    parser.add_argument('-r', '--reading-interval', type=float, default=10,
+                        help='Seconds between readings from each device')
+    parser.add_argument('-c', '--configme-interval', type=float, default=0,
+                        help='Seconds between CONFIGME messages, 0 for no device in configuration mode')
+    parser.add_argument('-t', '--devtype', default="SIMULATED",
+                        help='DTY reported by the device in configuration mode')
+    args = parser.parse_args()
+
+    simulator = RadioSimulator(args.devices, args.reading_interval, args.configme_interval, args.devtype)
+    simulator.start()
+    print("Radio simulator running on {}".format(simulator.port))
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Radio transports
+    Pick the transport for a radio from its configured port
+
+    Requires pySerial
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import urlparse
+import serial
+from RadioSimulator import RadioSimulator
+
+SIMULATOR_SCHEME = "sim://"
+
+# sim:// query options and the RadioSimulator argument they set
+_simulatorOptions = {'devices': 'devices',
+                     'reading_interval': 'readingInterval',
+                     'configme_interval': 'configmeInterval',
+                     'devtype': 'devType',
+                     'seed': 'seed',
+                     }
+
+def makeTransport(port):
+    """ Return an unopened transport for port
+
+        A transport is anything with the pySerial Serial interface the
+        Message Bridge and AT helper use: port, baudrate, timeout, open(),
+        close(), isOpen(), read(), write(), inWaiting(), flushInput() and
+        fileno() for select().
+
+        port is either a serial device (/dev/ttyAMA0, COM1 ...) or a
+        simulated radio given as sim://?devices=10&reading_interval=5
+    """
+    if port.startswith(SIMULATOR_SCHEME):
+        return SimulatedTransport(port)
+    transport = serial.Serial()
+    transport.port = port
+    return transport
+
+class SimulatedTransport(serial.Serial):
+    """ A serial port connected to a RadioSimulator
+
+        A new simulator is started on a pseudo-terminal every time the
+        transport is opened and stopped when it is closed.
+    """
+
+    def __init__(self, url):
+        serial.Serial.__init__(self)
+        self.url = url
+        self.simulator = None
+        self._simulatorArgs = {}
+        query = urlparse.urlparse(url).query or url[len(SIMULATOR_SCHEME):].lstrip('?')
+        for (option, values) in urlparse.parse_qs(query).items():
+            if _simulatorOptions.has_key(option):
+                self._simulatorArgs[_simulatorOptions[option]] = values[-1]
+
+    def open(self):
+        if self.isOpen():
+            # left open by a serial thread that died, start again with a new simulator
+            self.close()
+        self.simulator = RadioSimulator(**self._simulatorArgs)
+        self.simulator.start()
+        self.port = self.simulator.port
+        try:
+            serial.Serial.open(self)
+        except serial.SerialException:
+            self._stopSimulator()
+            raise
+
+    def close(self):
+        serial.Serial.close(self)
+        self._stopSimulator()
+
+    def _stopSimulator(self):
+        if self.simulator:
+            self.simulator.stop()
+            self.simulator = None
@@ -0,0 +1,4 @@
+from Transport import makeTransport, SimulatedTransport
+from RadioSimulator import RadioSimulator
+
+__ALL__ = ['makeTransport', 'SimulatedTransport', 'RadioSimulator']
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Wire Format
+    Compact binary encoding of Message Bridge UDP traffic
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import json
+import struct
+import logging
+from time import time
+
+class WireFormat():
+    """ Binary datagrams as an alternative to JSON
+
+        A datagram starts with the version byte, which can never start a
+        JSON text, followed by one or more records
+
+        WirelessMessage record
+            0x01
+            timestamp   8 bytes, milliseconds since the epoch, big endian
+            network     1 byte length then the name
+            id          2 bytes
+            data        1 byte count then for each 1 byte length and the command
+        JSON record, any other message or one that does not fit the above
+            0x02
+            length      2 bytes, big endian
+            json        the same JSON text that would have been sent
+            JSON of 64KiB or more can not be given a length, or sent in a
+            datagram at all, so it is left out with a warning
+
+        A WirelessMessage from a 12 byte frame is about 25 bytes instead of
+        about 120 as JSON. Decoded WirelessMessage's have an epochMs instead
+        of the timestamp string, JSON records are returned as json.loads()
+        gives them.
+
+        Examples/Python CLI/wirelessThingsBinary.py is a stand alone copy of
+        the decoder for clients.
+    """
+
+    VERSION = '\xa1'
+    WIRELESS_MESSAGE = '\x01'
+    JSON = '\x02'
+
+    _header = struct.Struct('>QB')
+    _length = struct.Struct('>H')
+
+    @classmethod
+    def isBinary(cls, data):
+        return data[:1] == cls.VERSION
+
+    _maxJSON = 0xffff
+
+    @classmethod
+    def encode(cls, items, now=None):
+        """ Encode a list of qUDPSend items, (json, message, ...), into one datagram
+            now is the time to put on WirelessMessage's, the current time if not given
+            Returns None if every item was too big to encode
+        """
+        epochMs = int((time() if now is None else now) * 1000)
+        records = [cls.VERSION]
+        for item in items:
+            message = item[1]
+            record = None
+            if message.get('type') == "WirelessMessage":
+                record = cls._encodeWirelessMessage(message, epochMs)
+            if record is None:
+                jsonout = item[0]
+                if isinstance(jsonout, unicode):
+                    jsonout = jsonout.encode('utf-8')
+                if len(jsonout) > cls._maxJSON:
+                    logging.getLogger('Message Bridge.WireFormat').warn(
+                        "{} JSON of {} bytes is too big for a binary datagram, left out".format(message.get('type'), len(jsonout)))
+                    continue
+                record = cls.JSON + cls._length.pack(len(jsonout)) + jsonout
+            records.append(record)
+        if len(records) == 1:
+            return None
+        return ''.join(records)
+
+    @classmethod
+    def _encodeWirelessMessage(cls, message, epochMs):
+        """ The record for a WirelessMessage or None if it does not fit the format
+        """
+        network = cls._bytes(message.get('network'))
+        deviceID = cls._bytes(message.get('id'))
+        data = message.get('data')
+        if (network is None or len(network) > 255 or deviceID is None or len(deviceID) != 2 or
+                not isinstance(data, list) or len(data) > 255):
+            return None
+        record = [cls.WIRELESS_MESSAGE, cls._header.pack(epochMs, len(network)), network, deviceID, chr(len(data))]
+        for command in data:
+            command = cls._bytes(command)
+            if command is None or len(command) > 255:
+                return None
+            record.append(chr(len(command)))
+            record.append(command)
+        return ''.join(record)
+
+    @staticmethod
+    def _bytes(value):
+        if isinstance(value, str):
+            return value
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return None
+
+    @classmethod
+    def decode(cls, data):
+        """ List of the messages in a binary datagram
+            raises ValueError if it is not a valid one
+        """
+        if not cls.isBinary(data):
+            raise ValueError("Not a binary datagram")
+        messages = []
+        position = 1
+        try:
+            while position < len(data):
+                recordType = data[position]
+                position += 1
+                if recordType == cls.WIRELESS_MESSAGE:
+                    (epochMs, length) = cls._header.unpack_from(data, position)
+                    position += cls._header.size
+                    network = data[position:position + length]
+                    deviceID = data[position + length:position + length + 2]
+                    count = ord(data[position + length + 2])
+                    position += length + 3
+                    commands = []
+                    for n in range(count):
+                        length = ord(data[position])
+                        commands.append(data[position + 1:position + 1 + length])
+                        position += 1 + length
+                    if position > len(data) or len(deviceID) != 2:
+                        raise ValueError("Truncated WirelessMessage record")
+                    messages.append({'type': "WirelessMessage",
+                                     'network': network,
+                                     'id': deviceID,
+                                     'data': commands,
+                                     'epochMs': epochMs})
+                elif recordType == cls.JSON:
+                    (length,) = cls._length.unpack_from(data, position)
+                    position += cls._length.size
+                    if position + length > len(data):
+                        raise ValueError("Truncated JSON record")
+                    messages.append(json.loads(data[position:position + length]))
+                    position += length
+                else:
+                    raise ValueError("Unknown record type {!r}".format(recordType))
+        except (struct.error, IndexError):
+            raise ValueError("Truncated record")
+        return messages
+
+if __name__ == "__main__":
+    # round trip a WirelessMessage and JSON records, the oversize one is left out
+    reading = {'type': "WirelessMessage", 'network': "Serial", 'id': "MA", 'data': ["TEMP19.20"]}
+    small = {'type': "MessageBridge", 'network': "Serial", 'data': {}}
+    large = {'type': "MessageBridge", 'network': "Serial", 'data': {'padding': "x" * 70000}}
+    items = [(json.dumps(message), message) for message in (reading, small, large)]
+    decoded = WireFormat.decode(WireFormat.encode(items, 1400000000))
+    assert len(decoded) == 2, decoded
+    assert decoded[0]['data'] == ["TEMP19.20"] and decoded[0]['epochMs'] == 1400000000000
+    assert decoded[1] == small
+    assert WireFormat.encode(items[2:]) is None
+    print("WireFormat OK")
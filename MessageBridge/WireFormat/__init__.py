@@ -0,0 +1,3 @@
+from WireFormat import WireFormat
+
+__ALL__ = ['WireFormat']
@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Message Bridge end to end benchmark
+
+    Runs MessageBridge.py against a simulated radio on a pseudo-terminal and
+    local UDP sockets and measures
+        serial to UDP      messages/s, p50/p99 latency and CPU per message
+        UDP to serial      messages/s, p50/p99 latency and CPU per message
+        DCR                round trip time
+        fleet startup      a bridge started on a sim:// fleet already sending
+                           readings stays up and passes them on
+    Results are written as JSON, and can be compared against a previous
+    run to catch regressions in the bridge hot paths.
+    CPU is read from /proc in clock ticks, use a --count of a few hundred
+    or more for a meaningful per message figure.
+
+    usage
+    $ python benchmark.py --output results.json
+    $ python benchmark.py --baseline results.json --tolerance 20
+
+    Linux only, needs pySerial
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import sys
+import os
+import shutil
+import tempfile
+import subprocess
+import threading
+import socket
+import select
+import json
+import argparse
+from time import time, sleep
+
+_bridgePath = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../MessageBridge')
+sys.path.insert(0, _bridgePath)
+import Transport
+
+SEND_PORT = 50150       # bridge sends JSON here
+LISTEN_PORT = 50151     # bridge listens here
+NETWORK = "Benchmark"
+BENCH_ID = "BM"
+
+# metrics where bigger is better, everything else is a time
+_higherIsBetter = ('msgs_per_sec', 'readings')
+# what the test was asked to do, not how it did
+_settings = ('count', 'devices')
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def summarise(latencies, count, elapsed, cpu):
+    """ Turn raw measurements into the reported metrics, times in ms
+    """
+    return {'count': count,
+            'received': len(latencies),
+            'msgs_per_sec': round(len(latencies) / elapsed, 1) if elapsed else None,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+            'cpu_us_per_msg': round(cpu / len(latencies) * 1e6, 1) if latencies and cpu is not None else None,
+            }
+
+class BridgeProcess():
+    """ MessageBridge.py running in its own working directory against a simulator
+    """
+
+    def __init__(self, port, python, debug=False, udpOptions=None, core='threaded'):
+        self._dir = tempfile.mkdtemp(prefix='mbbench')
+        shutil.copy(os.path.join(_bridgePath, 'MessageBridge_defaults.cfg'), self._dir)
+        os.mkdir(os.path.join(self._dir, 'CSVLogs'))
+        with open(os.path.join(self._dir, 'MessageBridge.cfg'), 'w') as cfg:
+            cfg.write("[Serial]\nnetwork = {}\nbaudrate = 115200\n".format(NETWORK))
+            cfg.write("[UDP]\nsend_port = {}\nlisten_port = {}\nuse_local_only = True\n".format(SEND_PORT, LISTEN_PORT))
+            for option in udpOptions or []:
+                cfg.write("{} = {}\n".format(*option))
+            cfg.write("[Run]\npid_file_path_name = {}\ncore = {}\n".format(self._dir, core))
+        args = [python, os.path.join(_bridgePath, 'MessageBridge.py'), '--port', port]
+        if debug:
+            args.append('--debug')
+        self.process = subprocess.Popen(args, cwd=self._dir)
+
+    def cpuTime(self):
+        """ user + system CPU seconds used so far, None if /proc is not available
+        """
+        try:
+            with open('/proc/{}/stat'.format(self.process.pid)) as stat:
+                fields = stat.read().rsplit(')', 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / float(os.sysconf('SC_CLK_TCK'))
+        except (IOError, IndexError, ValueError):
+            return None
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+class Benchmark():
+
+    def __init__(self, args):
+        self.args = args
+        self._arrived = {}
+        self._pending = []
+        self._lock = threading.Lock()
+
+        self.simulator = Transport.RadioSimulator(devices=0, configmeInterval=args.configme_interval, seed=1)
+        self.simulator.onFrame = self._onFrame
+        self.simulator.start()
+
+        self.listen = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.listen.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listen.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self.listen.bind(('', SEND_PORT))
+        self.send = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        udpOptions = [('batch_mode', True)] if args.batch else []
+        self.bridge = BridgeProcess(self.simulator.port, args.python, args.debug, udpOptions, args.core)
+
+    def _onFrame(self, frame):
+        if frame[1:3] == BENCH_ID:
+            with self._lock:
+                self._arrived[frame[3:].strip('-')] = time()
+
+    def _sendJSON(self, message):
+        self.send.sendto(json.dumps(message), ('127.0.0.1', LISTEN_PORT))
+
+    def _receiveJSON(self, timeout):
+        """ Next JSON from the bridge and the time it arrived, or (None, None)
+            a WirelessMessageBatch is handed out one message at a time
+        """
+        if self._pending:
+            return self._pending.pop(0)
+        if not select.select([self.listen], [], [], timeout)[0]:
+            return (None, None)
+        data = self.listen.recvfrom(65536)[0]
+        arrived = time()
+        message = json.loads(data)
+        if message['type'] == "WirelessMessageBatch":
+            self._pending = [(batched, arrived) for batched in message['messages']]
+            return self._pending.pop(0)
+        return (message, arrived)
+
+    def waitForBridge(self, timeout=60):
+        """ Ask the bridge for its state until it answers Running
+        """
+        end = time() + timeout
+        while time() < end:
+            self._sendJSON({"type": "MessageBridge", "network": NETWORK})
+            (message, arrived) = self._receiveJSON(1)
+            if message and message['type'] == "MessageBridge" and message.get('state') == "Running":
+                return True
+        return False
+
+    def serialToUDP(self, count, rate):
+        """ Inject count readings from the simulator, rate 0 is as fast as possible
+        """
+        sent = {}
+        latencies = []
+        cpu = self.bridge.cpuTime()
+        start = time()
+
+        def inject():
+            for seq in range(count):
+                key = "{:09d}".format(seq)
+                sent[key] = time()
+                self.simulator.sendFrame(BENCH_ID, key)
+                if rate:
+                    sleep(1.0 / rate)
+        injector = threading.Thread(target=inject)
+        injector.start()
+
+        last = time()
+        while len(latencies) < count and time() - last < self.args.settle:
+            (message, arrived) = self._receiveJSON(0.1)
+            if message and message['type'] == "WirelessMessage" and message['id'] == BENCH_ID:
+                latencies.append(arrived - sent[message['data'][0]])
+                last = arrived
+        elapsed = last - start
+        injector.join()
+        cpuEnd = self.bridge.cpuTime()
+        return summarise(latencies, count, elapsed, cpuEnd - cpu if cpu is not None else None)
+
+    def udpToSerial(self, count, rate):
+        """ Send count WirelessMessage JSON's to the bridge, rate 0 is as fast as possible
+        """
+        with self._lock:
+            self._arrived = {}
+        sent = {}
+        cpu = self.bridge.cpuTime()
+        start = time()
+        for seq in range(count):
+            key = "{:09d}".format(seq)
+            sent[key] = time()
+            self._sendJSON({"type": "WirelessMessage", "network": NETWORK, "id": BENCH_ID, "data": [key]})
+            if rate:
+                sleep(1.0 / rate)
+
+        # wait for the last stragglers
+        last = time()
+        while time() - last < self.args.settle:
+            with self._lock:
+                received = len(self._arrived)
+            if received == count:
+                break
+            sleep(0.05)
+            with self._lock:
+                if len(self._arrived) != received:
+                    last = time()
+        cpuEnd = self.bridge.cpuTime()
+        with self._lock:
+            arrived = dict(self._arrived)
+        latencies = [arrived[seq] - sent[seq] for seq in arrived if seq in sent]
+        elapsed = (max(arrived.values()) - start) if arrived else 0
+        return summarise(latencies, count, elapsed, cpuEnd - cpu if cpu is not None else None)
+
+    def dcrRoundTrip(self, count):
+        """ count DeviceConfigurationRequest's one after the other, time to their PASS/FAIL reply
+        """
+        latencies = []
+        failed = 0
+        for n in range(count):
+            sent = time()
+            self._sendJSON({"type": "DeviceConfigurationRequest", "network": NETWORK,
+                            "data": {"toQuery": [{"command": "APVER"}, {"command": "INTVL", "value": "001M"}],
+                                     "timeout": 30}})
+            while True:
+                (message, arrived) = self._receiveJSON(35)
+                if message is None:
+                    failed += 1
+                    break
+                if message['type'] == "DeviceConfigurationRequest":
+                    if message['data'].get('state') == "PASS":
+                        latencies.append(arrived - sent)
+                    else:
+                        failed += 1
+                    break
+        return {'count': count,
+                'failed': failed,
+                'p50_ms': round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+                'p99_ms': round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+                }
+
+    def fleetStartup(self, devices, readingInterval, duration):
+        """ Start a bridge of its own on a sim:// fleet of devices that send
+            readings from the moment the radio is up, then count the readings
+            passed on for duration seconds. Fails if the bridge does not get
+            to Running, exits or does not pass on a reading from every device
+        """
+        port = "sim://?devices={}&reading_interval={}".format(devices, readingInterval)
+        bridge = BridgeProcess(port, self.args.python, self.args.debug, None, self.args.core)
+        readings = 0
+        heardFrom = set()
+        try:
+            started = self.waitForBridge()
+            end = time()
+            if started:
+                end += duration
+            while time() < end:
+                (message, arrived) = self._receiveJSON(0.5)
+                if message and message['type'] == "WirelessMessage":
+                    readings += 1
+                    heardFrom.add(message['id'])
+            running = bridge.process.poll() is None
+        finally:
+            bridge.stop()
+        return {'devices': devices,
+                'readings': readings,
+                'heard_from': len(heardFrom),
+                'failed': 0 if started and running and len(heardFrom) == devices else 1,
+                }
+
+    def run(self):
+        results = {}
+        try:
+            try:
+                if not self.waitForBridge():
+                    raise RuntimeError("Message Bridge did not start")
+                results['serial_to_udp'] = self.serialToUDP(self.args.count, self.args.rate)
+                results['serial_to_udp_burst'] = self.serialToUDP(self.args.count, 0)
+                results['udp_to_serial'] = self.udpToSerial(self.args.count, self.args.rate)
+                results['udp_to_serial_burst'] = self.udpToSerial(self.args.count, 0)
+                if self.args.dcr_count:
+                    results['dcr'] = self.dcrRoundTrip(self.args.dcr_count)
+            finally:
+                self.bridge.stop()
+                self.simulator.stop()
+            # the fleet's bridge uses the same UDP ports so it runs once the first has gone
+            if self.args.fleet_devices:
+                self._pending = []
+                results['fleet_startup'] = self.fleetStartup(self.args.fleet_devices, self.args.fleet_interval,
+                                                             self.args.fleet_duration)
+        finally:
+            self.listen.close()
+            self.send.close()
+        return results
+
+def compare(results, baseline, tolerance):
+    """ Return a list of (test, metric, baseline, now) that got worse by more than tolerance %
+        Any rise in failed, any fall in received or heard_from, and a metric
+        the baseline had that is now None (nothing got through to time), is a
+        regression whatever the tolerance
+    """
+    regressions = []
+    for test, metrics in sorted(results.items()):
+        for metric, value in sorted(metrics.items()):
+            old = baseline.get(test, {}).get(metric)
+            if old is None or metric in _settings:
+                continue
+            if value is None:
+                regressions.append((test, metric, old, value))
+                continue
+            if metric == 'failed':
+                if value > old:
+                    regressions.append((test, metric, old, value))
+                continue
+            if metric in ('received', 'heard_from'):
+                if value < old:
+                    regressions.append((test, metric, old, value))
+                continue
+            if not old:
+                continue
+            if metric in _higherIsBetter:
+                change = (old - value) * 100.0 / old
+            else:
+                change = (value - old) * 100.0 / old
+            if change > tolerance:
+                regressions.append((test, metric, old, value))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Message Bridge end to end benchmark')
+    parser.add_argument('-c', '--count', type=int, default=500,
+                        help='Messages per serial/UDP test')
+    parser.add_argument('-r', '--rate', type=float, default=100,
+                        help='Messages per second for the latency tests')
+    parser.add_argument('--dcr-count', type=int, default=5,
+                        help='Number of DCR round trips, 0 to skip')
+    parser.add_argument('--configme-interval', type=float, default=0.5,
+                        help='Seconds between CONFIGME from the simulated device')
+    parser.add_argument('--fleet-devices', type=int, default=30,
+                        help='Devices in the fleet startup test, 0 to skip')
+    parser.add_argument('--fleet-interval', type=float, default=0.3,
+                        help='Seconds between readings from each fleet device')
+    parser.add_argument('--fleet-duration', type=float, default=10,
+                        help='Seconds to count fleet readings for once the bridge is running')
+    parser.add_argument('--settle', type=float, default=3,
+                        help='Seconds to wait for stragglers before giving up')
+    parser.add_argument('-o', '--output',
+                        help='Write the results JSON to this file as well as stdout')
+    parser.add_argument('-b', '--baseline',
+                        help='Results JSON from an earlier run to compare against')
+    parser.add_argument('-t', '--tolerance', type=float, default=10,
+                        help='Percent a metric may get worse before it counts as a regression')
+    parser.add_argument('--batch', action='store_true',
+                        help='Run the bridge with UDP batch_mode on')
+    parser.add_argument('--core', choices=['threaded', 'eventloop'], default='threaded',
+                        help='Message Bridge [Run] core to benchmark')
+    parser.add_argument('--python', default=sys.executable,
+                        help='Python used to run MessageBridge.py')
+    parser.add_argument('-d', '--debug', action='store_true',
+                        help='Run the bridge with --debug')
+    args = parser.parse_args()
+
+    results = Benchmark(args).run()
+    output = json.dumps(results, indent=4, sort_keys=True)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as outFile:
+            outFile.write(output + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as baseFile:
+            regressions = compare(results, json.load(baseFile), args.tolerance)
+        for (test, metric, old, new) in regressions:
+            sys.stderr.write("REGRESSION {} {}: {} -> {}\n".format(test, metric, old, new))
+        sys.exit(1 if regressions else 0)
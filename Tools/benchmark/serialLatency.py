@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Serial TX latency measurement
+
+    Measures the time from putting a Language of Things message on a
+    Radio's qSerialOut to the radio receiving it, for the serial thread of
+    the threaded core and the serial callbacks of the event loop core.
+
+    The real Radio serial engine is run against a sim:// transport, the
+    simulated radio reports every frame it receives so no hardware is needed
+
+    usage
+    $ python serialLatency.py
+    or
+    $ python serialLatency.py --count 200 --core eventloop
+
+    Copyright 2015 Ciseco Ltd.
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+"""
+import sys
+import os
+import random
+import threading
+import argparse
+import ConfigParser
+import Queue
+from time import time, sleep
+
+_bridgePath = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../MessageBridge')
+sys.path.insert(0, _bridgePath)
+import Radio
+import Settings
+import EventLoop
+import TXQueue
+
+LATENCY_ID = "SL"
+SIMULATOR_PORT = "sim://?devices=0"
+
+class RadioHost():
+    """ The parts of the MessageBridge a Radio uses, enough to run its
+        serial engine on its own with the default config
+    """
+
+    def __init__(self, pacing):
+        self.config = ConfigParser.SafeConfigParser()
+        self.config.read(os.path.join(_bridgePath, 'MessageBridge_defaults.cfg'))
+        self.config.set('TX', 'pacing', str(pacing))
+        self.args = argparse.Namespace(port=SIMULATOR_PORT, gpio=None, network=None)
+        self.settings = Settings.Settings(self.config)
+        self.debugLog = False
+        self.journal = None
+        self.qUDPSend = Queue.Queue()
+        self.tMainStop = threading.Event()
+
+    def registerNetwork(self, radio):
+        pass
+
+    def encodeWirelessMessageJson(self, message, network=None):
+        return (message, {'type': "WirelessMessage"})
+
+    def die(self):
+        print("Radio failed, stopping")
+        os._exit(1)
+
+class SerialEngine():
+    """ A Radio's serial side running on the given core
+    """
+
+    def __init__(self, core, pacing):
+        self.core = core
+        self.host = RadioHost(pacing)
+        self.radio = Radio.Radio(self.host, 'Serial')
+        self._loop = None
+        self._loopThread = None
+
+    def start(self):
+        """ Open the simulated radio, blocks while its AT settings are checked
+            Returns the RadioSimulator
+        """
+        if self.core == 'eventloop':
+            self._loop = EventLoop.EventLoop(threading.Event())
+            self.radio.initSerialLoop(self._loop)
+            self._loopThread = threading.Thread(target=self._loop.run)
+            self._loopThread.start()
+        else:
+            self.radio.initSerialThread()
+            self.radio.fNetworkNameSet.wait(60)
+        return self.radio._serial.simulator
+
+    def send(self, frame):
+        self.radio.qSerialOut.put_nowait(frame, TXQueue.TXScheduler.INTERACTIVE)
+
+    def stop(self):
+        if self._loop:
+            self._loop.callSoon(self.radio.stop)
+            self._loop.callSoon(self._loop.stop)
+            self._loopThread.join()
+        else:
+            self.radio.stop()
+        self.radio.qSerialOut.close()
+
+def measure(core, count, interval, pacing):
+    """ Run count messages through the serial engine of core and return
+        the latencies in ms
+    """
+    engine = SerialEngine(core, pacing)
+    simulator = engine.start()
+    arrived = {}
+    received = threading.Condition()
+
+    def onFrame(frame):
+        if frame[1:3] == LATENCY_ID:
+            with received:
+                arrived[frame[3:]] = time()
+                received.notify()
+
+    simulator.onFrame = onFrame
+    latencies = []
+    try:
+        # the first goes out once the port is past its AT checks
+        for seq in range(-1, count):
+            # messages arrive at random points relative to the serial loop
+            sleep(random.uniform(0, interval))
+            payload = "{:09d}".format(seq % 1000000000)
+            sent = time()
+            engine.send("a{}{}".format(LATENCY_ID, payload))
+            with received:
+                end = time() + 30
+                while payload not in arrived and time() < end:
+                    received.wait(end - time())
+            if payload not in arrived:
+                raise RuntimeError("{} never reached the radio".format(payload))
+            if seq >= 0:
+                latencies.append((arrived[payload] - sent) * 1000)
+    finally:
+        engine.stop()
+    return latencies
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serial TX latency measurement')
+    parser.add_argument('-c', '--count', type=int, default=100,
+                        help='Number of messages to send through each core')
+    parser.add_argument('-i', '--interval', type=float, default=0.1,
+                        help='Longest gap in seconds between messages')
+    parser.add_argument('--core', choices=['threaded', 'eventloop', 'both'], default='both',
+                        help='Serial engine to measure')
+    parser.add_argument('--no-pacing', dest='pacing', action='store_false',
+                        help='Turn off [TX] pacing so only the engine is measured')
+    args = parser.parse_args()
+
+    cores = ['threaded', 'eventloop'] if args.core == 'both' else [args.core]
+    for core in cores:
+        latencies = measure(core, args.count, args.interval, args.pacing)
+        print("{:<9} enqueue to radio ms: p50 {:8.3f} p99 {:8.3f} max {:8.3f}".format(
+              core, percentile(latencies, 50), percentile(latencies, 99), max(latencies)))